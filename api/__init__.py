@@ -1,4 +1,7 @@
-from .actor_resource import ActorQueryResource, ActorResource
-from .movie_resource import MovieQueryResource, MovieResource
+from .actor_resource import ActorQueryResource, ActorTopResource, ActorResource
+from .movie_resource import MovieQueryResource, MovieTopResource, MovieResource
+from .search_resource import SearchResource
+from .path_resource import PathResource
 
-__all__ = ["ActorQueryResource", "ActorResource", "MovieQueryResource", "MovieResource"]
+__all__ = ["ActorQueryResource", "ActorTopResource", "ActorResource", "MovieQueryResource", "MovieTopResource",
+           "MovieResource", "SearchResource", "PathResource"]
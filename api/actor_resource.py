@@ -1,40 +1,14 @@
 from flask_restful import Resource, abort
 from flask import request
 from database import db_session
-from sqlalchemy import and_, or_
-from model.graph import Actor, Edge, Movie, Graph
-from .util import parse_query
+from model.graph import Actor
+from model.graph.graph import RELATED_NODES
+from .util import parse_query, parse_options, parse_fields, parse_top_size, paginate, get_page_query, graph
+from .cache import response_cache
+from .planner import planner
 
-GROSS_RANGE = 5000
-graph = Graph(db_session)
-
-
-def generate_query(queries):
-    """
-    A helper method to get the actor query from queries
-    :param queries: the list of dictionary containing queries to filter query
-    :return: query corresponding to queries
-    """
-    filters = []
-    for query in queries:
-        query_filter = []
-        # check each field
-        if "name" in query:
-            query_filter.append(Actor.name.contains(query.get("name")))
-        if "age" in query:
-            query_filter.append(Actor.age == int(query.get("age")))
-        if "wiki_page" in query:
-            query_filter.append(Actor.wiki_page.contains(query.get("name")))
-        if "total_gross" in query:
-            gross = float(query.get("total_gross"))
-            query_filter.append(and_(Actor.total_gross >= gross - GROSS_RANGE,
-                                     Actor.total_gross <= gross + GROSS_RANGE))
-        if "movie" in query or "movies" in query:
-            movie_list = [query.get("movie")] if "movie" in query else query.get("movies").split(',')
-            query_filter.append(and_(*[Actor.movies.any(Edge.movie.has(Movie.name.contains(movie_name.strip())))
-                                       for movie_name in movie_list]))
-        filters.append(and_(*query_filter))
-    return or_(*filters)
+# fields that can be used to sort the query results
+SORT_FIELDS = ("id", "name", "age", "total_gross")
 
 
 class ActorQueryResource(Resource):
@@ -45,10 +19,23 @@ class ActorQueryResource(Resource):
     """
 
     @staticmethod
+    @response_cache.cached
     def get():
         try:
             queries = parse_query(request.query_string.decode("utf-8"))
-            return [actor.to_dict() for actor in Actor.query.filter(generate_query(queries)).all()]
+            options = parse_options(queries)
+            fields = parse_fields(options)
+            plan = planner.plan(Actor, queries)
+            query = Actor.query if plan.filter is None else Actor.query.filter(plan.filter)
+            if fields is None or "movies" in fields:
+                query = query.options(RELATED_NODES[Actor])
+            if options.get("explain") == "1":
+                page, limit, _ = get_page_query(query, Actor, options, SORT_FIELDS)
+                return plan.explain(db_session, page, lambda: page.all()[:limit])
+            actors, cursor = paginate(query, Actor, options, SORT_FIELDS)
+            # the cursor is given as "after" to get the next page
+            headers = {"X-Next-Cursor": cursor} if cursor else {}
+            return [actor.to_dict(fields) for actor in actors], 200, headers
         except ValueError:
             abort(400, message="Cannot parse the query")
 
@@ -59,9 +46,29 @@ class ActorQueryResource(Resource):
             abort(400, message="Incorrect mimetype or invalid json")
         else:
             graph.add_actor(changes, external=True)
+            response_cache.clear()
             return changes, 201
 
 
+class ActorTopResource(Resource):
+    """
+    The Flask-Restful Resource class used for creating
+    API for the leaderboard of actors (by=total_gross or by=age, n=number of actors)
+    Operates on: {API_ROOT}/actors/top
+    """
+
+    @staticmethod
+    @response_cache.cached
+    def get():
+        try:
+            fields = parse_fields(request.args)
+            actors = graph.get_top_actors(request.args.get("by", "total_gross"), parse_top_size(request.args),
+                                          related=fields is None or "movies" in fields)
+            return [actor.to_dict(fields) for actor in actors]
+        except ValueError:
+            abort(400, message="Cannot parse the query")
+
+
 class ActorResource(Resource):
     """
     The Flask-Restful Resource class used for creating
@@ -70,6 +77,7 @@ class ActorResource(Resource):
     """
 
     @staticmethod
+    @response_cache.cached
     def get(name):
         name = name.replace("_", " ")
         actor = graph.get_actor(name)
@@ -90,6 +98,7 @@ class ActorResource(Resource):
                 abort(400, message="Incorrect mimetype or invalid json")
             else:
                 graph.add_actor(changes, external=True, actor=actor)
+                response_cache.clear()
                 return actor.to_dict(), 201
 
     @staticmethod
@@ -100,3 +109,4 @@ class ActorResource(Resource):
             abort(404, message="Actor {} doesn't exist".format(name))
         else:
             graph.delete_actor(actor)
+            response_cache.clear()
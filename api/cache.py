@@ -0,0 +1,76 @@
+from functools import wraps
+from hashlib import sha1
+from urllib.parse import unquote
+from flask import request, current_app
+from flask_restful.utils import unpack
+from flask_restful.representations.json import output_json
+from model.graph.util import LRUCache
+from config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL
+import time
+
+
+class ResponseCache:
+    """
+    In-memory cache of the responses to GET requests, keyed by URL. Responses carry a strong
+    ETag, so clients sending it back in If-None-Match get a 304 if the response is unchanged
+    """
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        """
+        Create an empty cache
+        :param maxsize: the maximum number of responses to keep
+        :param ttl: the time, in seconds, a response is kept
+        """
+        self.cache = LRUCache(maxsize)
+        self.ttl = ttl
+
+    @staticmethod
+    def get_key():
+        """
+        Get the cache key of the current request. Names in the path are case insensitive
+        and "_" stands for " ", so they are normalized, and so is the order of the arguments
+        (the parts of a query separated by "|" are united, and their arguments are combined)
+        :return: the key of the request
+        """
+        path = unquote(request.path).replace("_", " ").lower()
+        parts = request.query_string.decode("utf-8").split('|')
+        return path, '|'.join(sorted('&'.join(sorted(part.split('&'))) for part in parts))
+
+    def cached(self, function):
+        """
+        Decorator for the GET handlers whose response should be cached
+        :param function: the handler
+        :return: the decorated handler
+        """
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            # the timings of explain=1 are measured again every time
+            if request.args.get("explain") == "1":
+                return function(*args, **kwargs)
+            key = self.get_key()
+            entry = self.cache.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                data, code, headers = unpack(function(*args, **kwargs))
+                response = output_json(data, code, headers)
+                if code != 200:
+                    return response
+                body = response.get_data()
+                entry = (time.time(), body, dict(response.headers), sha1(body).hexdigest())
+                self.cache.put(key, entry)
+
+            _, body, headers, etag = entry
+            response = current_app.response_class(body, 200, headers)
+            response.set_etag(etag)
+            # answer 304 if the client already has this version
+            return response.make_conditional(request)
+
+        return wrapper
+
+    def clear(self):
+        """
+        Remove all cached responses, called after any change to the graph
+        """
+        self.cache.clear()
+
+
+response_cache = ResponseCache()
@@ -1,41 +1,14 @@
 from flask_restful import Resource, abort
 from flask import request
-from sqlalchemy import and_, or_, extract
 from database import db_session
-from model.graph import Actor, Edge, Movie, Graph
-from .util import parse_query
+from model.graph import Movie
+from model.graph.graph import RELATED_NODES
+from .util import parse_query, parse_options, parse_fields, parse_top_size, paginate, get_page_query, graph
+from .cache import response_cache
+from .planner import planner
 
-BOX_OFFICE_RANGE = 5000
-graph = Graph(db_session)
-
-
-def generate_query(queries):
-    """
-    A helper method to get the actor query from queries
-    :param queries: the list of dictionary containing queries to filter query
-    :return: query corresponding to queries
-    """
-    filters = []
-    for query in queries:
-        query_filter = []
-        # check each field
-        if "name" in query:
-            query_filter.append(Movie.name.contains(query.get("name")))
-        if "year" in query:
-            year = int(query.get("year"))
-            query_filter.append(extract('year', Movie.release_date) == year)
-        if "wiki_page" in query:
-            query_filter.append(Movie.wiki_page.contains(query.get("name")))
-        if "box_office" in query:
-            gross = float(query.get("total_gross"))
-            query_filter.append(and_(Movie.box_office >= gross - BOX_OFFICE_RANGE,
-                                     Movie.box_office <= gross + BOX_OFFICE_RANGE))
-        if "actor" in query or "actors" in query:
-            actor_list = [query.get("actor")] if "actor" in query else query.get("actors").split(',')
-            query_filter.append(and_(*[Movie.actors.any(Edge.actor.has(Actor.name.contains(actor_name.strip())))
-                                       for actor_name in actor_list]))
-        filters.append(and_(*query_filter))
-    return or_(*filters)
+# fields that can be used to sort the query results
+SORT_FIELDS = ("id", "name", "box_office", "release_year")
 
 
 class MovieQueryResource(Resource):
@@ -46,10 +19,23 @@ class MovieQueryResource(Resource):
     """
 
     @staticmethod
+    @response_cache.cached
     def get():
         try:
             queries = parse_query(request.query_string.decode("utf-8"))
-            return [movie.to_dict() for movie in Movie.query.filter(generate_query(queries)).all()]
+            options = parse_options(queries)
+            fields = parse_fields(options)
+            plan = planner.plan(Movie, queries)
+            query = Movie.query if plan.filter is None else Movie.query.filter(plan.filter)
+            if fields is None or "actors" in fields:
+                query = query.options(RELATED_NODES[Movie])
+            if options.get("explain") == "1":
+                page, limit, _ = get_page_query(query, Movie, options, SORT_FIELDS)
+                return plan.explain(db_session, page, lambda: page.all()[:limit])
+            movies, cursor = paginate(query, Movie, options, SORT_FIELDS)
+            # the cursor is given as "after" to get the next page
+            headers = {"X-Next-Cursor": cursor} if cursor else {}
+            return [movie.to_dict(fields) for movie in movies], 200, headers
         except ValueError:
             abort(400, message="Cannot parse the query")
 
@@ -60,9 +46,30 @@ class MovieQueryResource(Resource):
             abort(400, message="Incorrect mimetype or invalid json")
         else:
             graph.add_movie(changes, external=True)
+            response_cache.clear()
             return changes, 201
 
 
+class MovieTopResource(Resource):
+    """
+    The Flask-Restful Resource class used for creating
+    API for the leaderboard of movies (by=box_office, n=number of movies, year=release year)
+    Operates on: {API_ROOT}/movies/top
+    """
+
+    @staticmethod
+    @response_cache.cached
+    def get():
+        try:
+            fields = parse_fields(request.args)
+            year = int(request.args["year"]) if "year" in request.args else None
+            movies = graph.get_top_movies(request.args.get("by", "box_office"), parse_top_size(request.args), year,
+                                          related=fields is None or "actors" in fields)
+            return [movie.to_dict(fields) for movie in movies]
+        except ValueError:
+            abort(400, message="Cannot parse the query")
+
+
 class MovieResource(Resource):
     """
     The Flask-Restful Resource class used for creating
@@ -71,6 +78,7 @@ class MovieResource(Resource):
     """
 
     @staticmethod
+    @response_cache.cached
     def get(name):
         name = name.replace("_", " ")
         movie = graph.get_movie(name)
@@ -91,6 +99,7 @@ class MovieResource(Resource):
                 abort(400, message="Incorrect mimetype or invalid json")
             else:
                 graph.add_movie(changes, external=True, movie=movie)
+                response_cache.clear()
                 return movie.to_dict(), 201
 
     @staticmethod
@@ -101,3 +110,4 @@ class MovieResource(Resource):
             abort(404, message="Movie {} doesn't exist".format(name))
         else:
             graph.delete_movie(movie)
+            response_cache.clear()
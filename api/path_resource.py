@@ -0,0 +1,43 @@
+from flask_restful import Resource, abort
+from flask import request
+from config import PATH_MAX_DEPTH
+from .util import graph
+from .cache import response_cache
+
+# fields of the actors and movies along the path
+PATH_FIELDS = ("id", "name", "wiki_page")
+
+
+class PathResource(Resource):
+    """
+    The Flask-Restful Resource class used for creating
+    API for the shortest chain of co-stars between two actors
+    (from=name of an actor, to=name of an actor, depth=maximum number of movies in the chain)
+    Operates on: {API_ROOT}/path
+    """
+
+    @staticmethod
+    @response_cache.cached
+    def get():
+        names = [request.args.get(key, "").strip().replace("_", " ") for key in ("from", "to")]
+        if not all(names):
+            abort(400, message="Missing the actors to link")
+        try:
+            depth = int(request.args.get("depth", PATH_MAX_DEPTH))
+        except ValueError:
+            abort(400, message="Cannot parse the query")
+        if not 0 < depth <= PATH_MAX_DEPTH:
+            abort(400, message="depth must be between 1 and {}".format(PATH_MAX_DEPTH))
+
+        actors = [graph.get_actor(name) for name in names]
+        for name, actor in zip(names, actors):
+            if actor is None:
+                abort(404, message="Actor {} doesn't exist".format(name))
+        path = graph.shortest_path(actors[0], actors[1], depth)
+        if path is None:
+            abort(404, message="{} and {} are more than {} movies apart".format(names[0], names[1], depth))
+        return {
+            "degrees": len(path) // 2,
+            "path": [dict(node.to_dict(PATH_FIELDS), type="movie" if position % 2 else "actor")
+                     for position, node in enumerate(path)],
+        }
@@ -0,0 +1,258 @@
+from sqlalchemy import select, and_, intersect, union, bindparam, text, literal_column, Float
+from sqlalchemy.dialects import sqlite
+from model.graph import Actor, Movie, Edge
+from model.graph.search import search_ids, get_search_parameter, uses_search_index
+from model.graph.util import LRUCache
+import time
+
+# the range of the total gross and box office filters, around the given value
+GROSS_RANGE = 5000
+BOX_OFFICE_RANGE = 5000
+
+# number of compiled statements kept, one for each shape of query
+PLAN_CACHE_SIZE = 256
+
+# the keys of the query string filtering the actors and movies: key -> (condition, parser).
+# The list keys give a condition for each of their comma separated values
+KEYS = {
+    Actor: {
+        "name": ("name", str),
+        "age": ("age", int),
+        "wiki_page": ("wiki_page", str),
+        "total_gross": ("total_gross", float),
+        "movie": ("movie", str),
+        "movies": ("movie", list),
+    },
+    Movie: {
+        "name": ("name", str),
+        "year": ("release_year", int),
+        "wiki_page": ("wiki_page", str),
+        "box_office": ("box_office", float),
+        "actor": ("actor", str),
+        "actors": ("actor", list),
+    },
+}
+
+# the conditions on the names of the linked nodes: condition -> (class of the linked nodes,
+# edge column of the linked nodes, edge column of the filtered nodes)
+LINKS = {
+    "movie": (Movie, Edge.movie_id, Edge.actor_id),
+    "actor": (Actor, Edge.actor_id, Edge.movie_id),
+}
+
+# the conditions matching a value in a range around the given value
+RANGES = {"total_gross": GROSS_RANGE, "box_office": BOX_OFFICE_RANGE}
+
+# the statements are compiled with named parameters, which text() binds by name
+DIALECT = sqlite.dialect(paramstyle="named")
+
+
+class Plan:
+    """
+    A compiled query: the SQL selecting the ids of the matching nodes, shared by all the
+    queries of the same shape, and the values of its parameters
+    """
+
+    def __init__(self, cls, clauses, sql, cached):
+        """
+        Create the plan
+        :param cls: the class of the nodes, Actor or Movie
+        :param clauses: the normalized clauses, list of lists of (condition, value)
+        :param sql: the compiled SQL, or None if the query matches all nodes
+        :param cached: whether the SQL was compiled for an earlier query
+        """
+        self.cls = cls
+        self.clauses = clauses
+        self.sql = sql
+        self.cached = cached
+        self.parameters = {"p{}".format(index): get_parameter(condition, value)
+                           for index, (condition, value) in enumerate(get_conditions(clauses))}
+
+    @property
+    def filter(self):
+        """
+        :return: the filter selecting the matching nodes, or None if the query matches all nodes
+        """
+        if self.sql is None:
+            return None
+        return text("{}.id IN ({})".format(self.cls.__tablename__, self.sql)).bindparams(**self.parameters)
+
+    def describe(self):
+        """
+        Describe the plan for explain=1
+        :return: list of the clauses (which are united), each a list of its conditions
+        """
+        descriptions = []
+        for clause in self.clauses:
+            conditions = []
+            for condition, value in clause:
+                if condition in LINKS:
+                    method = "edge INTERSECT, {}".format("search index" if uses_search_index(value) else "LIKE")
+                    conditions.append("{} contains {!r} ({})".format(condition, value, method))
+                elif condition == "name":
+                    method = "search index" if uses_search_index(value) else "LIKE"
+                    conditions.append("name contains {!r} ({})".format(value, method))
+                elif condition == "wiki_page":
+                    conditions.append("wiki_page contains {!r}".format(value))
+                elif condition in RANGES:
+                    conditions.append("{} within {} of {}".format(condition, RANGES[condition], value))
+                else:
+                    conditions.append("{} = {!r}".format(condition, value))
+            descriptions.append(conditions)
+        return descriptions
+
+    def explain(self, session, query, run):
+        """
+        Run a query using the plan, and report how it is run
+        :param session: the session the query runs in
+        :param query: the final query (filtered by the plan, sorted and limited to the page)
+        :param run: function running the query, returning the list of results
+        :return: dictionary of the plan, the SQL of the query and its parameters, the query plan of SQLite,
+         the time and the number of results
+        """
+        start = time.perf_counter()
+        results = run()
+        elapsed = time.perf_counter() - start
+
+        compiled = query.statement.compile(dialect=session.bind.dialect)
+        parameters = [compiled.params[name] for name in compiled.positiontup]
+        sqlite_plan = session.connection().execute("EXPLAIN QUERY PLAN " + str(compiled), *parameters).fetchall()
+        return {
+            "plan": self.describe(),
+            "sql": str(compiled),
+            "parameters": parameters,
+            "cached": self.cached,
+            "query_plan": [row[-1] for row in sqlite_plan],
+            "time_ms": elapsed * 1000,
+            "count": len(results),
+        }
+
+
+def parse_clauses(cls, queries):
+    """
+    Turn the parsed query (OR of ANDs) into clauses of conditions. Duplicated conditions and
+    clauses are dropped, and so are the clauses implied by a clause with fewer conditions
+    (A or (A and B) is A). Unknown keys are ignored
+    :param cls: the class of the nodes, Actor or Movie
+    :param queries: the list of dictionaries returned by parse_query, without the options
+    :return: list of the clauses, each a sorted list of (condition, value), or None if all
+     the nodes match
+    """
+    clauses = set()
+    for query in queries:
+        conditions = set()
+        for key, value in query.items():
+            if key not in KEYS[cls]:
+                continue
+            condition, parser = KEYS[cls][key]
+            if parser is list:
+                conditions.update((condition, name.strip()) for name in value.split(',') if name.strip())
+            else:
+                conditions.add((condition, parser(value)))
+        clauses.add(frozenset(conditions))
+    if not clauses or frozenset() in clauses:
+        return None
+
+    kept = []
+    for clause in sorted(clauses, key=len):
+        if not any(other <= clause for other in kept):
+            kept.append(clause)
+    # the same conditions in another order give the same shape
+    return sorted((sorted(clause, key=repr) for clause in kept), key=repr)
+
+
+def get_conditions(clauses):
+    """
+    :return: iterable of all the (condition, value) of the clauses, in the order of their parameters
+    """
+    return (condition for clause in clauses or () for condition in clause)
+
+
+def get_parameter(condition, value):
+    """
+    Get the value of the parameter of a condition
+    """
+    if condition == "name" or condition in LINKS:
+        return get_search_parameter(value)
+    return value
+
+
+def get_shape(cls, clauses):
+    """
+    Get the shape of a query, i.e. what its SQL depends on: the conditions of its clauses,
+    and whether the names are looked up in the search index
+    :return: the key of the compiled SQL in the cache
+    """
+    def get_method(condition, value):
+        return uses_search_index(value) if condition == "name" or condition in LINKS else None
+
+    return cls, tuple(tuple((condition, get_method(condition, value)) for condition, value in clause)
+                      for clause in clauses)
+
+
+def compile_clauses(cls, clauses):
+    """
+    Compile the clauses to the SQL selecting the ids of the matching nodes: each clause
+    selects the nodes matching its conditions on their columns, and whose ids are in the
+    INTERSECT of the ids matching its conditions on names, and the clauses are united
+    :param cls: the class of the nodes, Actor or Movie
+    :param clauses: the clauses returned by parse_clauses
+    :return: the SQL, with a named parameter p<n> for each condition
+    """
+    statements = []
+    index = 0
+    for clause in clauses:
+        filters = []
+        id_sets = []
+        for condition, value in clause:
+            key = "p{}".format(index)
+            index += 1
+            if condition in LINKS:
+                linked_cls, linked_column, node_column = LINKS[condition]
+                id_sets.append(select([node_column]).where(linked_column.in_(search_ids(linked_cls, value, key))))
+            elif condition == "name":
+                id_sets.append(search_ids(cls, value, key))
+            elif condition == "wiki_page":
+                filters.append(cls.wiki_page.contains(bindparam(key)))
+            elif condition in RANGES:
+                # (the constants are written in the SQL, which only has the parameters of the conditions)
+                parameter, width = bindparam(key, type_=Float), literal_column(str(RANGES[condition]))
+                filters.append(getattr(cls, condition).between(parameter - width, parameter + width))
+            else:
+                filters.append(getattr(cls, condition) == bindparam(key))
+        if id_sets:
+            filters.append(cls.id.in_(intersect(*id_sets) if len(id_sets) > 1 else id_sets[0]))
+        statements.append(select([cls.id]).where(and_(*filters)))
+    statement = union(*statements) if len(statements) > 1 else statements[0]
+    return str(statement.compile(dialect=DIALECT))
+
+
+class QueryPlanner:
+    """
+    Compiler of the query language of the API (a=1&b=2|c=3) to SQL, caching the compiled SQL
+    for each shape of query
+    """
+
+    def __init__(self, maxsize=PLAN_CACHE_SIZE):
+        self.cache = LRUCache(maxsize)
+
+    def plan(self, cls, queries):
+        """
+        Compile a query
+        :param cls: the class of the nodes, Actor or Movie
+        :param queries: the list of dictionaries returned by parse_query, without the options
+        :return: the Plan, raise ValueError if a value cannot be parsed
+        """
+        clauses = parse_clauses(cls, queries)
+        if clauses is None:
+            return Plan(cls, [], None, False)
+        shape = get_shape(cls, clauses)
+        sql = self.cache.get(shape)
+        cached = sql is not None
+        if not cached:
+            sql = compile_clauses(cls, clauses)
+            self.cache.put(shape, sql)
+        return Plan(cls, clauses, sql, cached)
+
+
+planner = QueryPlanner()
@@ -0,0 +1,32 @@
+from flask_restful import Resource, abort
+from flask import request
+from model.graph import Actor, Movie
+from .util import parse_top_size, graph
+from .cache import response_cache
+
+# fields of the actors and movies returned by the search
+SEARCH_FIELDS = ("id", "name", "wiki_page")
+
+
+class SearchResource(Resource):
+    """
+    The Flask-Restful Resource class used for creating
+    API for searching actors and movies by name, for autocompletion
+    (q=the string to search, n=number of actors and of movies)
+    Operates on: {API_ROOT}/search
+    """
+
+    @staticmethod
+    @response_cache.cached
+    def get():
+        value = request.args.get("q", "").strip()
+        if not value:
+            abort(400, message="Missing the string to search")
+        try:
+            n = parse_top_size(request.args)
+        except ValueError:
+            abort(400, message="Cannot parse the query")
+        return {
+            "actors": [actor.to_dict(SEARCH_FIELDS) for actor in graph.search(Actor, value, n)],
+            "movies": [movie.to_dict(SEARCH_FIELDS) for movie in graph.search(Movie, value, n)],
+        }
@@ -1,4 +1,19 @@
 from urllib.parse import unquote
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from sqlalchemy import and_, or_
+from database import db_session
+from model.graph import Graph
+import json
+
+# number of results returned when no limit is given, and the maximum limit allowed
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# number of results of the leaderboards when n is not given
+DEFAULT_TOP_SIZE = 10
+
+# keys in the query string that are options instead of filters
+OPTIONS = ("limit", "after", "fields", "sort", "explain")
 
 
 def decode(string):
@@ -30,3 +45,127 @@ def parse_query(query_string):
             query_dict[decode(pair[0])] = decode(pair[1])
         result.append(query_dict)
     return result
+
+
+def parse_options(queries):
+    """
+    Remove the options from the parsed query. The options apply to the whole query, and
+    can be given in any of its parts
+    :param queries: the list of dictionary returned by parse_query, modified in place
+    :return: a dictionary of the options
+    """
+    options = {}
+    for query in queries:
+        for key in OPTIONS:
+            if key in query:
+                options[key] = query.pop(key)
+    # a part containing only options does not filter anything
+    queries[:] = [query for query in queries if query]
+    return options
+
+
+def parse_fields(options):
+    """
+    Get the list of fields to return from the options
+    :param options: the dictionary of options
+    :return: the list of fields, or None to return all fields
+    """
+    if "fields" not in options:
+        return None
+    return [field.strip() for field in options["fields"].split(',') if field.strip()]
+
+
+def parse_top_size(args):
+    """
+    Get the number of results of a leaderboard from the query string
+    :param args: the arguments of the query string
+    :return: the number of results, raise ValueError if it is not a positive number
+    """
+    n = int(args.get("n", DEFAULT_TOP_SIZE))
+    if n <= 0:
+        raise ValueError("n must be positive")
+    return min(n, MAX_PAGE_SIZE)
+
+
+def encode_cursor(value, node_id):
+    """
+    Encode the position after a row as an opaque string
+    :param value: value of the sorting field of the row
+    :param node_id: id of the row
+    :return: the cursor string
+    """
+    # the padding is removed since "=" separates keys and values in the query
+    return urlsafe_b64encode(json.dumps([value, node_id]).encode("utf-8")).decode("ascii").rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode the cursor returned by encode_cursor, raise ValueError if the cursor is invalid
+    :param cursor: the cursor string
+    :return: (value, id) of the row
+    """
+    cursor = cursor.encode("ascii")
+    decoded = json.loads(urlsafe_b64decode(cursor + b'=' * (-len(cursor) % 4)).decode("utf-8"))
+    if not isinstance(decoded, list) or len(decoded) != 2 or not isinstance(decoded[1], int):
+        raise ValueError("invalid cursor")
+    return decoded
+
+
+def paginate(query, cls, options, sort_fields):
+    """
+    Sort the query and get a page of result. The next page starts after the last row of
+    this page (keyset pagination), so the pages are consistent even if rows are added
+    :param query: the query to paginate
+    :param cls: the class queried, Actor or Movie
+    :param options: the dictionary of options, using limit, after and sort
+    :param sort_fields: the fields that can be used to sort
+    :return: (list of objects, cursor of the next page or None if this is the last page)
+    """
+    query, limit, field = get_page_query(query, cls, options, sort_fields)
+    rows = query.all()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], encode_cursor(getattr(rows[limit - 1], field), rows[limit - 1].id)
+
+
+def get_page_query(query, cls, options, sort_fields):
+    """
+    Sort the query and restrict it to a page (see paginate). One more row than the page size
+    is selected, to know whether there is a next page
+    :param query: the query to paginate
+    :param cls: the class queried, Actor or Movie
+    :param options: the dictionary of options, using limit, after and sort
+    :param sort_fields: the fields that can be used to sort
+    :return: (the query of the page, the page size, the field the page is sorted by)
+    """
+    limit = int(options.get("limit", DEFAULT_PAGE_SIZE))
+    if limit <= 0:
+        raise ValueError("limit must be positive")
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    # sort=field for ascending order, sort=-field for descending order
+    sort = options.get("sort", "id")
+    descending = sort.startswith('-')
+    field = sort.lstrip('-')
+    if field not in sort_fields:
+        raise ValueError("cannot sort by {}".format(field))
+    column = getattr(cls, field)
+
+    if "after" in options:
+        value, last_id = decode_cursor(options["after"])
+        # null values come first in ascending order, and last in descending order
+        if descending and value is None:
+            query = query.filter(and_(column.is_(None), cls.id < last_id))
+        elif descending:
+            query = query.filter(or_(column < value, and_(column == value, cls.id < last_id), column.is_(None)))
+        elif value is None:
+            query = query.filter(or_(and_(column.is_(None), cls.id > last_id), column.isnot(None)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, cls.id > last_id)))
+
+    order = (column.desc(), cls.id.desc()) if descending else (column, cls.id)
+    return query.order_by(*order).limit(limit + 1), limit, field
+
+
+# the graph shared by all resources, so that they see the same lookup cache
+graph = Graph(db_session)
@@ -0,0 +1,65 @@
+"""
+Show the query plans and timings of the hot lookup queries on a synthetic graph
+
+usage: python -m benchmark.query_plan [number of movies]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+# run on an in-memory database
+os.environ["UNITTEST"] = "1"
+
+from database import engine, init_db  # noqa: E402
+from model.graph import Actor, Movie, Edge  # noqa: E402
+
+QUERIES = [
+    ("actor by name", "SELECT id FROM actor WHERE name = 'Actor 500'"),
+    ("actor by name, case insensitive", "SELECT id FROM actor WHERE lower(name) = lower('actor 500')"),
+    ("movie by name, case insensitive", "SELECT id FROM movie WHERE lower(name) = lower('movie 500')"),
+    ("movies of an actor", "SELECT movie_id FROM edge WHERE actor_id = 500"),
+    ("movies by year", "SELECT id FROM movie WHERE release_year = 2000"),
+    ("actors by year", "SELECT DISTINCT actor.id FROM actor JOIN edge ON actor.id = edge.actor_id "
+                       "JOIN movie ON movie.id = edge.movie_id WHERE movie.release_year = 2000"),
+    ("actor by name substring, LIKE", "SELECT id FROM actor WHERE name LIKE '%ctor 1234%'"),
+    ("actor by name substring, search", "SELECT rowid FROM actor_search WHERE actor_search MATCH '\"ctor 1234\"'"),
+    ("top actors by total gross", "SELECT id FROM actor ORDER BY total_gross DESC, id DESC LIMIT 10"),
+    ("top movies of a year", "SELECT id FROM movie WHERE release_year = 2000 "
+                             "ORDER BY box_office DESC, id DESC LIMIT 10"),
+]
+
+
+def populate(movie_count, actors_per_movie=5):
+    """
+    Fill the database with movie_count movies, each starring actors_per_movie actors
+    """
+    actor_count = movie_count
+    engine.execute(Actor.__table__.insert(), [
+        {"id": i, "name": "Actor {}".format(i), "wiki_page": "/wiki/Actor_{}".format(i), "age": i % 90,
+         "total_gross": i} for i in range(1, actor_count + 1)])
+    engine.execute(Movie.__table__.insert(), [
+        {"id": i, "name": "Movie {}".format(i), "wiki_page": "/wiki/Movie_{}".format(i), "box_office": i,
+         "release_date": datetime(1950 + i % 70, 1, 1), "release_year": 1950 + i % 70}
+        for i in range(1, movie_count + 1)])
+    engine.execute(Edge.__table__.insert(), [
+        {"movie_id": i, "actor_id": (i * 7 + j * 13) % actor_count + 1, "income": 1}
+        for i in range(1, movie_count + 1) for j in range(actors_per_movie)])
+
+
+def main():
+    movie_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    init_db()
+    populate(movie_count)
+
+    for title, query in QUERIES:
+        plan = [row[-1] for row in engine.execute("EXPLAIN QUERY PLAN " + query)]
+        start = time.perf_counter()
+        for _ in range(100):
+            engine.execute(query).fetchall()
+        elapsed = (time.perf_counter() - start) / 100
+        print("{:<35} {:>9.3f} ms  {}".format(title, elapsed * 1000, "; ".join(plan)))
+
+
+if __name__ == "__main__":
+    main()
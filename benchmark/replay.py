@@ -0,0 +1,103 @@
+"""
+Measure the end-to-end throughput of the crawler (parse -> pipeline -> database) by
+replaying a page store, without touching the network
+
+usage: python -m benchmark.replay [page store directory] [start path]
+       python -m benchmark.replay --synthetic [number of movies]
+"""
+import os
+import sys
+import tempfile
+import time
+
+# write to an in-memory database
+os.environ["UNITTEST"] = "1"
+
+import config  # noqa: E402
+
+ACTOR_PAGE = """<html><body><h1 id="firstHeading">{name}</h1><div id="mw-content-text">
+<table class="infobox biography vcard">
+<tr><th>Born</th><td>1950<span class="noprint ForceAgeToShow"> (age&#160;{age})</span></td></tr>
+</table>
+<p>{name} is an actor.</p>
+<h2><span class="mw-headline" id="Filmography">Filmography</span></h2>
+<ul>{movies}</ul>
+<h2><span class="mw-headline" id="References">References</span></h2>
+</div></body></html>"""
+
+MOVIE_PAGE = """<html><body><h1 id="firstHeading">{name} (film)</h1><div id="mw-content-text">
+<table class="infobox vevent">
+<tr><th>Starring</th><td><div class="plainlist"><ul>{actors}</ul></div></td></tr>
+<tr><th>Release date</th><td><span class="bday dtstart published updated">{year}-01-01</span></td></tr>
+<tr><th>Box office</th><td>${box_office} million</td></tr>
+</table>
+<p>{name} is a film.</p>
+</div></body></html>"""
+
+LINK = '<li><a href="{}">{}</a></li>'
+
+
+def generate(store, movie_count, actors_per_movie=5):
+    """
+    Fill the page store with a synthetic graph of movie_count movies, each starring
+    actors_per_movie actors. The crawl starts from /wiki/Actor_0
+    """
+    actor_count = movie_count
+    movies_of_actor = {i: [] for i in range(actor_count)}
+    for movie in range(movie_count):
+        actors = [(movie * 7 + k * 13) % actor_count for k in range(actors_per_movie)]
+        for actor in actors:
+            movies_of_actor[actor].append(movie)
+        store.put("/wiki/Movie_{}".format(movie), MOVIE_PAGE.format(
+            name="Movie {}".format(movie), year=1950 + movie % 70, box_office=movie % 500 + 1,
+            actors="".join(LINK.format("/wiki/Actor_{}".format(a), "Actor {}".format(a)) for a in actors))
+            .encode("utf-8"))
+    for actor, movies in movies_of_actor.items():
+        store.put("/wiki/Actor_{}".format(actor), ACTOR_PAGE.format(
+            name="Actor {}".format(actor), age=20 + actor % 60,
+            movies="".join(LINK.format("/wiki/Movie_{}".format(m), "Movie {}".format(m)) for m in movies))
+            .encode("utf-8"))
+
+
+def main():
+    synthetic = len(sys.argv) > 1 and sys.argv[1] == "--synthetic"
+    directory = tempfile.mkdtemp() if synthetic else sys.argv[1] if len(sys.argv) > 1 else config.PAGE_STORE_DIR
+
+    # the crawler reads the configuration as it is imported
+    config.CRAWL_MODE = "replay"
+    config.PAGE_STORE_DIR = directory
+    config.START_IS_MOVIE = config.START_IS_FILMOGRAPHY = False
+    config.RESUME = False
+    config.JSON_OUTPUT_FILE = None
+    if synthetic:
+        config.START_URL = "/wiki/Actor_0"
+    elif len(sys.argv) > 2:
+        config.START_URL = sys.argv[2]
+
+    from scrapy.crawler import CrawlerProcess
+    from database import init_db
+    from model.crawler.store import PageStore
+    from model.crawler import Spider
+
+    if synthetic:
+        generate(PageStore(directory), int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+
+    init_db()
+    process = CrawlerProcess({"LOG_LEVEL": "WARNING"})
+    crawler = process.create_crawler(Spider)
+    process.crawl(crawler)
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    stats = crawler.stats.get_stats()
+    pages = stats.get("page_store/hit", 0)
+    items = stats.get("item_scraped_count", 0)
+    print("replayed {} pages from {} ({} missing) in {:.2f}s".format(
+        pages, directory, stats.get("page_store/miss", 0), elapsed))
+    print("{:.1f} pages/sec, {:.1f} items/sec (parser: {}, processes: {})".format(
+        pages / elapsed, items / elapsed, config.PARSER, config.PARSE_PROCESSES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+from argparse import ArgumentParser
+from database import db_session, init_db
+from model.graph import Graph
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Check that the total gross of the actors is the sum of the income "
+                                        "of their edges")
+    parser.add_argument("--fix", action="store_true", help="recompute the total gross of the drifting actors")
+    parser.add_argument("--all", action="store_true", help="recompute the total gross of all the actors")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="difference, in dollars, reported as drift")
+    args = parser.parse_args()
+
+    init_db()
+    graph = Graph(db_session)
+    if args.all:
+        print("Recomputed the total gross of {} actors".format(graph.recompute_total_gross()))
+    else:
+        drift = graph.get_gross_drift(args.tolerance)
+        for actor_id, total_gross, income in drift[:20]:
+            print("actor {}: total gross {} instead of {}".format(actor_id, total_gross, income))
+        print("{} actors drifted".format(len(drift)))
+        if args.fix and drift:
+            count = graph.recompute_total_gross([actor_id for actor_id, _, _ in drift])
+            print("Recomputed the total gross of {} actors".format(count))
@@ -7,15 +7,40 @@ START_URL = "/wiki/Morgan_Freeman"
 START_IS_MOVIE = False
 START_IS_FILMOGRAPHY = False
 
-# delay between each request
+# delay between each request (where the crawl starts with THROTTLE_ENABLED)
 DELAY = 0.25
 
+# number of concurrent requests to wikipedia. With THROTTLE_ENABLED, this is where the crawl
+# starts, and the concurrency and the delay between requests then follow how wikipedia responds:
+# they grow (up to THROTTLE_MAX_CONCURRENCY and down to THROTTLE_MIN_DELAY) while the responses
+# are healthy and faster than THROTTLE_TARGET_LATENCY seconds, and back off on errors, for at
+# least the Retry-After of 429 and 503 responses (up to THROTTLE_MAX_DELAY seconds)
+CONCURRENCY = 2
+THROTTLE_ENABLED = True
+THROTTLE_MIN_DELAY = 0.05
+THROTTLE_MAX_DELAY = 60
+THROTTLE_MAX_CONCURRENCY = 16
+THROTTLE_TARGET_LATENCY = 1.0
+
 # timeout, in seconds, for the spider to close itself (set to 0 to disable timeout)
 CLOSE_TIMEOUT = 0
 
 # number of parsed item for the spider to close itself (set to 0 to disable item count)
 CLOSE_ITEM_COUNT = 0
 
+# priorities of the requests, so that a crawl bounded by CLOSE_TIMEOUT gets as much of the
+# income graph as possible: movie pages add the edges, while actor and filmography pages only
+# lead to more movies. Requests get BOX_OFFICE_PRIORITY more for each order of magnitude of
+# the box office (above a million) of the movie they come from or lead to, KNOWN_PRIORITY more
+# for each movie of the actor already in the graph (at most MAX_KNOWN_MOVIES), and
+# DEPTH_PRIORITY less for each link followed from START_URL. Scrapy keeps a queue for each
+# priority, so the priorities should stay small integers
+PAGE_PRIORITY = {"movie": 2, "actor": 1, "filmography": 0}
+BOX_OFFICE_PRIORITY = 1
+KNOWN_PRIORITY = 1
+MAX_KNOWN_MOVIES = 3
+DEPTH_PRIORITY = 1
+
 # decide whether or not to resume from previous work
 RESUME = True
 
@@ -27,5 +52,79 @@ JSON_OUTPUT_FILE = "output/out.json"
 # this will be the recover file if RESUME is True
 JOBDIR = "jobdir"
 
+# the requests already seen are kept in a Bloom filter saved to JOBDIR, which takes about
+# 1.8 bytes per request at a false positive rate of 0.1% (a false positive is a page that is
+# never crawled). The filter grows by stages, the first one holding DUPEFILTER_CAPACITY requests.
+# It is saved every DUPEFILTER_SAVE_INTERVAL new requests (and when the crawler stops), so that
+# a killed crawler only requests the pages seen since the last save again
+DUPEFILTER_CAPACITY = 1000000
+DUPEFILTER_ERROR_RATE = 0.001
+DUPEFILTER_SAVE_INTERVAL = 1000
+
 # name of the database file.
 DATABASE_FILE = "output/external.sqlite3"
+
+# number of items buffered by the pipeline before they are committed to the database
+# in a single transaction (set to 1 to commit every item right away). Buffered items
+# are committed when the spider closes or pauses. They are also written to a journal in
+# JOBDIR, from which they are committed when a killed crawler is resumed
+BATCH_SIZE = 100
+
+# maximum time, in seconds, an item can stay buffered before it is committed
+BATCH_INTERVAL = 5
+
+# number of actors (and movies) kept in memory by name and wiki page, so that nodes
+# referenced again and again within a batch are not looked up in the database
+LOOKUP_CACHE_SIZE = 10000
+
+# pragmas set on every connection to the database. The WAL journal lets the crawler
+# write to the database while the API is reading it
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # safe with WAL, only the last transactions can be lost on power failure
+    "cache_size": -64000,  # negative values are in KiB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,  # in milliseconds
+}
+
+# number of connections kept open for the threaded server, and the number of extra
+# connections that can be opened when all of them are in use
+DATABASE_POOL_SIZE = 5
+DATABASE_POOL_OVERFLOW = 10
+
+# number of API responses kept in memory, and the time, in seconds, they are kept. The
+# cache is cleared by every write through the API, but changes made by the crawler are only
+# seen once the cached responses expire
+RESPONSE_CACHE_SIZE = 1000
+RESPONSE_CACHE_TTL = 60
+
+# time, in seconds, the in-memory copy of the graph used for analytics is kept before it is
+# read again from the database (changes made through the same Graph object are seen at once)
+ANALYTICS_TTL = 300
+
+# the co-star paths between two actors are searched up to PATH_MAX_DEPTH movies apart, in the
+# in-memory copy of the graph, and the last PATH_CACHE_SIZE paths are kept until it is rebuilt
+PATH_MAX_DEPTH = 6
+PATH_CACHE_SIZE = 10000
+
+# the parser used to extract data from the crawled pages: "lxml" queries the pages with
+# XPath, "bs4" builds a BeautifulSoup tree (slower, kept as the reference implementation)
+PARSER = "lxml"
+
+# number of processes extracting the data of the crawled pages (set to 0 to parse the pages
+# in the crawler process, which blocks the downloads while a page is parsed)
+PARSE_PROCESSES = 0
+
+# "live" downloads the pages from wikipedia, "record" also saves them to PAGE_STORE_DIR,
+# and "replay" serves the pages from PAGE_STORE_DIR without touching the network (pages
+# missing from the store are skipped)
+CRAWL_MODE = "live"
+PAGE_STORE_DIR = "output/pages"
+
+# keep the crawled pages in a compressed http cache, so that crawling again only costs a
+# conditional request (and no parsing) for the pages that have not changed. The least
+# recently used pages are evicted once the cache takes more than HTTP_CACHE_SIZE bytes
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_DIR = "output/httpcache"
+HTTP_CACHE_SIZE = 1024 * 1024 * 1024
@@ -1,8 +1,9 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import scoped_session, sessionmaker
-from config import DATABASE_FILE, DIR_PATH
+from sqlalchemy.pool import QueuePool
+from config import DATABASE_FILE, DIR_PATH, SQLITE_PRAGMAS, DATABASE_POOL_SIZE, DATABASE_POOL_OVERFLOW
 
 # get the absolute path of current directory
 DATABASE_ADDRESS = "sqlite:///{}/{}".format(DIR_PATH, DATABASE_FILE)
@@ -11,7 +12,27 @@ database_address = "sqlite:///:memory:" if os.environ.get("UNITTEST") else DATAB
 
 # reference: http://flask.pocoo.org/docs/0.12/patterns/sqlalchemy/
 
-engine = create_engine(database_address, convert_unicode=True)
+if os.environ.get("UNITTEST"):
+    # every connection to an in-memory database is a different database, keep the default pool
+    engine = create_engine(database_address, convert_unicode=True)
+else:
+    engine = create_engine(database_address, convert_unicode=True,
+                           poolclass=QueuePool, pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_POOL_OVERFLOW,
+                           # connections are shared between the threads of the server through the pool
+                           connect_args={"check_same_thread": False,
+                                         "timeout": SQLITE_PRAGMAS.get("busy_timeout", 5000) / 1000})
+
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(connection, _):
+    """
+    Setup every new connection to the database with SQLITE_PRAGMAS
+    """
+    cursor = connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute("PRAGMA {} = {}".format(name, value))
+    cursor.close()
+
 db_session = scoped_session(sessionmaker(autocommit=False,
                                          autoflush=False,
                                          bind=engine))
@@ -19,8 +40,44 @@ Base = declarative_base()
 Base.query = db_session.query_property()
 
 
-# for quick setup, this should be run to initialize the database for the first time
+# for quick setup, this should be run to initialize the database for the first time.
+# It is safe to run it again on an existing database to upgrade it to the current schema
 def init_db():
     # noinspection PyUnresolvedReferences
-    from model.graph import Edge, Movie, Actor
+    from model.graph import Edge, Movie, Actor, Redirect
+    upgrade_db()
     Base.metadata.create_all(bind=engine)
+    create_indexes()
+    from model.graph.search import create_search_index
+    create_search_index()
+
+
+def upgrade_db():
+    """
+    Add the columns missing from the existing tables. A column can specify the SQL
+    expression used to fill it for the existing rows with info={"backfill": ...}
+    """
+    with engine.begin() as connection:
+        tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in Base.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            columns = {row[1] for row in connection.execute("PRAGMA table_info({})".format(table.name))}
+            for column in table.columns:
+                if column.name in columns:
+                    continue
+                connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(
+                    table.name, column.name, column.type.compile(dialect=engine.dialect)))
+                if "backfill" in column.info:
+                    connection.execute("UPDATE {} SET {} = {}".format(table.name, column.name, column.info["backfill"]))
+
+
+def create_indexes():
+    """
+    Create the indexes missing from the existing tables
+    """
+    indexes = {row[0] for row in engine.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind=engine)
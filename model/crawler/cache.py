@@ -0,0 +1,200 @@
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+from urllib.parse import urldefrag
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+# once the cache is full, the least recently used responses are evicted until it is this full
+EVICTION_TARGET = 0.9
+
+
+class CompressedCacheStorage:
+    """
+    Storage of the http cache (HTTPCACHE_STORAGE), keeping the response bodies compressed and
+    addressed by their content, so that identical pages are stored once. The responses are
+    indexed by url in a SQLite database, and the least recently used ones are evicted once the
+    bodies take more than HTTPCACHE_MAX_SIZE bytes
+    """
+
+    def __init__(self, settings):
+        self.directory = settings["HTTPCACHE_DIR"]
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.max_size = settings.getint("HTTPCACHE_MAX_SIZE")
+        self.index = None
+        # number of bytes taken by the bodies on disk
+        self.size = 0
+
+    def open_spider(self, spider):
+        os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(self.directory, "index.sqlite3"), isolation_level=None)
+        self.index.execute("PRAGMA journal_mode = WAL")
+        self.index.execute("CREATE TABLE IF NOT EXISTS response (url TEXT PRIMARY KEY, status INTEGER, "
+                           "headers BLOB, digest TEXT, stored REAL, accessed REAL)")
+        self.index.execute("CREATE INDEX IF NOT EXISTS ix_response_accessed ON response (accessed)")
+        self.index.execute("CREATE INDEX IF NOT EXISTS ix_response_digest ON response (digest)")
+        self.index.execute("CREATE TABLE IF NOT EXISTS object (digest TEXT PRIMARY KEY, size INTEGER, "
+                           "compressed INTEGER)")
+        self.size = self.index.execute("SELECT coalesce(sum(size), 0) FROM object").fetchone()[0]
+
+    def close_spider(self, spider):
+        self.index.close()
+
+    @staticmethod
+    def get_key(request):
+        """
+        Get the key of the cached response of the request
+        :param request: the request
+        :return: the url of the request, without fragment
+        """
+        return urldefrag(request.url)[0]
+
+    def get_filename(self, digest):
+        """
+        Get the file storing the body with the given digest
+        :param digest: the sha1 of the body
+        :return: the path of the file
+        """
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def retrieve_response(self, spider, request):
+        """
+        Get the cached response of the request
+        :return: the response, or None if the request is not cached
+        """
+        key = self.get_key(request)
+        row = self.index.execute("SELECT response.status, response.headers, response.digest, response.stored, "
+                                 "object.compressed FROM response JOIN object ON object.digest = response.digest "
+                                 "WHERE response.url = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        status, raw_headers, digest, stored, compressed = row
+        if 0 < self.expiration_secs < time.time() - stored:
+            return None
+        try:
+            with open(self.get_filename(digest), "rb") as file:
+                body = file.read()
+        except FileNotFoundError:
+            return None
+        if compressed:
+            body = gzip.decompress(body)
+
+        self.index.execute("UPDATE response SET accessed = ? WHERE url = ?", (time.time(), key))
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        response_class = responsetypes.from_args(headers=headers, url=request.url, body=body)
+        return response_class(url=request.url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """
+        Store the response of the request, replacing the previous one
+        """
+        digest = hashlib.sha1(response.body).hexdigest()
+        if self.index.execute("SELECT 1 FROM object WHERE digest = ?", (digest,)).fetchone() is None:
+            # bodies sent with a content encoding are compressed already
+            compressed = b"Content-Encoding" not in response.headers
+            data = gzip.compress(response.body) if compressed else response.body
+            filename = self.get_filename(digest)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(filename + ".tmp", filename)
+            self.index.execute("INSERT INTO object (digest, size, compressed) VALUES (?, ?, ?)",
+                               (digest, len(data), compressed))
+            self.size += len(data)
+
+        key = self.get_key(request)
+        old_digest = self.index.execute("SELECT digest FROM response WHERE url = ?", (key,)).fetchone()
+        now = time.time()
+        self.index.execute("INSERT OR REPLACE INTO response (url, status, headers, digest, stored, accessed) "
+                           "VALUES (?, ?, ?, ?, ?, ?)",
+                           (key, response.status, headers_dict_to_raw(response.headers), digest, now, now))
+        if old_digest is not None and old_digest[0] != digest:
+            self.collect([old_digest[0]])
+        if 0 < self.max_size < self.size:
+            self.evict(int(self.max_size * EVICTION_TARGET))
+
+    def evict(self, target_size):
+        """
+        Evict the least recently used responses until the cache takes at most target_size bytes
+        :param target_size: the size to reach, in bytes
+        """
+        # number of responses using each body met, which is freed once none is left
+        references = {}
+        size = self.size
+        urls = []
+        cursor = self.index.execute("SELECT url, digest FROM response ORDER BY accessed")
+        for url, digest in cursor:
+            if size <= target_size:
+                break
+            urls.append((url,))
+            if digest not in references:
+                references[digest] = self.index.execute("SELECT count(*) FROM response WHERE digest = ?",
+                                                        (digest,)).fetchone()[0]
+            references[digest] -= 1
+            if references[digest] == 0:
+                row = self.index.execute("SELECT size FROM object WHERE digest = ?", (digest,)).fetchone()
+                size -= row[0] if row is not None else 0
+        cursor.close()
+        self.index.executemany("DELETE FROM response WHERE url = ?", urls)
+        self.collect(references)
+        logging.info("Evicted {} responses from the http cache".format(len(urls)))
+
+    def collect(self, digests):
+        """
+        Delete the bodies that are no longer used by any response
+        :param digests: the digests of the bodies that may be unused
+        """
+        for digest in digests:
+            if self.index.execute("SELECT 1 FROM response WHERE digest = ? LIMIT 1", (digest,)).fetchone() is not None:
+                continue
+            row = self.index.execute("SELECT size FROM object WHERE digest = ?", (digest,)).fetchone()
+            if row is None:
+                continue
+            try:
+                os.remove(self.get_filename(digest))
+            except FileNotFoundError:
+                pass
+            self.size -= row[0]
+            self.index.execute("DELETE FROM object WHERE digest = ?", (digest,))
+
+
+class HttpCacheStats:
+    """
+    Extension reporting the hit rate of the http cache and the bytes it saved when the spider closes
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("HTTPCACHE_ENABLED"):
+            raise NotConfigured
+        extension = cls(crawler.stats)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def response_received(self, response, spider):
+        """
+        Count the bytes of the responses served by the cache, which are not downloaded
+        (revalidated responses only cost the headers of a 304)
+        """
+        if "cached" in response.flags:
+            self.stats.inc_value("httpcache/bytes_saved", len(response.body), spider=spider)
+
+    def spider_closed(self, spider):
+        hits = self.stats.get_value("httpcache/hit", 0, spider=spider)
+        revalidated = self.stats.get_value("httpcache/revalidate", 0, spider=spider)
+        total = hits + revalidated + self.stats.get_value("httpcache/miss", 0, spider=spider) \
+            + self.stats.get_value("httpcache/invalidate", 0, spider=spider)
+        hit_rate = (hits + revalidated) / total if total > 0 else 0
+        self.stats.set_value("httpcache/hit_rate", hit_rate, spider=spider)
+        logging.info("Http cache: {} hits, {} revalidated, {:.1%} hit rate, {:.1f} MB saved".format(
+            hits, revalidated, hit_rate, self.stats.get_value("httpcache/bytes_saved", 0, spider=spider) / 1e6))
@@ -0,0 +1,214 @@
+from scrapy.dupefilters import BaseDupeFilter
+from scrapy.utils.job import job_dir
+import hashlib
+import json
+import logging
+import math
+import os
+
+try:
+    from scrapy.utils.request import request_fingerprint
+except ImportError:
+    # newer versions of scrapy give the request fingerprinter to from_crawler instead
+    request_fingerprint = None
+
+# name of the file keeping the filter in the job directory
+FILENAME = "requests.bloom"
+
+# each new stage of the scalable filter is this many times larger than the previous one...
+GROWTH = 2
+# ...with this many times the false positive rate, so that the overall rate stays bounded
+TIGHTENING = 0.5
+
+
+class BloomFilter:
+    """
+    A Bloom filter: a bit array in which each key sets a few bits. Keys are never missed, but
+    a key that was not added is reported as seen with a probability of error_rate once capacity
+    keys are added
+    """
+
+    def __init__(self, capacity, error_rate, count=0, bits=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # number of keys added
+        self.count = count
+        # optimal number of bits and of hash functions for the capacity and the false positive rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+
+    def get_positions(self, digest):
+        """
+        Get the bits set by a key, using double hashing over the halves of its digest
+        :param digest: the sha1 of the key
+        :return: generator of the positions of the bits
+        """
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:16], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(digest))
+
+    def add(self, digest):
+        """
+        Add a key to the filter
+        :param digest: the sha1 of the key
+        """
+        for position in self.get_positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+
+class ScalableBloomFilter:
+    """
+    A Bloom filter growing with the number of keys: once a stage holds its capacity, a larger
+    stage with a lower false positive rate is added, and keys are looked up in every stage.
+    The overall false positive rate stays below error_rate however many keys are added, and
+    the memory taken grows by about -log2(error_rate) * 1.44 bits per key
+    """
+
+    def __init__(self, capacity, error_rate, stages=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # the rates of the stages sum up to error_rate
+        self.stages = stages if stages is not None else [BloomFilter(capacity, error_rate * (1 - TIGHTENING))]
+
+    def __contains__(self, key):
+        digest = hashlib.sha1(key).digest()
+        return any(digest in stage for stage in reversed(self.stages))
+
+    def __len__(self):
+        return sum(stage.count for stage in self.stages)
+
+    def add(self, key):
+        """
+        Add a key to the filter
+        :param key: the key (bytes)
+        :return: True if the key was already seen (or is a false positive)
+        """
+        digest = hashlib.sha1(key).digest()
+        if any(digest in stage for stage in reversed(self.stages)):
+            return True
+        stage = self.stages[-1]
+        if stage.count >= stage.capacity:
+            stage = BloomFilter(stage.capacity * GROWTH, stage.error_rate * TIGHTENING)
+            self.stages.append(stage)
+        stage.add(digest)
+        return False
+
+    def get_memory(self):
+        """
+        :return: the number of bytes taken by the bits of the filter
+        """
+        return sum(len(stage.bits) for stage in self.stages)
+
+    def save(self, path):
+        """
+        Save the filter to a file: a line of JSON describing the stages, followed by their bits
+        :param path: path of the file
+        """
+        header = {
+            "capacity": self.capacity, "error_rate": self.error_rate,
+            "stages": [{"capacity": stage.capacity, "error_rate": stage.error_rate, "count": stage.count}
+                       for stage in self.stages],
+        }
+        with open(path + ".tmp", "wb") as file:
+            file.write(json.dumps(header).encode("utf-8") + b"\n")
+            for stage in self.stages:
+                file.write(stage.bits)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a filter saved to a file
+        :param path: path of the file
+        :return: the ScalableBloomFilter
+        """
+        with open(path, "rb") as file:
+            header = json.loads(file.readline().decode("utf-8"))
+            stages = []
+            for stage in header["stages"]:
+                empty = BloomFilter(stage["capacity"], stage["error_rate"])
+                bits = bytearray(file.read(len(empty.bits)))
+                if len(bits) != len(empty.bits):
+                    raise ValueError("truncated bloom filter {}".format(path))
+                stages.append(BloomFilter(stage["capacity"], stage["error_rate"], stage["count"], bits))
+        return cls(header["capacity"], header["error_rate"], stages)
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    """
+    Duplicate request filter (DUPEFILTER_CLASS) keeping the fingerprints of the seen requests in a
+    scalable Bloom filter instead of a set, so that a crawl of millions of pages takes a few
+    megabytes. The filter is saved to the job directory when the spider closes or pauses. A
+    request can be wrongly filtered with a probability of BLOOM_ERROR_RATE. The filter is also
+    saved every BLOOM_SAVE_INTERVAL new requests, so that a killed crawl only sees the requests
+    seen since the last save again
+    """
+
+    def __init__(self, path=None, capacity=1000000, error_rate=0.001, debug=False, fingerprinter=None,
+                 save_interval=1000):
+        self.path = os.path.join(path, FILENAME) if path else None
+        self.fingerprinter = fingerprinter
+        self.debug = debug
+        self.logdupes = True
+        self.save_interval = save_interval
+        # number of requests added since the filter was saved
+        self.unsaved_count = 0
+        if self.path is not None and os.path.exists(self.path):
+            self.filter = ScalableBloomFilter.load(self.path)
+            logging.info("Loaded the fingerprints of {} seen requests".format(len(self.filter)))
+        else:
+            self.filter = ScalableBloomFilter(capacity, error_rate)
+
+    @classmethod
+    def from_settings(cls, settings, fingerprinter=None):
+        return cls(job_dir(settings), settings.getint("BLOOM_CAPACITY", 1000000),
+                   settings.getfloat("BLOOM_ERROR_RATE", 0.001), settings.getbool("DUPEFILTER_DEBUG"), fingerprinter,
+                   settings.getint("BLOOM_SAVE_INTERVAL", 1000))
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls.from_settings(crawler.settings, getattr(crawler, "request_fingerprinter", None))
+
+    def request_fingerprint(self, request):
+        """
+        :param request: the request
+        :return: the fingerprint of the request (bytes)
+        """
+        if self.fingerprinter is not None:
+            return self.fingerprinter.fingerprint(request)
+        return request_fingerprint(request).encode("ascii")
+
+    def request_seen(self, request):
+        if self.filter.add(self.request_fingerprint(request)):
+            return True
+        self.unsaved_count += 1
+        if self.path is not None and 0 < self.save_interval <= self.unsaved_count:
+            self.save()
+        return False
+
+    def save(self):
+        """
+        Save the filter to the job directory
+        """
+        self.filter.save(self.path)
+        self.unsaved_count = 0
+
+    def close(self, reason):
+        if self.path is not None:
+            self.save()
+        logging.info("Bloom filter of {} seen requests takes {:.1f} MB".format(
+            len(self.filter), self.filter.get_memory() / 1e6))
+
+    def log(self, request, spider):
+        if self.debug:
+            logging.debug("Filtered duplicate request: {}".format(request))
+        elif self.logdupes:
+            logging.debug("Filtered duplicate request: {} - no more duplicates will be shown "
+                          "(see DUPEFILTER_DEBUG to show all duplicates)".format(request))
+            self.logdupes = False
+        spider.crawler.stats.inc_value("dupefilter/filtered", spider=spider)
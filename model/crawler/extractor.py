@@ -0,0 +1,481 @@
+import re
+import hashlib
+from bs4 import BeautifulSoup
+from lxml import html
+from dateparser import parse as parse_date
+
+ROOT = "https://en.wikipedia.org"
+
+# the content of a page, as far as the extractors are concerned, goes from the heading to the
+# footer. The rest of the page (navigation, edit dates...) changes without the content changing
+CONTENT_START = 'id="firstHeading"'
+CONTENT_ENDS = ('class="printfooter"', 'id="catlinks"')
+# html comments in the content hold the time the page was rendered
+COMMENT_PATTERN = re.compile(r"<!--.*?-->", re.DOTALL)
+# change the version to invalidate the fingerprints when the extractors change
+FINGERPRINT_VERSION = "1"
+
+# class of the info box table, matched as one of the classes of the element
+INFOBOX_XPATH = '//table[contains(concat(" ", normalize-space(@class), " "), " infobox ")]'
+
+
+class Extractor:
+    """
+    The base class of the extractors, which get the data out of the html of actor, movie
+    and filmography pages. The methods raise AttributeError if a page cannot be parsed
+    """
+
+    def extract_actor(self, url, text):
+        """
+        Extract the data of an actor page
+        :param url: the url of the page
+        :param text: the html of the page
+        :return: a dict with the name, wiki_page, canonical (url), age, movies (links to movies)
+        and filmographies (links to filmography pages) of the actor
+        """
+        raise NotImplementedError
+
+    def extract_movie(self, url, text):
+        """
+        Extract the data of a movie page
+        :param url: the url of the page
+        :param text: the html of the page
+        :return: a dict with the name, wiki_page, canonical (url), box_office, actors (links
+        to actors) and release_date of the movie
+        """
+        raise NotImplementedError
+
+    def extract_filmography(self, url, text):
+        """
+        Extract the links of a filmography page
+        :param url: the url of the page
+        :param text: the html of the page
+        :return: a list of links on the page
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def parse_currency(box_office):
+        """
+        A helper method to convert string representation of box_office to float that
+        represent the value
+        :param box_office: the string representation of box_office
+        :return: the box_office as float, or None if box_office cannot be parsed
+        """
+        try:
+            # use regular expression to remove everything in parenthesis, if any
+            box_office = re.sub(r"[(\[].*[)\]]", "", box_office).strip()
+
+            # remove currency symbol, million/billion endings and comma
+            box_office_value = float(box_office.strip("$mbtrillion").replace(',', ''))
+
+            # augmented by the endings
+            if box_office.endswith("million"):
+                box_office_value *= 1e6
+            elif box_office.endswith("billion"):
+                box_office_value *= 1e9
+            elif box_office.endswith("trillion"):
+                box_office_value *= 1e12
+            return box_office_value
+
+        except ValueError:
+            return None
+
+    @staticmethod
+    def parse_name(heading):
+        """
+        A helper method to get the name of the page from its heading
+        :param heading: the text of the heading
+        :return: the heading without anything in parenthesis
+        """
+        return re.sub(r"\(.*\)", "", heading).strip()
+
+    @staticmethod
+    def parse_age(age):
+        """
+        A helper method to get the age from its description
+        :param age: the text describing the age, (age xxx) or (aged xxx)
+        :return: the age, or None if it cannot be parsed
+        """
+        try:
+            return int(re.search(r"aged?\D*(\d+)", age).group(1))
+        except AttributeError:
+            return None
+
+
+class SoupExtractor(Extractor):
+    """
+    Extractor using BeautifulSoup
+    """
+
+    def extract_actor(self, url, text):
+        soup, name, link, info_box = self.parse_basic_info(url, text)
+        movies, filmography_list = self.get_movies(soup)
+        return {"name": name, "wiki_page": link, "canonical": self.get_canonical(soup),
+                "age": self.get_age(info_box), "movies": movies, "filmographies": filmography_list}
+
+    def extract_movie(self, url, text):
+        soup, name, link, info_box = self.parse_basic_info(url, text)
+        return {"name": name, "wiki_page": link, "canonical": self.get_canonical(soup),
+                "box_office": self.get_box_office(info_box), "actors": self.get_starring(info_box),
+                "release_date": self.get_release_date(info_box)}
+
+    def extract_filmography(self, url, text):
+        urls = BeautifulSoup(text, 'lxml').find_all("a")
+        return [url["href"] for url in urls if url.has_attr('href')]
+
+    def parse_basic_info(self, url, text):
+        """
+        A helper function to parse the basic information on a page
+        :param url: the url of the page
+        :param text: the html of the page
+        """
+        soup = BeautifulSoup(text, 'lxml')
+        name = self.parse_name(soup.find(id="firstHeading").text)
+        link = url[len(ROOT):]
+        info_box = soup.find("table", attrs={"class": "infobox"})
+        return soup, name, link, info_box
+
+    def get_canonical(self, soup):
+        """
+        A helper method to get the canonical url of the page, which differs from the url of
+        the page when the page is reached through a redirect
+        :param soup: the beautiful soup object
+        :return: the canonical url, or None if the page does not have one
+        """
+        link = soup.find("link", rel="canonical")
+        return link["href"] if link is not None and link.has_attr("href") else None
+
+    def get_movies(self, soup):
+        """
+        A helper method to get the url to movies from soup
+        :param soup: the beautiful soup object
+        :return: a list of movies
+        """
+        movies = []
+        filmography_list = []
+        filmography = soup.find("span", id="Filmography").find_parent("h2").find_next_sibling()
+        stop_token = "h2"
+
+        while filmography.name != stop_token:  # stop at next h2
+            # if contains film subsection, then read directly from there
+            films = filmography.find(id="Film")
+            if filmography.name == "h3" and films is not None:
+                stop_token = "h3"
+            urls = filmography.find_all("a")
+            for url in urls:
+                if url.has_attr('href') and not url["href"].startswith("#"):
+                    href = url["href"]
+                    # goes to filmography page instead
+                    if href.endswith("filmography"):
+                        filmography_list.append(href)
+                    else:
+                        movies.append(href)
+
+            filmography = filmography.find_next_sibling()
+
+        return movies, filmography_list
+
+    def get_age(self, info_box):
+        """
+        A helper method to get the age of current actor
+        :param info_box: info_box: the beautiful soup object for the info box
+        :return: age of the actor, or none if cannot find anything
+        """
+        # try to find the current age of actor, if he/she is still alive
+        try:
+            age = info_box.find("span", attrs={"class": "noprint ForceAgeToShow"})
+            if age is not None:
+                # the actor is still alive
+                age = age.text
+            else:
+                # the actor is dead.. need to find the death information
+                age = info_box.find("span", attrs={"class": "dday deathdate"}) \
+                    .find_parent().find_next_sibling().previous_element
+            # gather all digits in age description (age xxx) or (aged xxx)
+            return int(re.search(r"aged?\D*(\d+)", age).group(1))
+
+        except AttributeError:
+            # cannot parse the age
+            return None
+
+    def get_box_office(self, info_box):
+        """
+        A helper method to get the box office of current film
+        :param info_box: the beautiful soup object for the info box
+        :return: gross box_office of the film, or none if cannot find anything
+        """
+        try:
+            box_office = info_box.find(text="Box office").find_parent() \
+                .find_next_sibling().next_element
+            return self.parse_currency(box_office)
+        except (AttributeError, TypeError):
+            return None
+
+    def get_starring(self, info_box):
+        """
+        A helper method to get all actors for a given movie
+        :param info_box: the beautiful soup object for the info box
+        :return: a list of links to actors (in the same order as they are listed in wikipedia)
+        """
+        try:
+            starring = info_box.find(text="Starring").find_parent("tr")
+            return [url["href"] for url in starring.find_all("a") if
+                    url.has_attr("href") and not url["href"].startswith("#")]
+        except AttributeError:
+            return []
+
+    def get_release_date(self, info_box):
+        """
+        a helper method to get the release date of the movie
+        :param info_box: the beautiful soup object of the info box
+        :return: the release date of the movie, or None if cannot parse
+        """
+        try:
+            release_date = info_box.find("span", attrs={"class": "published"}).text
+            return parse_date(release_date)
+        except AttributeError:
+            return None
+
+
+class LxmlExtractor(Extractor):
+    """
+    Extractor using lxml and XPath, which gives the same result as SoupExtractor but only
+    parses the page once and does not build a BeautifulSoup tree
+    """
+
+    def extract_actor(self, url, text):
+        root, name, link, info_box = self.parse_basic_info(url, text)
+        movies, filmography_list = self.get_movies(root)
+        return {"name": name, "wiki_page": link, "canonical": self.get_canonical(root),
+                "age": self.get_age(info_box), "movies": movies, "filmographies": filmography_list}
+
+    def extract_movie(self, url, text):
+        root, name, link, info_box = self.parse_basic_info(url, text)
+        return {"name": name, "wiki_page": link, "canonical": self.get_canonical(root),
+                "box_office": self.get_box_office(info_box), "actors": self.get_starring(info_box),
+                "release_date": self.get_release_date(info_box)}
+
+    def extract_filmography(self, url, text):
+        return [str(href) for href in html.fromstring(text).xpath("//a/@href")]
+
+    def parse_basic_info(self, url, text):
+        """
+        A helper function to parse the basic information on a page
+        :param url: the url of the page
+        :param text: the html of the page
+        """
+        root = html.fromstring(text)
+        heading = first(root.xpath('//*[@id="firstHeading"]'))
+        name = self.parse_name(heading.text_content())
+        link = url[len(ROOT):]
+        info_box = first(root.xpath(INFOBOX_XPATH), None)
+        return root, name, link, info_box
+
+    def get_canonical(self, root):
+        """
+        A helper method to get the canonical url of the page, which differs from the url of
+        the page when the page is reached through a redirect
+        :param root: the root element of the page
+        :return: the canonical url, or None if the page does not have one
+        """
+        link = first(root.xpath('//link[@rel="canonical"]/@href'), None)
+        return str(link) if link is not None else None
+
+    def get_movies(self, root):
+        """
+        A helper method to get the url to movies from the page
+        :param root: the root element of the page
+        :return: a list of movies
+        """
+        movies = []
+        filmography_list = []
+        heading = first(first(root.xpath('//span[@id="Filmography"]')).xpath("ancestor::h2[1]"))
+        filmography = next_sibling(heading)
+        stop_token = "h2"
+
+        while filmography.tag != stop_token:  # stop at next h2
+            # if contains film subsection, then read directly from there
+            if filmography.tag == "h3" and filmography.xpath('.//*[@id="Film"]'):
+                stop_token = "h3"
+            for href in filmography.xpath(".//a/@href"):
+                if not href.startswith("#"):
+                    # goes to filmography page instead
+                    if href.endswith("filmography"):
+                        filmography_list.append(str(href))
+                    else:
+                        movies.append(str(href))
+
+            filmography = next_sibling(filmography)
+
+        return movies, filmography_list
+
+    def get_age(self, info_box):
+        """
+        A helper method to get the age of current actor
+        :param info_box: the element of the info box
+        :return: age of the actor, or none if cannot find anything
+        """
+        if info_box is None:
+            return None
+        # try to find the current age of actor, if he/she is still alive
+        age = info_box.xpath('.//span[@class="noprint ForceAgeToShow"]')
+        if age:
+            return self.parse_age(age[0].text_content())
+
+        # the actor is dead.. the age follows the death date
+        death_date = info_box.xpath('.//span[@class="dday deathdate"]')
+        if not death_date or death_date[0].getparent() is None:
+            return None
+        sibling = next_sibling(death_date[0].getparent())
+        return self.parse_age(previous_text(sibling)) if sibling is not None else None
+
+    def get_box_office(self, info_box):
+        """
+        A helper method to get the box office of current film
+        :param info_box: the element of the info box
+        :return: gross box_office of the film, or none if cannot find anything
+        """
+        label = first(info_box.xpath('.//text()[. = "Box office"]'), None) if info_box is not None else None
+        if label is None:
+            return None
+        sibling = next_sibling(text_parent(label))
+        # the value must be the text at the beginning of the next cell
+        if sibling is None or not sibling.text:
+            return None
+        return self.parse_currency(sibling.text)
+
+    def get_starring(self, info_box):
+        """
+        A helper method to get all actors for a given movie
+        :param info_box: the element of the info box
+        :return: a list of links to actors (in the same order as they are listed in wikipedia)
+        """
+        label = first(info_box.xpath('.//text()[. = "Starring"]'), None) if info_box is not None else None
+        row = first(text_parent(label).xpath("ancestor-or-self::tr[1]"), None) if label is not None else None
+        if row is None:
+            return []
+        return [str(href) for href in row.xpath(".//a/@href") if not href.startswith("#")]
+
+    def get_release_date(self, info_box):
+        """
+        a helper method to get the release date of the movie
+        :param info_box: the element of the info box
+        :return: the release date of the movie, or None if cannot parse
+        """
+        if info_box is None:
+            return None
+        published = info_box.xpath('.//span[contains(concat(" ", normalize-space(@class), " "), " published ")]')
+        return parse_date(published[0].text_content()) if published else None
+
+
+def first(elements, *default):
+    """
+    A helper function to get the first result of an XPath query
+    :param elements: the list of results
+    :param default: the value returned if there is no result. If not given,
+    AttributeError is raised instead (like BeautifulSoup does when a lookup fails)
+    :return: the first result
+    """
+    if elements:
+        return elements[0]
+    if default:
+        return default[0]
+    raise AttributeError("element not found")
+
+
+def next_sibling(element):
+    """
+    A helper function to get the next sibling element, skipping comments
+    :param element: the element
+    :return: the next sibling, or None if there is none
+    """
+    sibling = element.getnext()
+    while sibling is not None and not isinstance(sibling.tag, str):
+        sibling = sibling.getnext()
+    return sibling
+
+
+def text_parent(text):
+    """
+    A helper function to get the element containing a text node
+    :param text: the text node returned by XPath
+    :return: the element containing the text
+    """
+    parent = text.getparent()
+    # the tail of an element is contained by the parent of the element
+    return parent.getparent() if text.is_tail else parent
+
+
+def previous_text(element):
+    """
+    A helper function to get the text right before an element in the document
+    :param element: the element
+    :return: the text, or "" if the element is not preceded by text
+    """
+    previous = element.getprevious()
+    if previous is None:
+        return element.getparent().text or ""
+    if previous.tail:
+        return previous.tail
+    texts = previous.xpath(".//text()")
+    return texts[-1] if texts else ""
+
+
+# the extractors that can be selected with config.PARSER
+EXTRACTORS = {
+    "bs4": SoupExtractor,
+    "lxml": LxmlExtractor,
+}
+
+
+def get_extractor(name):
+    """
+    Get the extractor with the given name
+    :param name: name of the extractor, one of EXTRACTORS
+    :return: the extractor object
+    """
+    if name not in EXTRACTORS:
+        raise ValueError("unknown parser {}, expected one of {}".format(name, ", ".join(EXTRACTORS)))
+    return EXTRACTORS[name]()
+
+
+def get_fingerprint(text):
+    """
+    Get the fingerprint of the content of a page, without parsing the page
+    :param text: the html of the page
+    :return: the fingerprint, as a hex string
+    """
+    start = max(text.find(CONTENT_START), 0)
+    end = min((index for index in (text.find(token, start) for token in CONTENT_ENDS) if index >= 0),
+              default=len(text))
+    content = COMMENT_PATTERN.sub("", text[start:end])
+    return hashlib.sha1((FINGERPRINT_VERSION + content).encode("utf-8")).hexdigest()
+
+
+def get_page_type(meta):
+    """
+    Get the type of page from the metadata of its request
+    :param meta: the metadata of the request
+    :return: "movie", "filmography" or "actor"
+    """
+    if meta.get("is_movie"):
+        return "movie"
+    if meta.get("is_filmography"):
+        return "filmography"
+    return "actor"
+
+
+def extract_page(parser, page_type, url, text):
+    """
+    Extract the data of a page. This is the function run by the processes parsing the pages
+    :param parser: name of the extractor, one of EXTRACTORS
+    :param page_type: type of the page, as returned by get_page_type
+    :param url: the url of the page
+    :param text: the html of the page
+    :return: the extracted data, or None if the page cannot be parsed
+    """
+    try:
+        return getattr(get_extractor(parser), "extract_" + page_type)(url, text)
+    except AttributeError:
+        return None
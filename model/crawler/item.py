@@ -7,6 +7,10 @@ class Item(ScrapyItem):
     """
     name = Field()
     wiki_page = Field()
+    # fingerprint of the content of the page
+    fingerprint = Field()
+    # the wiki pages redirecting to the page
+    aliases = Field()
 
 
 class ActorItem(Item):
@@ -14,6 +18,8 @@ class ActorItem(Item):
     The scrapy item containing actor specific field
     """
     age = Field()
+    # the links of the page to movies and filmographies, followed again when the page is unchanged
+    links = Field()
 
 
 class MovieItem(Item):
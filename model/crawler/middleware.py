@@ -0,0 +1,272 @@
+from concurrent.futures import ProcessPoolExecutor
+from scrapy import signals
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from scrapy.http import HtmlResponse, Response
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from .extractor import extract_page, get_page_type
+from .store import PageStore
+from config import PARSER, PARSE_PROCESSES, CRAWL_MODE, PAGE_STORE_DIR, THROTTLE_ENABLED, THROTTLE_MIN_DELAY, \
+    THROTTLE_MAX_DELAY, THROTTLE_MAX_CONCURRENCY, THROTTLE_TARGET_LATENCY
+import logging
+import time
+
+# the delay of a domain is multiplied by this once all its concurrent requests succeed
+DELAY_DECREASE = 0.75
+
+
+class ParseMiddleware:
+    """
+    Downloader middleware extracting the data of the downloaded pages in a pool of processes,
+    so that parsing does not block the reactor. The data is passed to the spider as
+    response.meta["extracted"] (None if the page cannot be parsed)
+    """
+
+    def __init__(self, processes):
+        """
+        Create the middleware
+        :param processes: number of processes parsing the pages
+        """
+        self.pool = ProcessPoolExecutor(processes)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if PARSE_PROCESSES <= 0:
+            raise NotConfigured
+        middleware = cls(PARSE_PROCESSES)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self):
+        """
+        Shut down the processes as the spider closes
+        """
+        self.pool.shutdown()
+
+    def process_response(self, request, response, spider):
+        """
+        Send the page to the pool
+        :return: a Deferred firing with the response once the page is extracted
+        """
+        if response.status != 200 or not isinstance(response, HtmlResponse):
+            return response
+        # unchanged pages are not parsed again (see Spider.get_unchanged_node, which keeps the
+        # result in the meta of the request for the spider)
+        if hasattr(spider, "get_unchanged_node") and spider.get_unchanged_node(response) is not None:
+            return response
+
+        deferred = Deferred()
+        future = self.pool.submit(extract_page, PARSER, get_page_type(request.meta), request.url, response.text)
+        # the future completes in a thread of the pool, go back to the reactor thread
+        future.add_done_callback(lambda _: reactor.callFromThread(self.resolve, deferred, future, request, response))
+        return deferred
+
+    @staticmethod
+    def resolve(deferred, future, request, response):
+        """
+        Attach the extracted data to the response and hand it back to Scrapy
+        """
+        try:
+            request.meta["extracted"] = future.result()
+        except Exception as e:
+            # let the spider parse the page itself
+            logging.warning("Failed to parse {} in the pool: {}".format(request.url, e))
+        deferred.callback(response)
+
+
+class PageStoreMiddleware:
+    """
+    Downloader middleware saving the crawled pages to a PageStore (CRAWL_MODE = "record"),
+    or serving the pages from it instead of downloading them (CRAWL_MODE = "replay")
+    """
+
+    def __init__(self, store, mode, stats):
+        """
+        Create the middleware
+        :param store: the PageStore
+        :param mode: "record" or "replay"
+        :param stats: the stats collector of the crawler
+        """
+        self.store = store
+        self.mode = mode
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if CRAWL_MODE not in ("record", "replay"):
+            raise NotConfigured
+        return cls(PageStore(PAGE_STORE_DIR), CRAWL_MODE, crawler.stats)
+
+    def process_request(self, request, spider):
+        """
+        Serve the page from the store when replaying
+        :return: the stored response, or None to download the page
+        """
+        if self.mode != "replay":
+            return None
+
+        target = self.store.get_redirect(request.url)
+        if target is not None:
+            # let the redirect middleware follow the redirect, as it does for live pages
+            self.stats.inc_value("page_store/redirect", spider=spider)
+            return Response(request.url, status=301, headers={"Location": target}, request=request)
+        body = self.store.get(request.url)
+        if body is None:
+            self.stats.inc_value("page_store/miss", spider=spider)
+            raise IgnoreRequest("{} is not in the page store".format(request.url))
+        self.stats.inc_value("page_store/hit", spider=spider)
+        return HtmlResponse(request.url, body=body, encoding="utf-8", request=request)
+
+    def process_response(self, request, response, spider):
+        """
+        Save the page to the store when recording
+        :return: the response
+        """
+        if self.mode == "record" and response.status == 200 and isinstance(response, HtmlResponse):
+            # store the pages as utf-8, which is what replay reads
+            self.store.put(response.url, response.text.encode("utf-8"))
+            for url in request.meta.get("redirect_urls", []):
+                self.store.put_redirect(url, response.url)
+            self.stats.inc_value("page_store/recorded", spider=spider)
+        return response
+
+
+class AdaptiveThrottleMiddleware:
+    """
+    Downloader middleware adapting the concurrency and the delay of the requests to each domain
+    to how its server responds, as TCP does: once all the concurrent requests come back healthy,
+    one more request is allowed and the delay shrinks, while errors halve the concurrency and
+    double the delay. Responses slower than THROTTLE_TARGET_LATENCY take one request off, and
+    the delay is at least the Retry-After of 429 and 503 responses. The current concurrency and
+    delay are reported in the stats (throttle/...)
+    """
+
+    def __init__(self, crawler, min_delay, max_delay, max_concurrency, target_latency):
+        """
+        Create the middleware
+        :param crawler: the crawler, whose downloader slots are throttled
+        :param min_delay: minimum delay between two requests to a domain, in seconds
+        :param max_delay: maximum delay between two requests to a domain, in seconds
+        :param max_concurrency: maximum number of concurrent requests to a domain
+        :param target_latency: latency, in seconds, above which the server is taken as loaded
+        """
+        self.crawler = crawler
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        # number of healthy responses of each domain since its concurrency last changed
+        self.successes = {}
+        # time each domain last backed off, the responses to the requests that were in flight
+        # at the time do not back off again
+        self.backoff_times = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not THROTTLE_ENABLED or CRAWL_MODE == "replay":
+            raise NotConfigured
+        return cls(crawler, THROTTLE_MIN_DELAY, THROTTLE_MAX_DELAY, THROTTLE_MAX_CONCURRENCY, THROTTLE_TARGET_LATENCY)
+
+    def get_slot(self, request):
+        """
+        Get the downloader slot (the domain) of a request
+        :return: (key of the slot, the slot), the slot is None if the request was not downloaded
+        """
+        key = request.meta.get("download_slot")
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def process_response(self, request, response, spider):
+        """
+        Adapt the slot of the request to the response
+        :return: the response
+        """
+        key, slot = self.get_slot(request)
+        # responses served by the http cache are not downloaded
+        if slot is None or "cached" in response.flags:
+            return response
+
+        if response.status in (429, 503):
+            retry_after = self.get_retry_after(response)
+            if retry_after is not None:
+                self.crawler.stats.inc_value("throttle/retry_after", spider=spider)
+            self.back_off(key, slot, spider, retry_after or 0)
+        elif response.status >= 500:
+            self.back_off(key, slot, spider)
+        elif request.meta.get("download_latency", 0) > self.target_latency:
+            self.successes[key] = 0
+            slot.concurrency = max(slot.concurrency - 1, 1)
+            self.update_stats(slot, spider)
+        else:
+            self.speed_up(key, slot, spider)
+        return response
+
+    def process_exception(self, request, exception, spider):
+        """
+        Back off when the server cannot be reached or times out
+        """
+        key, slot = self.get_slot(request)
+        if slot is not None and not isinstance(exception, IgnoreRequest):
+            self.back_off(key, slot, spider)
+
+    def speed_up(self, key, slot, spider):
+        """
+        Count a healthy response, and allow one more request once all the concurrent requests succeed
+        """
+        self.successes[key] = self.successes.get(key, 0) + 1
+        if self.successes[key] >= slot.concurrency:
+            self.successes[key] = 0
+            slot.concurrency = min(slot.concurrency + 1, self.max_concurrency)
+            slot.delay = max(slot.delay * DELAY_DECREASE, self.min_delay)
+            self.update_stats(slot, spider)
+
+    def back_off(self, key, slot, spider, retry_after=0):
+        """
+        Halve the concurrency and double the delay of a slot
+        :param retry_after: the delay, in seconds, the server asked for
+        """
+        self.successes[key] = 0
+        now = time.time()
+        backed_off = now - self.backoff_times.get(key, 0) > max(slot.delay, self.target_latency)
+        if backed_off:
+            self.backoff_times[key] = now
+            self.crawler.stats.inc_value("throttle/backoff", spider=spider)
+            slot.concurrency = max(slot.concurrency // 2, 1)
+            slot.delay = min(max(slot.delay * 2, self.min_delay), self.max_delay)
+        slot.delay = max(slot.delay, min(retry_after, self.max_delay))
+        if backed_off:
+            logging.info("Backing off {}: {} concurrent requests, {:.2f}s delay".format(
+                key, slot.concurrency, slot.delay))
+        self.update_stats(slot, spider)
+
+    def update_stats(self, slot, spider):
+        """
+        Report the current concurrency and delay
+        """
+        stats = self.crawler.stats
+        stats.set_value("throttle/concurrency", slot.concurrency, spider=spider)
+        stats.set_value("throttle/delay", slot.delay, spider=spider)
+        stats.max_value("throttle/max_concurrency", slot.concurrency, spider=spider)
+
+    @staticmethod
+    def get_retry_after(response):
+        """
+        Get the delay asked for by the Retry-After header of a response (in seconds or as a date)
+        :return: the delay in seconds, or None if the header is missing or invalid
+        """
+        value = response.headers.get("Retry-After")
+        if value is None:
+            return None
+        value = value.decode("latin-1").strip()
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        return max((date - datetime.now(timezone.utc)).total_seconds(), 0)
@@ -1,9 +1,19 @@
 from scrapy.exceptions import DropItem
+from sqlalchemy.exc import IntegrityError, InvalidRequestError
+from scrapy.utils.job import job_dir
+from twisted.internet.task import LoopingCall
 from ..graph import Graph
-from .item import MovieItem
+from ..graph.stream import DATE_FORMAT, parse_date
+from .item import MovieItem, ActorItem
 from database import db_session
-from config import JSON_OUTPUT_FILE, RESUME
+from config import JSON_OUTPUT_FILE, RESUME, BATCH_SIZE, BATCH_INTERVAL
+import json
 import logging
+import os
+import time
+
+# name of the file of the job directory keeping the items that are not committed yet
+JOURNAL_FILENAME = "pending.jl"
 
 
 class GraphPipeline:
@@ -14,10 +24,21 @@ class GraphPipeline:
     actor_count = 0
     movie_count = 0
 
-    def open_spider(self, _):
+    # the items that are not committed yet, added again one by one if their batch fails
+    pending = None
+    # number of items lost because they could not be written
+    failed_count = 0
+    # the file the pending items are written to as they come, so that they are not lost if the
+    # crawler is killed (their requests are seen, and would not be crawled again on resume)
+    journal = None
+    start_time = None
+    last_commit = None
+    commit_loop = None
+
+    def open_spider(self, spider):
         """
         Try to the graph (if any) when spider opens
-        :param _: reference to the spider object (unused)
+        :param spider: reference to the spider object
         """
         if RESUME and JSON_OUTPUT_FILE is not None:
             try:
@@ -27,11 +48,32 @@ class GraphPipeline:
             except FileNotFoundError:
                 pass
 
+        # buffer the items and commit them in batches
+        self.pending = []
+        self.graph.batch = BATCH_SIZE > 1
+        self.start_time = self.last_commit = time.time()
+        if self.graph.batch and BATCH_INTERVAL > 0:
+            # commit the buffered items even if no new item comes in
+            self.commit_loop = LoopingCall(self.commit_if_due)
+            self.commit_loop.start(BATCH_INTERVAL, now=False)
+        self.open_journal(job_dir(spider.crawler.settings))
+
     def close_spider(self, _):
         """
         Close the file object as the spider ends crawling
         :param _: reference to the spider object (unused)
         """
+        if self.commit_loop is not None and self.commit_loop.running:
+            self.commit_loop.stop()
+        self.commit()
+        if self.journal is not None:
+            self.journal.close()
+            os.remove(self.journal.name)
+        logging.info("Processed {} items in total ({:.2f} items/sec)".format(
+            self.actor_count + self.movie_count, self.get_throughput()))
+        if self.failed_count:
+            logging.error("{} items could not be written to the database".format(self.failed_count))
+
         if JSON_OUTPUT_FILE is not None:
             self.graph.dump(JSON_OUTPUT_FILE)
 
@@ -48,7 +90,9 @@ class GraphPipeline:
             if isinstance(item, MovieItem):
                 if item.get("box_office") is None or not item.get("actors"):
                     raise ValueError("missing actors or income information")
-            self.graph.add(item)
+            # (written first, the journal is emptied if the batch fails and is committed again)
+            self.write_journal(item)
+            self.add(item)
             if isinstance(item, MovieItem):
                 self.movie_count += 1
             else:
@@ -59,6 +103,124 @@ class GraphPipeline:
                 "Processed {} at {}. "
                 "Current Progress - movies: {}, actors: {}".format(
                     item.__class__.__name__, item["wiki_page"], self.movie_count, self.actor_count))
+
+            if len(self.pending) >= BATCH_SIZE:
+                self.commit()
+            else:
+                self.commit_if_due()
             return item
         except (KeyError, ValueError):
             raise DropItem("Incomplete info in %s" % item)
+
+    def add(self, item):
+        """
+        Add an item to the graph, to be committed with the buffered items
+        :param item: the item to add
+        """
+        try:
+            self.graph.add(item)
+            self.pending.append(item)
+        except (IntegrityError, InvalidRequestError):
+            # the batch was discarded along with the item
+            self.pending.append(item)
+            self.commit(failed=True)
+
+    def open_journal(self, directory):
+        """
+        Add and commit the items left in the journal by a crawler that was killed, and start
+        a new journal
+        :param directory: the job directory, or None to keep no journal
+        """
+        if directory is None:
+            return
+        path = os.path.join(directory, JOURNAL_FILENAME)
+        if os.path.exists(path):
+            items = []
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last item was being written when the crawler was killed
+                        break
+                    if record.get("release_date") is not None:
+                        record["release_date"] = parse_date(record["release_date"])
+                    items.append((MovieItem if record.pop("type") == "movie" else ActorItem)(record))
+            for item in items:
+                try:
+                    self.add(item)
+                except (KeyError, ValueError):
+                    logging.warning("Incomplete info in {}".format(item))
+            self.commit()
+            logging.info("Recovered {} items that were not committed".format(len(items)))
+        self.journal = open(path, "w", encoding="utf-8")
+
+    def write_journal(self, item):
+        """
+        Write a pending item to the journal
+        :param item: the item
+        """
+        if self.journal is None:
+            return
+        record = dict(item, type="movie" if isinstance(item, MovieItem) else "actor")
+        if record.get("release_date") is not None:
+            record["release_date"] = record["release_date"].strftime(DATE_FORMAT)
+        # (flushed, so that it is kept if the process is killed)
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+
+    def commit(self, failed=False):
+        """
+        Commit the buffered items to the database in one transaction. If the transaction
+        fails, the items are added and committed again one by one, so that only the items
+        that cannot be written are lost
+        :param failed: whether the batch was already discarded, because an item failed to be added
+        """
+        if self.pending:
+            if not failed:
+                try:
+                    self.graph.commit()
+                except (IntegrityError, InvalidRequestError) as e:
+                    logging.warning("Failed to commit {} items, committing them one by one: {}".format(
+                        len(self.pending), e))
+                    failed = True
+            committed = self.retry(self.pending) if failed else len(self.pending)
+            logging.info("Committed {} items ({:.2f} items/sec)".format(committed, self.get_throughput()))
+        self.pending = []
+        if self.journal is not None:
+            self.journal.seek(0)
+            self.journal.truncate()
+        self.last_commit = time.time()
+
+    def retry(self, items):
+        """
+        Add and commit the items of a discarded batch one at a time
+        :param items: the items to add
+        :return: the number of items committed
+        """
+        committed = 0
+        for item in items:
+            try:
+                self.graph.add(item)
+                self.graph.commit()
+                committed += 1
+            except (IntegrityError, InvalidRequestError) as e:
+                self.failed_count += 1
+                logging.error("Failed to write {} at {}, the item is lost: {}".format(
+                    item.__class__.__name__, item.get("wiki_page"), e))
+        return committed
+
+    def commit_if_due(self):
+        """
+        Commit the buffered items if they have been waiting for more than BATCH_INTERVAL seconds
+        """
+        if time.time() - self.last_commit >= BATCH_INTERVAL:
+            self.commit()
+
+    def get_throughput(self):
+        """
+        Get the number of items processed per second since the spider opens
+        :return: the throughput in items/sec
+        """
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        return (self.actor_count + self.movie_count) / elapsed if elapsed > 0 else 0
@@ -1,11 +1,14 @@
-import re
 from scrapy import Spider as ScrapySpider, Request
-from bs4 import BeautifulSoup
-from dateparser import parse as parse_date
 from .item import MovieItem, ActorItem
+from .extractor import ROOT, get_extractor, get_fingerprint
+from .url import canonicalize, is_red_link
+from database import db_session
 import config
+import math
+import os
 
-ROOT = "https://en.wikipedia.org"
+# serve the pages from the page store instead of downloading them
+REPLAY = config.CRAWL_MODE == "replay"
 
 
 class Spider(ScrapySpider):
@@ -21,7 +24,15 @@ class Spider(ScrapySpider):
         # source: https://github.com/alecxe/scrapy-fake-useragent
         "DOWNLOADER_MIDDLEWARES": {
             "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
-            "scrapy_fake_useragent.middleware.RandomUserAgentMiddleware": 400,
+            # (the fake user agents are fetched from the network, which is not used in replay)
+            "scrapy_fake_useragent.middleware.RandomUserAgentMiddleware": None if REPLAY else 400,
+            # record or replay the pages (see CRAWL_MODE)
+            "model.crawler.middleware.PageStoreMiddleware": 60,
+            # parse the pages in a pool of processes (if PARSE_PROCESSES > 0), once the
+            # other middlewares (retry, redirect, decompression...) are done with the response
+            "model.crawler.middleware.ParseMiddleware": 50,
+            # adapt the concurrency and the delay to the responses as they come from the network
+            "model.crawler.middleware.AdaptiveThrottleMiddleware": 950,
         },
         "ITEM_PIPELINES": {
             "model.crawler.pipeline.GraphPipeline": 300,
@@ -30,17 +41,43 @@ class Spider(ScrapySpider):
         # to shut down the spider
         "EXTENSIONS": {
             "scrapy.extensions.closespider.CloseSpider": 1,
+            "model.crawler.cache.HttpCacheStats": 500,
         },
         "CLOSESPIDER_ITEMCOUNT": config.CLOSE_ITEM_COUNT,
         "CLOSESPIDER_TIMEOUT": config.CLOSE_TIMEOUT,
         # avoid robot detection
         "COOKIES_ENABLED": False,
-        # delay between two consecutive request
-        "DOWNLOAD_DELAY": config.DELAY,
+        # delay between two consecutive request (the stored pages are served at full speed),
+        # adapted along with the concurrency by the AdaptiveThrottleMiddleware
+        "DOWNLOAD_DELAY": 0 if REPLAY else config.DELAY,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": config.CONCURRENCY,
+        "CONCURRENT_REQUESTS": max(config.CONCURRENCY, config.THROTTLE_MAX_CONCURRENCY),
+        # retry when rate limited, after the delay asked for by the server
+        "RETRY_HTTP_CODES": [500, 502, 503, 504, 522, 524, 408, 429],
+        # keep the pages on disk and revalidate them with conditional requests when crawling again
+        "HTTPCACHE_ENABLED": config.HTTP_CACHE_ENABLED and not REPLAY,
+        "HTTPCACHE_POLICY": "scrapy.extensions.httpcache.RFC2616Policy",
+        "HTTPCACHE_STORAGE": "model.crawler.cache.CompressedCacheStorage",
+        "HTTPCACHE_DIR": os.path.join(config.DIR_PATH, config.HTTP_CACHE_DIR),
+        "HTTPCACHE_MAX_SIZE": config.HTTP_CACHE_SIZE,
+        # keep the seen requests in a Bloom filter instead of a set of fingerprints
+        "DUPEFILTER_CLASS": "model.crawler.dupefilter.BloomDupeFilter",
+        "BLOOM_CAPACITY": config.DUPEFILTER_CAPACITY,
+        "BLOOM_ERROR_RATE": config.DUPEFILTER_ERROR_RATE,
+        "BLOOM_SAVE_INTERVAL": config.DUPEFILTER_SAVE_INTERVAL,
+        # crawl the pages close to START_URL first (see PAGE_PRIORITY for the other signals)
+        "DEPTH_PRIORITY": config.DEPTH_PRIORITY,
         # directory to store paused spider
         "JOBDIR": config.JOBDIR if config.RESUME else None,
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # the extractor getting the data out of the pages
+        self.extractor = get_extractor(config.PARSER)
+        # the graph built so far, used to follow the links of unchanged pages
+        self.graph = None
+
     def start_requests(self):
         """
         override default start_requests so that we can pass in is_movie information
@@ -70,20 +107,24 @@ class Spider(ScrapySpider):
         :param response: the response page
         :return: parsed ActorItem or Request
         """
-        try:
-            soup, name, link, info_box = self.parse_basic_info(response)
-            age = self.get_age(info_box)
+        node = self.get_unchanged_node(response)
+        if node is not None:
+            yield from self.follow_unchanged(response, node)
+            return
 
-            movies, filmography_list = self.get_movies(soup)
-            for movie_url in movies:
-                yield Request(ROOT + movie_url, meta={'is_movie': True, 'is_filmography': False})
-            for filmography in filmography_list:
-                yield Request(ROOT + filmography, meta={'is_movie': False, 'is_filmography': True})
-
-            # return the final parsed object
-            yield ActorItem(name=name, age=age, wiki_page=link)
+        try:
+            actor = self.extract("actor", response)
         except AttributeError:
             yield {}
+            return
+
+        yield from self.follow(actor["movies"], actor["filmographies"])
+
+        # return the final parsed object
+        wiki_page, aliases = self.get_wiki_page(response, actor)
+        yield ActorItem(name=actor["name"], age=actor["age"], wiki_page=wiki_page, aliases=aliases,
+                        fingerprint=response.meta.get("fingerprint"),
+                        links={"movies": actor["movies"], "filmographies": actor["filmographies"]})
 
     def parse_movie(self, response):
         """
@@ -91,31 +132,34 @@ class Spider(ScrapySpider):
         :param response: the response page
         :return: parsed MovieItem or Request
         """
+        node = self.get_unchanged_node(response)
+        if node is not None:
+            yield from self.follow_unchanged(response, node)
+            return
+
         try:
-            soup, name, link, info_box = self.parse_basic_info(response)
-            box_office = self.get_box_office(info_box)
-            starring = self.get_starring(info_box)
-            release_date = self.get_release_date(info_box)
-            yield MovieItem(name=name, box_office=box_office, wiki_page=link, actors=starring,
-                            release_date=release_date)
-
-            # generate new requests if there is box_office information
-            if box_office is not None:
-                for actor in starring:
-                    yield Request(ROOT + actor, meta={'is_movie': False, 'is_filmography': False})
+            movie = self.extract("movie", response)
         except AttributeError:
             yield {}
+            return
 
-    def parse_basic_info(self, response):
-        """
-        A helper function to parse the basic information on a page
-        :param response:
-        """
-        soup = BeautifulSoup(response.text, 'lxml')
-        name = re.sub(r"\(.*\)", "", soup.find(id="firstHeading").text).strip()
-        link = response.request.url[len(ROOT):]
-        info_box = soup.find("table", attrs={"class": "infobox"})
-        return soup, name, link, info_box
+        wiki_page, aliases = self.get_wiki_page(response, movie)
+        actors = self.resolve_all(movie["actors"])
+        # (counted before the movie itself is added to the graph)
+        movie_counts = self.get_graph().get_movie_counts([actor for actor in actors if actor is not None])
+        yield MovieItem(name=movie["name"], box_office=movie["box_office"], wiki_page=wiki_page, aliases=aliases,
+                        actors=[actor for actor in actors if actor is not None], release_date=movie["release_date"],
+                        fingerprint=response.meta.get("fingerprint"))
+
+        # generate new requests if there is box_office information
+        if movie["box_office"] is not None:
+            for actor_url, actor in zip(movie["actors"], actors):
+                # actors without article are kept in the movie, but their pages are not requested
+                if is_red_link(actor_url):
+                    self.crawler.stats.inc_value("url/filtered", spider=self)
+                elif actor is not None:
+                    priority = self.get_priority("actor", movie["box_office"], movie_counts.get(actor, 0))
+                    yield Request(ROOT + actor, priority=priority, meta={'is_movie': False, 'is_filmography': False})
 
     def parse_filmography(self, response):
         """
@@ -123,125 +167,189 @@ class Spider(ScrapySpider):
         :param response: the response page
         :return: parsed Requests
         """
-        urls = BeautifulSoup(response.text, 'lxml').find_all("a")
-        for url in urls:
-            if url.has_attr('href'):
-                # fetch each movies
-                yield Request(ROOT + url["href"], meta={'is_movie': True})
-
-    def get_movies(self, soup):
-        """
-        A helper method to get the url to movies from soup
-        :param soup: the beautiful soup object
-        :return: a list of movies
-        """
-        movies = []
-        filmography_list = []
-        filmography = soup.find("span", id="Filmography").find_parent("h2").find_next_sibling()
-        stop_token = "h2"
-
-        while filmography.name != stop_token:  # stop at next h2
-            # if contains film subsection, then read directly from there
-            films = filmography.find(id="Film")
-            if filmography.name == "h3" and films is not None:
-                stop_token = "h3"
-            urls = filmography.find_all("a")
-            for url in urls:
-                if url.has_attr('href') and not url["href"].startswith("#"):
-                    href = url["href"]
-                    # goes to filmography page instead
-                    if href.endswith("filmography"):
-                        filmography_list.append(href)
-                    else:
-                        movies.append(href)
-
-            filmography = filmography.find_next_sibling()
-
-        return movies, filmography_list
-
-    def get_age(self, info_box):
-        """
-        A helper method to get the age of current actor
-        :param info_box: info_box: the beautiful soup object for the info box
-        :return: age of the actor, or none if cannot find anything
-        """
-        # try to find the current age of actor, if he/she is still alive
         try:
-            age = info_box.find("span", attrs={"class": "noprint ForceAgeToShow"})
-            if age is not None:
-                # the actor is still alive
-                age = age.text
+            urls = self.extract("filmography", response)
+        except AttributeError:
+            return
+
+        # fetch each movies
+        yield from self.follow(urls)
+
+    def get_graph(self):
+        """
+        Get the graph built so far, used to follow the redirects and the links of unchanged pages
+        :return: the Graph
+        """
+        if self.graph is None:
+            # the graph module imports the crawler
+            from ..graph import Graph
+            self.graph = Graph(db_session)
+        return self.graph
+
+    def resolve(self, url):
+        """
+        Get the canonical wiki page a link leads to, following the known redirects
+        :param url: the link
+        :return: the wiki page, or None if the link does not lead to an article
+        """
+        return self.resolve_all([url])[0]
+
+    def resolve_all(self, urls):
+        """
+        Get the canonical wiki pages the links of a page lead to, following the known redirects
+        with one query
+        :param urls: the links
+        :return: list of the wiki pages, None for the links that do not lead to an article
+        """
+        wiki_pages = self.canonicalize_all(urls)
+        return self.redirect(wiki_pages, self.get_graph().get_redirects([page for page in wiki_pages if page]))
+
+    def canonicalize_all(self, urls):
+        """
+        Get the canonical wiki pages of links
+        :param urls: the links
+        :return: list of the wiki pages, None for the links that do not lead to an article
+        """
+        wiki_pages = [canonicalize(url) for url in urls]
+        if None in wiki_pages:
+            self.crawler.stats.inc_value("url/filtered", wiki_pages.count(None), spider=self)
+        return wiki_pages
+
+    def redirect(self, wiki_pages, redirects):
+        """
+        Follow the redirects of wiki pages
+        :param wiki_pages: the wiki pages (or None)
+        :param redirects: dict mapping the known redirects to the page they redirect to
+        :return: list of the wiki pages the pages lead to
+        """
+        aliased = sum(page in redirects for page in wiki_pages)
+        if aliased:
+            self.crawler.stats.inc_value("url/aliased", aliased, spider=self)
+        return [redirects.get(page, page) for page in wiki_pages]
+
+    def follow(self, movies=(), filmographies=()):
+        """
+        Create the requests following the links of a page to movies and filmographies, except
+        the links that do not lead to an article
+        :param movies: the links to movies
+        :param filmographies: the links to filmography pages
+        :return: list of the Requests
+        """
+        links = []
+        for url, is_movie in [(url, True) for url in movies] + [(url, False) for url in filmographies]:
+            if is_red_link(url):
+                self.crawler.stats.inc_value("url/filtered", spider=self)
             else:
-                # the actor is dead.. need to find the death information
-                age = info_box.find("span", attrs={"class": "dday deathdate"}) \
-                    .find_parent().find_next_sibling().previous_element
-            # gather all digits in age description (age xxx) or (aged xxx)
-            return int(re.search(r"aged?\D*(\d+)", age).group(1))
+                links.append((url, is_movie))
 
-        except AttributeError:
-            # cannot parse the age
-            return None
+        # the redirects, and the box offices of the movies crawled before, come with one query
+        wiki_pages = self.canonicalize_all([url for url, _ in links])
+        redirects, box_offices = self.get_graph().get_link_targets([page for page in wiki_pages if page])
+        requests = []
+        for (_, is_movie), wiki_page in zip(links, self.redirect(wiki_pages, redirects)):
+            if wiki_page is None:
+                continue
+            if is_movie:
+                priority = self.get_priority("movie", box_offices.get(wiki_page))
+            else:
+                priority = self.get_priority("filmography")
+            requests.append(Request(ROOT + wiki_page, priority=priority,
+                                    meta={'is_movie': is_movie, 'is_filmography': not is_movie}))
+        return requests
 
-    def get_box_office(self, info_box):
+    @staticmethod
+    def get_priority(page_type, box_office=None, movie_count=0):
         """
-        A helper method to get the box office of current film
-        :param info_box: the beautiful soup object for the info box
-        :return: gross box_office of the film, or none if cannot find anything
+        Get the priority of a request from cheap signals (see PAGE_PRIORITY), the depth of the
+        request being handled by the DepthMiddleware
+        :param page_type: "actor", "movie" or "filmography"
+        :param box_office: the box office of the movie the page comes from or leads to, if known
+        :param movie_count: the number of movies of the actor already in the graph
+        :return: the priority of the request (higher is crawled first)
         """
-        try:
-            box_office = info_box.find(text="Box office").find_parent() \
-                .find_next_sibling().next_element
-            return self.parse_currency(box_office)
-        except (AttributeError, TypeError):
-            return None
+        priority = config.PAGE_PRIORITY[page_type]
+        if box_office is not None and box_office >= 1e6:
+            # (at most 3 orders of magnitude, so that there are few priorities)
+            priority += min(int(math.log10(box_office / 1e6)), 3) * config.BOX_OFFICE_PRIORITY
+        return priority + min(movie_count, config.MAX_KNOWN_MOVIES) * config.KNOWN_PRIORITY
 
-    def get_starring(self, info_box):
+    def get_wiki_page(self, response, data):
         """
-        A helper method to get all actors for a given movie
-        :param info_box: the beautiful soup object for the info box
-        :return: a list of links to actors (in the same order as they are listed in wikipedia)
+        Get the wiki page of an actor or movie page, and the wiki pages redirecting to it
+        :param response: the response page
+        :param data: the extracted data of the page
+        :return: (wiki page, list of the aliases)
         """
-        try:
-            starring = info_box.find(text="Starring").find_parent("tr")
-            return [url["href"] for url in starring.find_all("a") if
-                    url.has_attr("href") and not url["href"].startswith("#")]
-        except AttributeError:
-            return []
+        requested = [canonicalize(url) for url in response.meta.get("redirect_urls", []) + [response.request.url]]
+        wiki_page = canonicalize(data.get("canonical") or "") or requested[-1] or data["wiki_page"]
+        return wiki_page, sorted({page for page in requested if page is not None and page != wiki_page})
 
-    def parse_currency(self, box_office):
+    def extract(self, page_type, response):
         """
-        A helper method to convert string representation of box_office to float that
-        represent the value
-        :param box_office: the string representation of box_office
-        :return: the box_office as float, or None if box_office cannot be parsed
+        Extract the data of the page, unless it is already extracted by the ParseMiddleware
+        :param page_type: "actor", "movie" or "filmography"
+        :param response: the response page
+        :return: the extracted data
         """
-        try:
-            # use regular expression to remove everything in parenthesis, if any
-            box_office = re.sub(r"[(\[].*[)\]]", "", box_office).strip()
-
-            # remove currency symbol, million/billion endings and comma
-            box_office_value = float(box_office.strip("$mbtrillion").replace(',', ''))
-
-            # augmented by the endings
-            if box_office.endswith("million"):
-                box_office_value *= 1e6
-            elif box_office.endswith("billion"):
-                box_office_value *= 1e9
-            elif box_office.endswith("trillion"):
-                box_office_value *= 1e12
-            return box_office_value
-
-        except ValueError:
-            return None
+        if "extracted" in response.meta:
+            data = response.meta.pop("extracted")
+            if data is None:
+                raise AttributeError("cannot parse {}".format(response.request.url))
+            return data
+        return getattr(self.extractor, "extract_" + page_type)(response.request.url, response.text)
 
-    def get_release_date(self, info_box):
+    def get_unchanged_node(self, response):
         """
-        a helper method to get the release date of the movie
-        :param info_box: the beautiful soup object of the info box
-        :return: the release date of the movie, or None if cannot parse
+        Get the node of an actor or movie page that has not changed since it was crawled, i.e.
+        the page is served or revalidated by the http cache, or its fingerprint is the one stored
+        with the node. Nodes that were not built from their page (such as the actors added with
+        a movie) have no fingerprint, and their page is parsed. The fingerprint of the page is
+        kept in response.meta["fingerprint"], and the result in response.meta["unchanged_node"],
+        so that the page is only checked once (by the ParseMiddleware, then the spider)
+        :param response: the response page
+        :return: the node, or None if the page has to be parsed
         """
-        try:
-            release_date = info_box.find("span", attrs={"class": "published"}).text
-            return parse_date(release_date)
-        except AttributeError:
+        # the graph module imports the crawler
+        from ..graph import Actor, Movie
+
+        if response.meta.get("is_filmography") and not response.meta.get("is_movie"):
             return None
+        if "unchanged_node" in response.meta:
+            return response.meta["unchanged_node"]
+        wiki_page = self.resolve(response.request.url) or response.request.url[len(ROOT):]
+        node = self.get_graph().find_node(Movie if response.meta.get("is_movie") else Actor, wiki_page=wiki_page)
+        if node is None or node.fingerprint is None or "cached" not in response.flags:
+            if "fingerprint" not in response.meta:
+                response.meta["fingerprint"] = get_fingerprint(response.text)
+            if node is not None and node.fingerprint != response.meta["fingerprint"]:
+                node = None
+        response.meta["unchanged_node"] = node
+        return node
+
+    def follow_unchanged(self, response, node):
+        """
+        Follow the links of an unchanged page from the graph, instead of parsing the page again:
+        the links of an actor page stored with the node, and the actors of a movie
+        :param response: the response page
+        :param node: the node of the page
+        :return: list of Requests
+        """
+        self.crawler.stats.inc_value("httpcache/unchanged", spider=self)
+        is_movie = response.meta["is_movie"]
+        if not is_movie:
+            links = node.get_links()
+            if links is not None:
+                return self.follow(links["movies"], links["filmographies"])
+            # (actors crawled before their links were stored only lead to their movies in the graph)
+            return [Request(ROOT + page, priority=self.get_priority("movie"),
+                            meta={'is_movie': True, 'is_filmography': False})
+                    for page in self.get_graph().get_neighbour_pages(node)]
+        pages = self.get_graph().get_neighbour_pages(node)
+        # only movies with box office information lead to their actors
+        if node.box_office is None:
+            return []
+        # (the movie itself is not counted)
+        movie_counts = self.get_graph().get_movie_counts(pages)
+        return [Request(ROOT + page, meta={'is_movie': False, 'is_filmography': False},
+                        priority=self.get_priority("actor", node.box_office, movie_counts.get(page, 1) - 1))
+                for page in pages]
@@ -0,0 +1,97 @@
+from urllib.parse import quote, urlsplit
+import hashlib
+import os
+
+# longer file names are replaced by their hash (most file systems allow 255 bytes)
+MAX_NAME_LENGTH = 200
+
+
+class PageStore:
+    """
+    A directory of crawled pages, keyed by their path on wikipedia (e.g. /wiki/Die_Hard).
+    Every page is stored as a html file, and every redirect as a file holding the path it
+    redirects to, so that the pages can be inspected and edited by hand
+    """
+
+    def __init__(self, directory):
+        """
+        Open the page store, creating the directory if needed
+        :param directory: the directory of the store
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(url):
+        """
+        Get the key of a page
+        :param url: the url (or path) of the page
+        :return: the path of the page, with its query but without fragment
+        """
+        parts = urlsplit(url)
+        return parts.path + ("?" + parts.query if parts.query else "")
+
+    def get_filename(self, key, extension):
+        """
+        Get the file storing the page (or redirect) of the given key
+        :param key: the key of the page
+        :param extension: ".html" for pages, ".redirect" for redirects
+        :return: the path of the file
+        """
+        name = quote(key, safe="")
+        if len(name) > MAX_NAME_LENGTH:
+            name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name + extension)
+
+    def get(self, url):
+        """
+        Get the page with the given url
+        :param url: the url (or path) of the page
+        :return: the html of the page as bytes, or None if the page is not in the store
+        """
+        try:
+            with open(self.get_filename(self.get_key(url), ".html"), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def get_redirect(self, url):
+        """
+        Get the path the given url redirects to
+        :param url: the url (or path) of the page
+        :return: the path the page redirects to, or None if the page is not a redirect
+        """
+        try:
+            with open(self.get_filename(self.get_key(url), ".redirect"), encoding="utf-8") as file:
+                return file.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, body):
+        """
+        Store a page
+        :param url: the url (or path) of the page
+        :param body: the html of the page as bytes
+        """
+        self.write(self.get_filename(self.get_key(url), ".html"), body)
+
+    def put_redirect(self, url, target):
+        """
+        Store a redirect
+        :param url: the url (or path) of the page
+        :param target: the url (or path) the page redirects to
+        """
+        self.write(self.get_filename(self.get_key(url), ".redirect"), self.get_key(target).encode("utf-8"))
+
+    @staticmethod
+    def write(filename, data):
+        """
+        Write the file atomically, so that a killed crawler does not leave partial pages
+        """
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "wb") as file:
+            file.write(data)
+        os.replace(temp_filename, filename)
+
+    def __len__(self):
+        return sum(1 for filename in os.listdir(self.directory) if filename.endswith(".html"))
@@ -0,0 +1,73 @@
+from urllib.parse import urlsplit, parse_qs, quote, unquote
+import re
+
+# hosts serving the articles of the english wikipedia
+HOSTS = ("", "en.wikipedia.org", "en.m.wikipedia.org")
+
+# namespaces of the pages that are not articles (the talk namespace of each of them is
+# "<namespace> talk"), see https://en.wikipedia.org/wiki/Wikipedia:Namespace
+NAMESPACES = {
+    "talk", "user", "wikipedia", "wp", "project", "file", "image", "mediawiki", "template", "help",
+    "category", "portal", "book", "draft", "education program", "timedtext", "module", "gadget",
+    "gadget definition", "special", "media",
+}
+
+# characters that wikipedia does not escape in the links to articles
+SAFE_CHARACTERS = ";@$!*(),/~:"
+
+
+def get_title(url):
+    """
+    A helper function to get the title of the article a link leads to
+    :param url: the link (absolute or relative to wikipedia)
+    :return: the title, or None if the link does not lead to an article of wikipedia
+    """
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    if parts.scheme not in ("", "http", "https") or parts.netloc not in HOSTS:
+        return None
+
+    if parts.path.startswith("/wiki/"):
+        title = parts.path[len("/wiki/"):]
+    elif parts.path == "/w/index.php":
+        # only links to missing articles (red links) are kept, not the history, diffs, etc.
+        query = parse_qs(parts.query)
+        if "title" not in query or not set(query) <= {"title", "action", "redlink"} \
+                or query.get("action", ["edit"]) != ["edit"]:
+            return None
+        title = query["title"][0]
+    else:
+        return None
+
+    # titles are case sensitive except for the first letter, and spaces are underscores
+    title = re.sub(r"[ _]+", "_", unquote(title)).strip("_")
+    if not title:
+        return None
+    namespace = title.split(":", 1)[0].replace("_", " ").lower() if ":" in title else None
+    if namespace is not None and (namespace in NAMESPACES or namespace.endswith(" talk")):
+        return None
+    return title[0].upper() + title[1:]
+
+
+def canonicalize(url):
+    """
+    Get the canonical path of the article a link leads to, so that all links to an article
+    are the same
+    :param url: the link (absolute or relative to wikipedia)
+    :return: the path of the article (/wiki/...), or None if the link does not lead to an article
+    """
+    title = get_title(url)
+    if title is None:
+        return None
+    return "/wiki/" + quote(title, safe=SAFE_CHARACTERS)
+
+
+def is_red_link(url):
+    """
+    Check whether the link leads to a missing article
+    :param url: the link
+    :return: True if the article does not exist
+    """
+    return "redlink=1" in urlsplit(url).query.split("&")
@@ -1,7 +1,8 @@
 from .edge import Edge
 from .movie import Movie
 from .actor import Actor
+from .redirect import Redirect
 from .graph import Graph
 
 # export the class itself instead of the file
-__all__ = ["Edge", "Movie", "Actor", "Graph"]
+__all__ = ["Edge", "Movie", "Actor", "Redirect", "Graph"]
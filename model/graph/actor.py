@@ -1,8 +1,9 @@
-from sqlalchemy import Column, Integer, Text, Float
+from sqlalchemy import Column, Integer, Text, Float, Index, func
 from sqlalchemy.orm import relationship
 from database import Base
 from .util import get_wiki_page
 from model.crawler import ActorItem
+import json
 
 
 class Actor(Base):
@@ -19,6 +20,24 @@ class Actor(Base):
     wiki_page = Column(Text, unique=True)
     age = Column(Integer)
     total_gross = Column(Float)
+    # fingerprint of the content of the page the actor is crawled from
+    fingerprint = Column(Text)
+    # links of the page to movies and filmographies (JSON), to follow when the page is unchanged
+    links = Column(Text)
+
+    # indexes for looking up actors by name, case sensitive or not, and for ranking them
+    __table_args__ = (
+        Index("ix_actor_name", name),
+        Index("ix_actor_name_lower", func.lower(name)),
+        Index("ix_actor_total_gross", total_gross),
+        Index("ix_actor_age", age),
+    )
+
+    # the data fields that can be set from an item
+    FIELDS = ("name", "age", "total_gross", "wiki_page", "fingerprint", "links")
+
+    # the fields the actors can be ranked by (each has an index)
+    RANK_FIELDS = ("total_gross", "age")
 
     # relationship to movies
     movies = relationship("Edge", back_populates="actor", cascade="all, delete-orphan")
@@ -37,12 +56,35 @@ class Actor(Base):
         Update current actor node using other actor node
         :param item: the item or dict representing other actor
         """
+        values = self.merge({field: getattr(self, field) for field in self.FIELDS}, item)
+        for field, value in values.items():
+            setattr(self, field, value)
+
+    @staticmethod
+    def merge(values, item):
+        """
+        Merge other actor node into the column values of an actor, the same way as update
+        :param values: dict of the column values (FIELDS) of the actor, modified in place
+        :param item: the item or dict representing other actor
+        :return: the merged values
+        """
         if not (isinstance(item, ActorItem) or isinstance(item, dict)):
-            return
-        self.name = item.get("name", self.name)
-        self.age = item.get("age", self.age)
-        self.total_gross = item.get("total_gross", 0 if self.total_gross is None else self.total_gross)
-        self.wiki_page = get_wiki_page(item.get("wiki_page", self.wiki_page))
+            return values
+        values["name"] = item.get("name", values["name"])
+        values["age"] = item.get("age", values["age"])
+        values["total_gross"] = item.get("total_gross", 0 if values["total_gross"] is None else values["total_gross"])
+        values["wiki_page"] = get_wiki_page(item.get("wiki_page", values["wiki_page"]))
+        values["fingerprint"] = item.get("fingerprint", values["fingerprint"])
+        links = item.get("links", values["links"])
+        values["links"] = json.dumps(links, sort_keys=True) if isinstance(links, dict) else links
+        return values
+
+    def get_links(self):
+        """
+        Get the links of the page of the actor, stored when it was crawled
+        :return: dict of the lists of "movies" and "filmographies" links, or None if they are unknown
+        """
+        return json.loads(self.links) if self.links else None
 
     def __repr__(self):
         """
@@ -51,16 +93,20 @@ class Actor(Base):
         """
         return '<{} "{}">'.format(self.__class__.__name__, self.name)
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         """
         A method to convert Actor class do dict
+        :param fields: the list of fields to include, or None to include all fields
         :return: a dictionary represents a Actor
         """
-        return {
+        values = {
             "id": self.id,
             "name": self.name,
             "wiki_page": self.wiki_page,
             "age": self.age,
             "total_gross": self.total_gross,
-            "movies": [edge.movie.name for edge in self.movies if edge.movie.name is not None],
         }
+        # the related movies are only loaded if needed
+        if fields is None or "movies" in fields:
+            values["movies"] = [edge.movie.name for edge in self.movies if edge.movie.name is not None]
+        return values if fields is None else {field: values[field] for field in fields if field in values}
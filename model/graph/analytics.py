@@ -0,0 +1,255 @@
+import numpy as np
+import threading
+
+
+class CSRGraph:
+    """
+    A compact in-memory copy of the actor-movie graph for analytics. Actors and movies are
+    numbered densely (in the order of their ids), and the edges are stored as compressed
+    sparse rows (CSR): the neighbours of actor i are
+    actor_movies[actor_indptr[i]:actor_indptr[i + 1]], and likewise for the movies.
+    The co-star graph (actors sharing at least one movie) is stored the same way, once it is needed
+    """
+
+    def __init__(self, actor_ids, movie_ids, edges):
+        """
+        Build the graph from the node ids and the edges
+        :param actor_ids: sorted array of the ids of all actors
+        :param movie_ids: sorted array of the ids of all movies
+        :param edges: array of shape (n, 2) holding the (actor_id, movie_id) of every edge
+        """
+        self.actor_ids = actor_ids
+        self.movie_ids = movie_ids
+
+        # map the ids to dense indices, dropping the edges to unknown nodes
+        actors = np.searchsorted(actor_ids, edges[:, 0])
+        movies = np.searchsorted(movie_ids, edges[:, 1])
+        valid = (actors < len(actor_ids)) & (movies < len(movie_ids))
+        valid[valid] = (actor_ids[actors[valid]] == edges[valid, 0]) & (movie_ids[movies[valid]] == edges[valid, 1])
+        actors = actors[valid]
+        movies = movies[valid]
+
+        self.actor_indptr, self.actor_movies = to_csr(actors, movies, len(actor_ids))
+        self.movie_indptr, self.movie_actors = to_csr(movies, actors, len(movie_ids))
+        # the co-star graph, (indptr, indices) in CSR, projected the first time it is needed
+        self.costars = None
+
+        # the arrays of the two sides of shortest_path, allocated on the first search and
+        # reused by the next ones (one search at a time)
+        self.searches = None
+        self.search_lock = threading.Lock()
+
+    @classmethod
+    def build(cls, session):
+        """
+        Read the graph from the database, with one scan of each table
+        :param session: the database session
+        :return: the CSRGraph
+        """
+        actor_ids = np.array([row[0] for row in session.execute("SELECT id FROM actor ORDER BY id")],
+                             dtype=np.int64)
+        movie_ids = np.array([row[0] for row in session.execute("SELECT id FROM movie ORDER BY id")],
+                             dtype=np.int64)
+        edges = np.array(session.execute("SELECT actor_id, movie_id FROM edge").fetchall(),
+                         dtype=np.int64).reshape(-1, 2)
+        return cls(actor_ids, movie_ids, edges)
+
+    def project(self):
+        """
+        Compute the co-star graph, where two actors are connected if they share a movie
+        :return: (indptr, indices) of the co-star graph in CSR
+        """
+        n = len(self.actor_ids)
+        if n == 0:
+            return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        degrees = np.diff(self.movie_indptr)
+        # pair every edge (movie, actor) with every actor of the same movie
+        edge_movies = np.repeat(np.arange(len(self.movie_ids)), degrees)
+        pair_counts = degrees[edge_movies]
+        sources = np.repeat(self.movie_actors, pair_counts)
+        offsets = np.arange(pair_counts.sum()) - np.repeat(np.cumsum(pair_counts) - pair_counts, pair_counts)
+        targets = self.movie_actors[np.repeat(self.movie_indptr[edge_movies], pair_counts) + offsets]
+
+        # drop self loops and duplicated pairs
+        keep = sources != targets
+        pairs = np.unique(sources[keep] * n + targets[keep])
+        return to_csr(pairs // n, pairs % n, n)
+
+    def get_actor_index(self, actor_id):
+        """
+        Get the dense index of the actor
+        :param actor_id: id of the actor
+        :return: the index, or None if the actor is not in the graph
+        """
+        index = np.searchsorted(self.actor_ids, actor_id)
+        if index < len(self.actor_ids) and self.actor_ids[index] == actor_id:
+            return int(index)
+
+    def get_costar_counts(self):
+        """
+        Get the number of co-stars of every actor
+        :return: array of the number of co-stars, indexed like actor_ids
+        """
+        if self.costars is None:
+            self.costars = self.project()
+        return np.diff(self.costars[0])
+
+    def shortest_path(self, source, target, max_depth):
+        """
+        Find a shortest chain of co-stars between two actors, with a breadth first search
+        growing from both actors at once over the actor-movie edges, one level at a time
+        from the side with the smaller frontier
+        :param source: index of the first actor
+        :param target: index of the second actor
+        :param max_depth: the maximum number of movies in the chain
+        :return: list of the indices of the chain, alternating actors and movies from source
+         to target, or None if the actors are more than max_depth movies apart
+        """
+        if source == target:
+            return [source]
+        with self.search_lock:
+            if self.searches is None:
+                self.searches = (Search(self), Search(self))
+            sides = list(self.searches)
+            sides[0].start(source)
+            sides[1].start(target)
+            try:
+                return self.meet(sides, max_depth)
+            finally:
+                sides[0].reset()
+                sides[1].reset()
+
+    @staticmethod
+    def meet(sides, max_depth):
+        """
+        Expand the two sides of the search until they reach a common node
+        :param sides: the two Search, started from the source and the target
+        :param max_depth: the maximum number of movies in the chain
+        :return: the chain (see shortest_path), or None
+        """
+        while sides[0].depth + sides[1].depth < 2 * max_depth:
+            side = 0 if len(sides[0].frontier) <= len(sides[1].frontier) else 1
+            search, other = sides[side], sides[1 - side]
+            if not search.expand():
+                return None
+            # the nodes reached by both sides, the path goes through the closest one to the other side
+            distances = other.distances[search.is_movie][search.frontier]
+            met = np.flatnonzero(distances >= 0)
+            if len(met):
+                node = int(search.frontier[met[np.argmin(distances[met])]])
+                path = search.get_path(node, search.is_movie)[::-1] + other.get_path(node, search.is_movie)[1:]
+                return path if side == 0 else path[::-1]
+        return None
+
+
+class Search:
+    """
+    One side of the bidirectional search of CSRGraph.shortest_path
+    """
+
+    def __init__(self, graph):
+        """
+        Allocate the arrays of the search
+        :param graph: the CSRGraph
+        """
+        self.graph = graph
+        # indexed by is_movie (the actors, then the movies): the distance, in edges, of the
+        # reached nodes from the start (-1 for the others), and the node they were reached from
+        self.distances = [np.full(len(graph.actor_ids), -1, dtype=np.int64),
+                          np.full(len(graph.movie_ids), -1, dtype=np.int64)]
+        self.parents = [np.zeros(len(graph.actor_ids), dtype=np.int64),
+                        np.zeros(len(graph.movie_ids), dtype=np.int64)]
+        self.frontier = None
+        self.is_movie = 0
+        self.depth = 0
+        # the frontiers of every level, to reset the distances of their nodes afterwards
+        self.reached = []
+
+    def start(self, node):
+        """
+        Start the search from an actor
+        :param node: index of the actor
+        """
+        self.frontier = np.array([node], dtype=np.int64)
+        self.distances[0][node] = 0
+        self.is_movie = 0
+        self.depth = 0
+        self.reached = [(0, self.frontier)]
+
+    def reset(self):
+        """
+        Forget the nodes reached, so that the arrays can be used by the next search
+        """
+        for is_movie, nodes in self.reached:
+            self.distances[is_movie][nodes] = -1
+        self.reached = []
+
+    def expand(self):
+        """
+        Reach the nodes linked to the frontier that were not reached yet, which become the frontier
+        :return: whether any node was reached
+        """
+        if self.is_movie:
+            indptr, indices = self.graph.movie_indptr, self.graph.movie_actors
+        else:
+            indptr, indices = self.graph.actor_indptr, self.graph.actor_movies
+        starts = indptr[self.frontier]
+        counts = indptr[self.frontier + 1] - starts
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        neighbours = indices[np.repeat(starts, counts) + offsets]
+        parents = np.repeat(self.frontier, counts)
+
+        self.is_movie = 1 - self.is_movie
+        self.depth += 1
+        distances = self.distances[self.is_movie]
+        new = distances[neighbours] < 0
+        # keep one parent for each node reached
+        self.frontier, first = np.unique(neighbours[new], return_index=True)
+        distances[self.frontier] = self.depth
+        self.parents[self.is_movie][self.frontier] = parents[new][first]
+        self.reached.append((self.is_movie, self.frontier))
+        return len(self.frontier) > 0
+
+    def get_path(self, node, is_movie):
+        """
+        Follow the parents from a reached node back to the start
+        :param node: index of the node
+        :param is_movie: whether the node is a movie
+        :return: list of the indices of the nodes, from the node to the start
+        """
+        path = [node]
+        while self.distances[is_movie][node] > 0:
+            node = int(self.parents[is_movie][node])
+            is_movie = 1 - is_movie
+            path.append(node)
+        return path
+
+
+def to_csr(rows, columns, n):
+    """
+    Convert a list of (row, column) pairs to compressed sparse rows
+    :param rows: array of the row of each pair
+    :param columns: array of the column of each pair
+    :param n: the number of rows
+    :return: (indptr, indices), where the columns of row i are indices[indptr[i]:indptr[i + 1]], sorted
+    """
+    order = np.lexsort((columns, rows))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+    return indptr, columns[order]
+
+
+def get_nodes(session, cls, ids, chunk_size=500):
+    """
+    Get the nodes with the given ids, a few hundred at a time
+    :param session: the database session
+    :param cls: the class of the nodes, Actor or Movie
+    :param ids: the ids of the nodes
+    :param chunk_size: the number of ids queried at once
+    :return: a dict mapping the ids to the nodes
+    """
+    ids = [int(node_id) for node_id in ids]
+    nodes = {}
+    for start in range(0, len(ids), chunk_size):
+        nodes.update((node.id, node) for node in session.query(cls).filter(cls.id.in_(ids[start:start + chunk_size])))
+    return nodes
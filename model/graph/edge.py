@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, Boolean, ForeignKey, Float
+from sqlalchemy import Column, Integer, Text, Boolean, ForeignKey, Float, Index
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -19,6 +19,11 @@ class Edge(Base):
     movie = relationship("Movie", back_populates="actors")
     actor = relationship("Actor", back_populates="movies")
 
+    # the primary key indexes edges by movie, this one indexes them by actor
+    __table_args__ = (
+        Index("ix_edge_actor_movie", actor_id, movie_id),
+    )
+
     def __repr__(self):
         """
         Representation of the node
@@ -1,11 +1,29 @@
 from sqlalchemy.orm.scoping import scoped_session
+from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import IntegrityError, InvalidRequestError
-from sqlalchemy import extract, func, and_
-from operator import itemgetter
-import matplotlib.pyplot as plt
+from sqlalchemy import func, and_, or_, select, literal, union_all, inspect
+import numpy as np
 import json
-from model.graph import Actor, Movie, Edge
+import logging
+import time
+from model.graph import Actor, Movie, Edge, Redirect
+from .util import LRUCache
+from .loader import BulkLoader
+from .stream import StreamLoader, dump as dump_stream
 from ..crawler import ActorItem, MovieItem
+from .analytics import CSRGraph, get_nodes
+from .search import search as search_nodes
+from config import LOOKUP_CACHE_SIZE, ANALYTICS_TTL, PATH_MAX_DEPTH, PATH_CACHE_SIZE
+
+# load the edges and the nodes related to the queried nodes (e.g. for to_dict) with
+# one query each, instead of one query per node
+RELATED_NODES = {
+    Actor: selectinload(Actor.movies).selectinload(Edge.movie),
+    Movie: selectinload(Movie.actors).selectinload(Edge.actor),
+}
+
+# default value of the cache lookups, as None is a cached value
+MISSING = object()
 
 
 class Graph:
@@ -13,12 +31,14 @@ class Graph:
     The graph class that holds all nodes and edges
     """
 
-    def __init__(self, session=None):
+    def __init__(self, session=None, batch=False):
         """
         Initialize the graph with two kinds of nodes
         :param session: the database session. If None is given,
         then the graph will creates its own session (remember to
         close the graph)
+        :param batch: whether to buffer the changes until commit() is called, instead
+        of committing every node and edge right away
         """
         if session is None:
             from database import db_session
@@ -28,6 +48,18 @@ class Graph:
             if not isinstance(session, scoped_session):
                 raise TypeError("'session' must be a scoped database session")
             self.session = session
+        self.batch = batch
+
+        # map ("name" or "wiki_page", value) to the node, which keeps it in the session (whose
+        # identity map only holds weak references) so that lookups can skip the query
+        self.cache = {Actor: LRUCache(LOOKUP_CACHE_SIZE), Movie: LRUCache(LOOKUP_CACHE_SIZE)}
+
+        # in-memory copy of the graph for analytics, built on demand
+        self.analytics = None
+        self.analytics_time = 0
+        # map (actor id, actor id, max depth) to the ids along the shortest path, for the
+        # current copy of the graph
+        self.path_cache = LRUCache(PATH_CACHE_SIZE)
 
     def __enter__(self):
         """
@@ -62,19 +94,19 @@ class Graph:
         """
         if actor is None:
             # check if the given actor already existed, search by name or wiki page
-            actor = self.get_actors(name=actor_item.get("name")).first() if external \
-                else self.get_actors(wiki_page=actor_item.get("wiki_page")).first()
+            actor = self.find_node(Actor, name=actor_item.get("name")) if external \
+                else self.find_node(Actor, wiki_page=actor_item.get("wiki_page"))
 
         if actor is None:
             actor = Actor(actor_item)
         else:
+            # the name or wiki page might change
+            self.uncache_node(actor)
             actor.update(actor_item)
         self.session.add(actor)
 
-        try:
-            self.session.commit()
-        except (IntegrityError, InvalidRequestError):  # unlikely to happen, but just in case
-            self.session.rollback()
+        self.save(actor)
+        self.add_redirects(actor, actor_item.get("aliases"))
 
         movies = actor_item.get("movies")
         if isinstance(movies, list):
@@ -91,19 +123,19 @@ class Graph:
         :param movie: the movie object to receive updates
         """
         if movie is None:
-            movie = self.get_movies(name=movie_item.get("name")).first() if external \
-                else self.get_movies(wiki_page=movie_item.get("wiki_page")).first()
+            movie = self.find_node(Movie, name=movie_item.get("name")) if external \
+                else self.find_node(Movie, wiki_page=movie_item.get("wiki_page"))
 
         if movie is None:
             movie = Movie(movie_item)
         else:
+            # the name or wiki page might change
+            self.uncache_node(movie)
             movie.update(movie_item)
         self.session.add(movie)
 
-        try:
-            self.session.commit()
-        except (IntegrityError, InvalidRequestError):  # unlikely to happen, but just in case
-            self.session.rollback()
+        self.save(movie)
+        self.add_redirects(movie, movie_item.get("aliases"))
 
         # add relationship to actors
         # the nth actor have 2 * (m + 1 - n) / (m * (m + 1)) of the movies gross income
@@ -129,20 +161,20 @@ class Graph:
         """
         if actor is None:
             actor_dict = {key[len("actor_"):]: val for key, val in kwargs.items() if key.startswith("actor_")}
-            actor = self.get_actors(**actor_dict).first()
+            actor = self.find_node(Actor, **actor_dict)
             # non exists
             if actor is None:
                 actor = Actor(actor_dict)
         if movie is None:
             movie_dict = {key[len("movie_"):]: val for key, val in kwargs.items() if key.startswith("movie_")}
-            movie = self.get_movies(**movie_dict).first()
+            movie = self.find_node(Movie, **movie_dict)
             # non exists
             if movie is None:
                 movie = Movie(movie_dict)
 
-        # find edge
-
-        edge = Edge.query.filter_by(movie=movie, actor=actor).first() if movie.id and actor.id else None
+        # find edge (the primary key of edge is (movie_id, actor_id)), an edge that is
+        # already in the session is returned without querying the database
+        edge = self.session.query(Edge).get((movie.id, actor.id)) if movie.id and actor.id else None
         if edge is None:
             edge = Edge(actor=actor, movie=movie, income=value)
         elif value is not None:
@@ -156,33 +188,264 @@ class Graph:
         self.session.add(actor)
         self.session.add(edge)
 
+        self.save(actor, movie)
+
+        return edge
+
+    def save(self, *nodes):
+        """
+        Write the pending changes to the database. The changes are committed right away,
+        unless the graph is in batch mode, in which case they are only flushed (so that
+        later lookups can see them) and committed together by commit()
+        :param nodes: the nodes to remember in the lookup cache once they are written
+        """
+        try:
+            self.session.flush()
+        except (IntegrityError, InvalidRequestError):  # unlikely to happen, but just in case
+            self.rollback()
+            if self.batch:
+                # every uncommitted change is discarded, which the caller has to know about
+                raise
+            logging.warning("Failed to save {}".format(", ".join(str(node.wiki_page) for node in nodes)))
+            return
+
+        for node in nodes:
+            self.cache_node(node)
+        self.analytics = None
+        if not self.batch:
+            try:
+                self.commit()
+            except (IntegrityError, InvalidRequestError):
+                logging.warning("Failed to save {}".format(", ".join(str(node.wiki_page) for node in nodes)))
+
+    def commit(self):
+        """
+        Commit all changes made since the last commit in a single transaction. If the
+        commit fails, the changes are discarded and the error is raised again
+        """
         try:
             self.session.commit()
         except (IntegrityError, InvalidRequestError):  # unlikely to happen, but just in case
-            self.session.rollback()
+            self.rollback()
+            raise
+
+    def rollback(self):
+        """
+        Discard all changes made since the last commit
+        """
+        self.session.rollback()
+        # the cached ids might belong to the discarded nodes
+        for cache in self.cache.values():
+            cache.clear()
+        self.analytics = None
+
+    def find_node(self, cls, **kwargs):
+        """
+        Find the first node matching the filter. Lookups by a single name or wiki page
+        go through the lookup cache, which finds the node without a query while it is loaded
+        in the session (between the commits of a batch, since a commit expires the nodes)
+        :param cls: the class of the node, Actor or Movie
+        :param kwargs: the filter used to select the node
+        :return: the node, or None if no node matches
+        """
+        if len(kwargs) != 1 or not ("name" in kwargs or "wiki_page" in kwargs):
+            return self.session.query(cls).filter_by(**kwargs).first()
+
+        key = next(iter(kwargs.items()))
+        cache = self.cache[cls]
+        node = cache.get(key)
+        if node is not None:
+            state = inspect(node)
+            # the expired (or detached) nodes would be loaded again, which costs as much as the lookup below
+            if state.persistent and state.session_id == self.session().hash_key and key[0] not in state.unloaded:
+                # the node might have been renamed elsewhere
+                if getattr(node, key[0]) == key[1]:
+                    return node
+                cache.pop(key)
+
+        node = self.session.query(cls).filter_by(**kwargs).first()
+        if node is not None:
+            self.cache_node(node)
+        return node
+
+    def cache_node(self, node):
+        """
+        Remember the node by its name and wiki page
+        :param node: the Actor or Movie object, which must have been flushed
+        """
+        cache = self.cache[type(node)]
+        for field in ("name", "wiki_page"):
+            value = getattr(node, field)
+            if value is not None:
+                cache.put((field, value), node)
+
+    def uncache_node(self, node):
+        """
+        Forget the node in the lookup cache
+        :param node: the Actor or Movie object
+        """
+        cache = self.cache[type(node)]
+        for field in ("name", "wiki_page"):
+            cache.pop((field, getattr(node, field)))
+
+    def get_redirect(self, wiki_page):
+        """
+        Get the page the given wiki page redirects to
+        :param wiki_page: the wiki page
+        :return: the wiki page it redirects to, or None if it is not a known redirect
+        """
+        return self.session.query(Redirect.target).filter(Redirect.source == wiki_page).scalar()
+
+    def get_redirects(self, wiki_pages):
+        """
+        Get the pages many wiki pages redirect to, with one query
+        :param wiki_pages: the wiki pages
+        :return: dict mapping the wiki pages that are known redirects to the page they redirect to
+        """
+        if not wiki_pages:
+            return {}
+        return dict(self.session.query(Redirect.source, Redirect.target).filter(Redirect.source.in_(set(wiki_pages))))
+
+    def get_link_targets(self, wiki_pages):
+        """
+        Get the pages many wiki pages redirect to, and the box offices of the movies they lead
+        to, with one query
+        :param wiki_pages: the wiki pages
+        :return: (dict mapping the known redirects to the page they redirect to, dict mapping
+         the wiki pages of the movies in the graph, after the redirects, to their box office)
+        """
+        if not wiki_pages:
+            return {}, {}
+        wiki_pages = set(wiki_pages)
+        redirects = select([literal("redirect"), Redirect.source, Redirect.target]) \
+            .where(Redirect.source.in_(wiki_pages))
+        targets = select([Redirect.target]).where(Redirect.source.in_(wiki_pages))
+        movies = select([literal("movie"), Movie.wiki_page, Movie.box_office]) \
+            .where(or_(Movie.wiki_page.in_(wiki_pages), Movie.wiki_page.in_(targets)))
+        targets, box_offices = {}, {}
+        for kind, wiki_page, value in self.session.execute(union_all(redirects, movies)):
+            if kind == "redirect":
+                targets[wiki_page] = value
+            else:
+                box_offices[wiki_page] = value
+        return targets, box_offices
 
-        return edge
+    def add_redirects(self, node, sources):
+        """
+        Record that the given wiki pages redirect to the page of the node. The nodes of these
+        pages (e.g. created by the edges of movies linking to a redirect) are merged into the node
+        :param node: the Actor or Movie object
+        :param sources: list of the wiki pages redirecting to the page of the node
+        """
+        if not sources or node.wiki_page is None:
+            return
+        for source in sources:
+            if source is None or source == node.wiki_page:
+                continue
+            redirect = self.session.query(Redirect).get(source)
+            if redirect is None:
+                redirect = Redirect(source=source)
+            redirect.target = node.wiki_page
+            self.session.add(redirect)
+            # redirects to the source now lead to the node
+            self.session.query(Redirect).filter(Redirect.target == source) \
+                .update({Redirect.target: node.wiki_page}, synchronize_session=False)
+
+            alias = self.find_node(type(node), wiki_page=source)
+            if alias is not None and alias is not node:
+                self.merge_nodes(alias, node)
+        self.save(node)
+
+    def merge_nodes(self, source, target):
+        """
+        Merge a node into another node of the same class, moving its edges. The target keeps
+        its values, and its own edge when both nodes are linked to the same node
+        :param source: the Actor or Movie object to merge, which is deleted
+        :param target: the Actor or Movie object receiving the edges
+        """
+        is_actor = isinstance(target, Actor)
+        edges = (lambda node: node.movies) if is_actor else (lambda node: node.actors)
+        linked = {edge.movie_id if is_actor else edge.actor_id for edge in edges(target)}
+        for edge in list(edges(source)):
+            actor, movie, income = edge.actor, edge.movie, edge.income
+            # detach the edge from the other node too, so that it is deleted as an orphan
+            (movie.actors if is_actor else actor.movies).remove(edge)
+            if (movie.id if is_actor else actor.id) in linked:
+                # the income of the dropped edge no longer counts for its actor
+                if not is_actor and income:
+                    actor.total_gross -= income
+            elif is_actor:
+                self.session.add(Edge(actor=target, movie=movie, income=income))
+                if income:
+                    target.total_gross = (target.total_gross or 0) + income
+            else:
+                self.session.add(Edge(actor=actor, movie=target, income=income))
+        self.uncache_node(source)
+        self.session.delete(source)
+
+    def get_analytics(self):
+        """
+        Get the in-memory copy of the graph for analytics. It is rebuilt after the graph
+        changes, or after ANALYTICS_TTL seconds for changes made elsewhere
+        :return: the CSRGraph
+        """
+        if self.analytics is None or time.time() - self.analytics_time > ANALYTICS_TTL:
+            self.analytics = CSRGraph.build(self.session)
+            self.analytics_time = time.time()
+            self.path_cache.clear()
+        return self.analytics
+
+    def get_cache_stats(self):
+        """
+        Get the statistics of the lookup caches
+        :return: a dict containing the hits, misses and size of the actor and movie caches
+        """
+        return {"actor": self.cache[Actor].get_stats(), "movie": self.cache[Movie].get_stats()}
 
     @classmethod
-    def load(cls, filename, session=None):
+    def load(cls, filename, session=None, bulk=True):
         """
         Load the graph from given file
         :param filename: the file to load the graph
+        :param session: the database session
+        :param bulk: whether to insert the nodes and edges with bulk statements in one
+        transaction, instead of adding them one by one (only used by the legacy format,
+        the newline-delimited format is always loaded in bulk)
         :return: the graph loaded
         """
         with open(filename) as file:
+            # the legacy format is a single json list of [actors, movies]
+            if not file.read(64).lstrip().startswith("["):
+                file.seek(0)
+                graph = Graph(session)
+                StreamLoader(graph.session).load(file)
+                return graph
+
+            file.seek(0)
             decoded = json.load(file)
             if isinstance(decoded, list) and len(decoded) == 2:
                 actors, movies = decoded
                 graph = Graph(session)
                 movies = movies.values() if isinstance(movies, dict) else movies
                 actors = actors.values() if isinstance(actors, dict) else actors
+                if bulk:
+                    BulkLoader(graph.session).load(actors, movies)
+                    return graph
                 for movie in movies:
                     graph.add_movie(movie, external=True)
                 for actor in actors:
                     graph.add_actor(actor, external=True)
                 return graph
 
+    def dump(self, filename):
+        """
+        Write the graph to the given file as newline-delimited json, which can be read
+        back with load()
+        :param filename: the file to write the graph
+        """
+        with open(filename, "w") as file:
+            dump_stream(self.session, file)
+
     @staticmethod
     def get_movies(**kwargs):
         """
@@ -208,7 +471,8 @@ class Graph:
         :param name: name of the actor, case insensitive
         :return: the first actor with matching name
         """
-        return Actor.query.filter(func.lower(Actor.name) == func.lower(name)).first()
+        return Actor.query.options(RELATED_NODES[Actor]) \
+            .filter(func.lower(Actor.name) == func.lower(name)).first()
 
     @staticmethod
     def get_movie(name):
@@ -217,7 +481,8 @@ class Graph:
         :param name: name of the movie, case insensitive
         :return: the first movie with matching name
         """
-        return Movie.query.filter(func.lower(Movie.name) == func.lower(name)).first()
+        return Movie.query.options(RELATED_NODES[Movie]) \
+            .filter(func.lower(Movie.name) == func.lower(name)).first()
 
     def delete_actor(self, actor):
         """
@@ -225,12 +490,85 @@ class Graph:
         :param actor:
         :return:
         """
+        self.uncache_node(actor)
         self.session.delete(actor)
         self.session.commit()
+        self.analytics = None
 
     def delete_movie(self, movie):
+        """
+        helper method to delete the given Movie object, taking the income of its edges
+        off the total gross of its actors
+        :param movie:
+        """
+        self.session.flush()
+        income = select([Edge.income]).where(and_(Edge.actor_id == Actor.id, Edge.movie_id == movie.id)).as_scalar()
+        self.session.query(Actor) \
+            .filter(Actor.id.in_(select([Edge.actor_id]).where(Edge.movie_id == movie.id))) \
+            .update({Actor.total_gross: func.coalesce(Actor.total_gross, 0) - func.coalesce(income, 0)},
+                    synchronize_session=False)
+        self.expire_total_gross()
+        self.uncache_node(movie)
         self.session.delete(movie)
         self.session.commit()
+        self.analytics = None
+
+    def recompute_total_gross(self, actor_ids=None):
+        """
+        Set the total gross of the actors to the sum of the income of their edges, in a single
+        UPDATE statement for each batch of actors
+        :param actor_ids: the ids of the actors to update (e.g. from get_gross_drift), or None for all
+        :return: the number of updated actors
+        """
+        self.session.flush()
+        income = select([func.coalesce(func.sum(Edge.income), 0)]).where(Edge.actor_id == Actor.id).as_scalar()
+        if actor_ids is None:
+            count = self.session.query(Actor).update({Actor.total_gross: income}, synchronize_session=False)
+        else:
+            actor_ids = list(actor_ids)
+            count = 0
+            # (sqlite limits the number of parameters of a statement)
+            for start in range(0, len(actor_ids), 500):
+                count += self.session.query(Actor).filter(Actor.id.in_(actor_ids[start:start + 500])) \
+                    .update({Actor.total_gross: income}, synchronize_session=False)
+        self.expire_total_gross()
+        self.save()
+        return count
+
+    def get_gross_drift(self, tolerance=1.0):
+        """
+        Find the actors whose total gross is not the sum of the income of their edges, with a
+        single aggregate query
+        :param tolerance: the difference (in dollars) above which the total gross is wrong
+        :return: list of (actor id, total gross, sum of the income of the edges)
+        """
+        self.session.flush()
+        incomes = self.session.query(Edge.actor_id, func.sum(Edge.income).label("income")) \
+            .group_by(Edge.actor_id).subquery()
+        expected = func.coalesce(incomes.c.income, 0)
+        query = self.session.query(Actor.id, Actor.total_gross, expected) \
+            .outerjoin(incomes, incomes.c.actor_id == Actor.id) \
+            .filter(func.abs(func.coalesce(Actor.total_gross, 0) - expected) > tolerance)
+        return query.all()
+
+    def expire_total_gross(self):
+        """
+        Forget the total gross of the actors loaded in the session, after it is updated in SQL
+        """
+        for node in list(self.session.identity_map.values()):
+            if isinstance(node, Actor):
+                self.session.expire(node, ["total_gross"])
+
+    def search(self, cls, value, n=10):
+        """
+        Find the actors or movies whose name starts with or contains the given string, through
+        the full text search index (see model.graph.search)
+        :param cls: the class of the nodes, Actor or Movie
+        :param value: the string, case insensitive
+        :param n: the number of nodes to get
+        :return: list of the nodes, the names starting with the string first
+        """
+        return search_nodes(self.session, cls, value, n)
 
     def get_box_office(self, **kwargs):
         """
@@ -249,9 +587,9 @@ class Graph:
         :return: list of the movies that the first matching actor is in,
          or None if no data is found
         """
-        actor = self.get_actors(**kwargs).first()
+        actor = self.get_actors(**kwargs).options(RELATED_NODES[Actor]).first()
         if actor is not None:
-            return
+            return [edge.movie for edge in actor.movies]
 
     def get_actors_for_movie(self, **kwargs):
         """
@@ -259,10 +597,37 @@ class Graph:
         :param kwargs: query arguments to search the movie
         :return: list of the actors that the movie has, or None if no data is found
         """
-        movie = self.get_movies(**kwargs).first()
+        movie = self.get_movies(**kwargs).options(RELATED_NODES[Movie]).first()
         if movie is not None:
             return [edge.actor for edge in movie.actors]
 
+    def get_neighbour_pages(self, node):
+        """
+        Get the wiki pages of the neighbours of a node, i.e. the movies of an actor or the
+        actors of a movie
+        :param node: the actor or movie
+        :return: list of the wiki pages of the neighbours
+        """
+        if isinstance(node, Actor):
+            query = self.session.query(Movie.wiki_page).join(Edge, Edge.movie_id == Movie.id) \
+                .filter(Edge.actor_id == node.id)
+        else:
+            query = self.session.query(Actor.wiki_page).join(Edge, Edge.actor_id == Actor.id) \
+                .filter(Edge.movie_id == node.id)
+        return [page for page, in query if page is not None]
+
+    def get_movie_counts(self, wiki_pages):
+        """
+        Get the number of movies of the actors already in the graph
+        :param wiki_pages: the wiki pages of the actors
+        :return: dict mapping the wiki pages of the actors in the graph to their number of movies
+        """
+        if not wiki_pages:
+            return {}
+        query = self.session.query(Actor.wiki_page, func.count(Edge.movie_id)).join(Edge, Edge.actor_id == Actor.id) \
+            .filter(Actor.wiki_page.in_(set(wiki_pages))).group_by(Actor.wiki_page)
+        return dict(query)
+
     def get_actor_rank(self, n=10):
         """
         Get the top n actors with highest gross income
@@ -270,7 +635,7 @@ class Graph:
         :return: a List containing n actor object. The returning list might be shorter
         than n if the total number of actors is smaller than n
         """
-        return self.get_actors().order_by(Actor.total_gross.desc()).limit(n).all()
+        return self.get_top_actors("total_gross", n)
 
     def get_oldest_actors(self, n=10):
         """
@@ -279,7 +644,43 @@ class Graph:
         :return: a List containing n actor object. The returning list might be shorter
         than n if the total number of actors is smaller than n
         """
-        return self.get_actors().order_by(Actor.age.desc()).limit(n).all()
+        return self.get_top_actors("age", n)
+
+    def get_top_actors(self, by="total_gross", n=10, related=False):
+        """
+        Get the top n actors by a field, reading the index of the field instead of sorting
+        the actors (the actors without value come last)
+        :param by: the field to rank the actors by, one of Actor.RANK_FIELDS
+        :param n: the number of actors to get, or negative int to get all actors
+        :param related: whether to load the movies of the actors too
+        :return: list of the actors, raise ValueError if they cannot be ranked by the field
+        """
+        if by not in Actor.RANK_FIELDS:
+            raise ValueError("cannot rank actors by {}".format(by))
+        query = self.session.query(Actor).order_by(getattr(Actor, by).desc(), Actor.id.desc())
+        if related:
+            query = query.options(RELATED_NODES[Actor])
+        return query.limit(n).all()
+
+    def get_top_movies(self, by="box_office", n=10, year=None, related=False):
+        """
+        Get the top n movies by a field, among all movies or the movies of a year, reading
+        the index of the field instead of sorting the movies (the movies without value come last)
+        :param by: the field to rank the movies by, one of Movie.RANK_FIELDS
+        :param n: the number of movies to get, or negative int to get all movies
+        :param year: the release year of the movies, or None for all movies
+        :param related: whether to load the actors of the movies too
+        :return: list of the movies, raise ValueError if they cannot be ranked by the field
+        """
+        if by not in Movie.RANK_FIELDS:
+            raise ValueError("cannot rank movies by {}".format(by))
+        query = self.session.query(Movie)
+        if year is not None:
+            query = query.filter(Movie.release_year == year)
+        query = query.order_by(getattr(Movie, by).desc(), Movie.id.desc())
+        if related:
+            query = query.options(RELATED_NODES[Movie])
+        return query.limit(n).all()
 
     def get_movies_by_year(self, year):
         """
@@ -287,7 +688,7 @@ class Graph:
         :param year: the year to lookup
         :return: a list of MovieNode in a given year
         """
-        return self.get_movies().filter(extract('year', Movie.release_date) == year).all()
+        return self.get_movies().filter(Movie.release_year == year).all()
 
     def get_actors_by_year(self, year):
         """
@@ -296,7 +697,50 @@ class Graph:
         :return: a list of ActorNode in a given year
         """
         # search through movie
-        return self.get_actors().join(Edge).join(Movie).filter(extract('year', Movie.release_date) == year).all()
+        return self.get_actors().join(Edge).join(Movie).filter(Movie.release_year == year).all()
+
+    def shortest_path(self, actor_a, actor_b, max_depth=PATH_MAX_DEPTH):
+        """
+        Find the shortest chain of co-stars linking two actors (the degrees of separation are
+        the number of movies in the chain), searched in the in-memory copy of the graph
+        :param actor_a: the first actor
+        :param actor_b: the second actor
+        :param max_depth: the maximum number of movies in the chain
+        :return: list alternating the actors and the movies linking them, from actor_a to
+         actor_b, or None if they are more than max_depth movies apart
+        """
+        analytics = self.get_analytics()
+        # the path from b to a is the path from a to b reversed
+        reverse = actor_a.id > actor_b.id
+        key = (actor_b.id, actor_a.id, max_depth) if reverse else (actor_a.id, actor_b.id, max_depth)
+        # (a single lookup, as another thread can evict the entry)
+        ids = self.path_cache.get(key, MISSING)
+        if ids is MISSING:
+            source, target = analytics.get_actor_index(key[0]), analytics.get_actor_index(key[1])
+            if source is None or target is None:
+                # the actors were added since the copy was read, which is read again
+                self.analytics = None
+                analytics = self.get_analytics()
+                source, target = analytics.get_actor_index(key[0]), analytics.get_actor_index(key[1])
+            if source is None or target is None:
+                # (not cached, the actors are not in the database yet)
+                return None
+            path = analytics.shortest_path(source, target, max_depth)
+            ids = None
+            if path is not None:
+                ids = [int(analytics.movie_ids[index] if position % 2 else analytics.actor_ids[index])
+                       for position, index in enumerate(path)]
+            self.path_cache.put(key, ids)
+        if ids is None:
+            return None
+        if reverse:
+            ids = ids[::-1]
+
+        actors = get_nodes(self.session, Actor, ids[::2])
+        movies = get_nodes(self.session, Movie, ids[1::2])
+        path = [movies.get(node_id) if position % 2 else actors.get(node_id) for position, node_id in enumerate(ids)]
+        # the nodes deleted elsewhere since the copy was read break the path
+        return None if None in path else path
 
     def get_hub_actor(self, plot=False, n=10, save_to=None):
         """
@@ -307,29 +751,22 @@ class Graph:
         :param save_to: the file name to save the plot
         :return: a list of (actor, count) tuple, sorted in decreasing order
         """
-        connection_count = []
-        actors = self.get_actors().all()
-        for actor in actors:
-            if not actor.movies:
-                connection_count.append((actor, 0))
-                continue
-            # storing unique actor id
-            neighbour_ids = set()
-            for edge in actor.movies:
-                neighbour_ids.update(other_edge.actor_id for other_edge in edge.movie.actors)
-            # remove self
-            neighbour_ids.remove(actor.id)
-            connection_count.append((actor, len(neighbour_ids)))
-
-        # sort actor by neighbour count
-        connection_count.sort(key=itemgetter(1), reverse=True)
-
-        n = min(n, len(connection_count))
+        analytics = self.get_analytics()
+        counts = analytics.get_costar_counts()
+
+        # sort actor by neighbour count, actors with the same count stay in the order of id
+        order = np.argsort(-counts, kind="stable")
+
+        n = min(n, len(order))
         if n <= 0:
-            n = len(connection_count)
-        connection_count = connection_count[:n]
+            n = len(order)
+        order = order[:n]
+        actors = get_nodes(self.session, Actor, analytics.actor_ids[order])
+        connection_count = [(actors[analytics.actor_ids[index]], int(counts[index])) for index in order]
 
         if plot:
+            # matplotlib is only needed for plotting
+            import matplotlib.pyplot as plt
             plt.cla()
             plt.clf()
 
@@ -346,8 +783,7 @@ class Graph:
 
         return connection_count
 
-    @staticmethod
-    def get_age_correlation(plot=False, save_to=None):
+    def get_age_correlation(self, plot=False, save_to=None):
         """
         Get the age group vs total income graph. If plot=True, then a bar graph for the
         top n actor is plotted
@@ -355,21 +791,20 @@ class Graph:
         :param save_to: the file name to save the plot
         :return: a list of (age_group, total_income) tuple, sorted in decreasing order
         """
-        income_dict = {}
         # noinspection PyComparisonWithNone
-        actors = Actor.query.filter(and_(Actor.age != None, Actor.total_gross != None)).all()
-
-        for actor in actors:
-            income_dict[actor.age] = income_dict.get(actor.age, 0) + actor.total_gross
-
-        income_list = sorted(income_dict.items(), key=itemgetter(1), reverse=True)
+        condition = and_(Actor.age != None, Actor.total_gross != None)
+        total_income = func.sum(Actor.total_gross)
+        income_list = [tuple(row) for row in self.session.query(Actor.age, total_income).filter(condition)
+                       .group_by(Actor.age).order_by(total_income.desc())]
 
         if plot:
+            # matplotlib is only needed for plotting
+            import matplotlib.pyplot as plt
             plt.cla()
             plt.clf()
 
-            plt.scatter([actor.age for actor in actors],
-                        [actor.total_gross for actor in actors])
+            ages, incomes = to_arrays(self.session.query(Actor.age, Actor.total_gross).filter(condition))
+            plt.scatter(ages, incomes)
             plt.xlabel("Age of Actors")
             plt.ylabel("Total Gross of Actors")
             plt.yscale("symlog")  # use symlog instead of log to preserve zero value
@@ -379,3 +814,33 @@ class Graph:
             else:
                 plt.show()
         return income_list
+
+    def get_income_by_year(self):
+        """
+        Get the total income of the actors from the movies released in each year
+        :return: (years, incomes) arrays, sorted by year
+        """
+        # noinspection PyComparisonWithNone
+        return to_arrays(self.session.query(Movie.release_year, func.coalesce(func.sum(Edge.income), 0))
+                         .join(Movie.actors).filter(Movie.release_year != None)
+                         .group_by(Movie.release_year).order_by(Movie.release_year))
+
+    def get_box_office_by_decade(self):
+        """
+        Get the total box office of the movies released in each decade
+        :return: (decades, box_offices) arrays sorted by decade, where a decade is given by its first year
+        """
+        decade = Movie.release_year / 10 * 10
+        # noinspection PyComparisonWithNone
+        return to_arrays(self.session.query(decade, func.coalesce(func.sum(Movie.box_office), 0))
+                         .filter(Movie.release_year != None).group_by(decade).order_by(decade))
+
+
+def to_arrays(rows):
+    """
+    A helper function to convert the rows of a two-column query to two arrays
+    :param rows: the query or list of rows
+    :return: the arrays of the first and second column
+    """
+    table = np.array([tuple(row) for row in rows], dtype=float).reshape(-1, 2)
+    return table[:, 0], table[:, 1]
@@ -0,0 +1,186 @@
+from sqlalchemy import bindparam
+from .actor import Actor
+from .movie import Movie
+from .edge import Edge
+
+# maximum number of ids in one "IN" clause (SQLite limits the number of parameters)
+CHUNK_SIZE = 500
+
+
+class NodeTable:
+    """
+    In-memory copy of the actor or movie table used by the bulk loader, indexed by name
+    """
+
+    def __init__(self, cls, session):
+        """
+        Read all nodes of the given class from the database
+        :param cls: the class of the node, Actor or Movie
+        :param session: the database session
+        """
+        self.cls = cls
+        self.rows = {}
+        self.ids_by_name = {}
+        self.ids_by_page = {}
+        self.new_ids = set()
+        self.dirty_ids = set()
+
+        columns = [cls.id] + [getattr(cls, field) for field in cls.FIELDS]
+        for row in session.query(*columns).order_by(cls.id):
+            values = dict(zip(cls.FIELDS, row[1:]))
+            self.rows[row[0]] = values
+            # queries by name return the node with the smallest id
+            self.ids_by_name.setdefault(values["name"], row[0])
+            if values["wiki_page"] is not None:
+                self.ids_by_page[values["wiki_page"]] = row[0]
+        self.next_id = max(self.rows) + 1 if self.rows else 1
+
+    def get_or_create(self, name):
+        """
+        Get the id of the node with the given name, creating the node if it does not exist
+        :param name: name of the node
+        :return: the id of the node
+        """
+        node_id = self.ids_by_name.get(name)
+        if node_id is None:
+            node_id = self.merge({"name": name})
+        return node_id
+
+    def merge(self, item):
+        """
+        Create a node for the item, or merge it to the node with the same name
+        :param item: the item or dict of the node
+        :return: the id of the node
+        """
+        node_id = self.ids_by_name.get(item.get("name"))
+        if node_id is None:
+            node_id = self.next_id
+            self.next_id += 1
+            self.rows[node_id] = {field: None for field in self.cls.FIELDS}
+            self.new_ids.add(node_id)
+
+        values = self.rows[node_id]
+        old_page = values["wiki_page"]
+        self.cls.merge(values, item)
+        if values["wiki_page"] != old_page:
+            if values["wiki_page"] is not None and self.ids_by_page.get(values["wiki_page"], node_id) != node_id:
+                # the wiki page is unique, keep the one of the existing node
+                values["wiki_page"] = old_page
+            else:
+                self.ids_by_page.pop(old_page, None)
+                if values["wiki_page"] is not None:
+                    self.ids_by_page[values["wiki_page"]] = node_id
+
+        self.ids_by_name.setdefault(values["name"], node_id)
+        self.dirty_ids.add(node_id)
+        return node_id
+
+    def write(self, session):
+        """
+        Insert the new nodes and update the modified ones
+        :param session: the database session
+        """
+        table = self.cls.__table__
+        inserts = [dict(self.rows[node_id], id=node_id) for node_id in sorted(self.new_ids)]
+        updates = [dict({"_" + field: value for field, value in self.rows[node_id].items()}, _id=node_id)
+                   for node_id in sorted(self.dirty_ids - self.new_ids)]
+        if inserts:
+            session.execute(table.insert(), inserts)
+        if updates:
+            session.execute(table.update().where(table.c.id == bindparam("_id"))
+                            .values({field: bindparam("_" + field) for field in self.cls.FIELDS}), updates)
+
+
+class BulkLoader:
+    """
+    Load external data (where nodes refer to each other by name) with a few bulk statements
+    in a single transaction. The resulting graph is the same as adding every movie and then
+    every actor with Graph.add_movie and Graph.add_actor (external=True)
+    """
+
+    def __init__(self, session):
+        """
+        Read the existing nodes from the database
+        :param session: the database session
+        """
+        self.session = session
+        self.actors = NodeTable(Actor, session)
+        self.movies = NodeTable(Movie, session)
+        # map (movie_id, actor_id) to the income of the edges to write
+        self.edges = {}
+        # income of the existing edges, read on demand
+        self.existing_edges = {}
+
+    def load(self, actors, movies):
+        """
+        Merge the actors and movies into the graph and commit them
+        :param actors: iterable of actor dicts, whose "movies" are names of movies
+        :param movies: iterable of movie dicts, whose "actors" are names of actors
+        """
+        # edges from the movies have no weight, and reset the existing weights
+        movie_edges = []
+        for movie in movies:
+            movie_id = self.movies.merge(movie)
+            if isinstance(movie.get("actors"), list):
+                movie_edges.extend((movie_id, self.actors.get_or_create(name)) for name in movie["actors"])
+        self.read_edges(movie_edges)
+        for key in movie_edges:
+            old_income = self.edges.get(key, self.existing_edges.get(key))
+            if old_income:
+                values = self.actors.rows[key[1]]
+                values["total_gross"] = (values["total_gross"] or 0) - old_income
+                self.actors.dirty_ids.add(key[1])
+            self.edges[key] = 0
+
+        # edges from the actors only create the missing edges
+        actor_edges = []
+        for actor in actors:
+            actor_id = self.actors.merge(actor)
+            if isinstance(actor.get("movies"), list):
+                actor_edges.extend((self.movies.get_or_create(name), actor_id) for name in actor["movies"])
+        self.read_edges(actor_edges)
+        for key in actor_edges:
+            if key not in self.edges and key not in self.existing_edges:
+                self.edges[key] = None
+
+        self.write()
+
+    def read_edges(self, keys):
+        """
+        Read the income of the existing edges among the given keys
+        :param keys: list of (movie_id, actor_id)
+        """
+        movie_ids = sorted({movie_id for movie_id, actor_id in keys
+                            if movie_id not in self.movies.new_ids and actor_id not in self.actors.new_ids})
+        for start in range(0, len(movie_ids), CHUNK_SIZE):
+            query = self.session.query(Edge.movie_id, Edge.actor_id, Edge.income) \
+                .filter(Edge.movie_id.in_(movie_ids[start:start + CHUNK_SIZE]))
+            for movie_id, actor_id, income in query:
+                self.existing_edges[(movie_id, actor_id)] = income
+
+    def write(self):
+        """
+        Write all changes in one transaction
+        """
+        table = Edge.__table__
+        inserts = []
+        updates = []
+        for (movie_id, actor_id), income in sorted(self.edges.items()):
+            if (movie_id, actor_id) in self.existing_edges:
+                updates.append({"_movie_id": movie_id, "_actor_id": actor_id, "_income": income})
+            else:
+                inserts.append({"movie_id": movie_id, "actor_id": actor_id, "income": income})
+
+        try:
+            self.movies.write(self.session)
+            self.actors.write(self.session)
+            if inserts:
+                self.session.execute(table.insert(), inserts)
+            if updates:
+                self.session.execute(table.update().where(table.c.movie_id == bindparam("_movie_id"))
+                                     .where(table.c.actor_id == bindparam("_actor_id"))
+                                     .values(income=bindparam("_income")), updates)
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
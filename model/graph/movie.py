@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Text, Float, DateTime
+from sqlalchemy import Column, Integer, Text, Float, DateTime, Index, func
 from sqlalchemy.orm import relationship
 from datetime import datetime, MINYEAR, MAXYEAR
 from dateparser import parse as parse_date
@@ -21,6 +21,26 @@ class Movie(Base):
     wiki_page = Column(Text, unique=True)
     box_office = Column(Float)
     release_date = Column(DateTime)
+    # stored so that movies can be looked up by year with an index
+    release_year = Column(Integer, index=True,
+                          info={"backfill": "CAST(strftime('%Y', release_date) AS INTEGER)"})
+    # fingerprint of the content of the page the movie is crawled from
+    fingerprint = Column(Text)
+
+    # indexes for looking up movies by name, case sensitive or not, and for ranking them,
+    # among all movies or the movies of a year
+    __table_args__ = (
+        Index("ix_movie_name", name),
+        Index("ix_movie_name_lower", func.lower(name)),
+        Index("ix_movie_box_office", box_office),
+        Index("ix_movie_release_year_box_office", release_year, box_office),
+    )
+
+    # the data fields that are set from an item
+    FIELDS = ("name", "box_office", "wiki_page", "release_date", "release_year", "fingerprint")
+
+    # the fields the movies can be ranked by (each has an index, with the release year too)
+    RANK_FIELDS = ("box_office",)
 
     # relationship to actors
     actors = relationship("Edge", back_populates="movie", cascade="all, delete-orphan")
@@ -39,23 +59,39 @@ class Movie(Base):
         Update current movie node using other actor node
         :param item: the item or dict representing other movie
         """
+        values = self.merge({field: getattr(self, field) for field in self.FIELDS}, item)
+        for field, value in values.items():
+            setattr(self, field, value)
+
+    @staticmethod
+    def merge(values, item):
+        """
+        Merge other movie node into the column values of a movie, the same way as update
+        :param values: dict of the column values (FIELDS) of the movie, modified in place
+        :param item: the item or dict representing other movie
+        :return: the merged values
+        """
         if not (isinstance(item, MovieItem) or isinstance(item, dict)):
-            return
-        self.name = item.get("name", self.name)
-        self.box_office = item.get("box_office", 0 if self.box_office is None else self.box_office)
-        self.wiki_page = get_wiki_page(item.get("wiki_page", self.wiki_page))
+            return values
+        values["name"] = item.get("name", values["name"])
+        values["box_office"] = item.get("box_office", 0 if values["box_office"] is None else values["box_office"])
+        values["wiki_page"] = get_wiki_page(item.get("wiki_page", values["wiki_page"]))
+        values["fingerprint"] = item.get("fingerprint", values["fingerprint"])
 
-        self.release_date = item.get("release_date", self.release_date)
+        values["release_date"] = item.get("release_date", values["release_date"])
 
         # parse release date if it is string
-        if isinstance(self.release_date, str):
-            self.release_date = parse_date(self.release_date)
+        if isinstance(values["release_date"], str):
+            values["release_date"] = parse_date(values["release_date"])
 
         # setup release date
-        if self.release_date is None and "year" in item:
+        if values["release_date"] is None and "year" in item:
             year = item.get("year")
             if MINYEAR <= year <= MAXYEAR:
-                self.release_date = datetime(year, 1, 1)
+                values["release_date"] = datetime(year, 1, 1)
+
+        values["release_year"] = values["release_date"].year if values["release_date"] is not None else None
+        return values
 
     def __repr__(self):
         """
@@ -64,16 +100,20 @@ class Movie(Base):
         """
         return '<{} "{}">'.format(self.__class__.__name__, self.name)
 
-    def to_dict(self):
+    def to_dict(self, fields=None):
         """
         A method to convert Movie class do dict
+        :param fields: the list of fields to include, or None to include all fields
         :return: a dictionary represents a Movie
         """
-        return {
+        values = {
             "id": self.id,
             "name": self.name,
             "wiki_page": self.wiki_page,
             "box_office": self.box_office,
             "release_date": self.release_date.strftime('%Y-%m-%d') if self.release_date else None,
-            "actors": [edge.actor.name for edge in self.actors if edge.actor.name is not None],
         }
+        # the related actors are only loaded if needed
+        if fields is None or "actors" in fields:
+            values["actors"] = [edge.actor.name for edge in self.actors if edge.actor.name is not None]
+        return values if fields is None else {field: values[field] for field in fields if field in values}
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Text
+from database import Base
+
+
+class Redirect(Base):
+    """
+    The wiki pages redirecting to other pages, so that the aliases of an article lead to the
+    same node
+    (SQLAlchemy model: redirect)
+    """
+
+    __tablename__ = 'redirect'
+    source = Column(Text, primary_key=True)
+    target = Column(Text, nullable=False, index=True)
+
+    def __repr__(self):
+        """
+        Representation of the redirect
+        :return: a string representation of the redirect
+        """
+        return '<{} "{}" -> "{}">'.format(self.__class__.__name__, self.source, self.target)
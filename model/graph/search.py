@@ -0,0 +1,138 @@
+from sqlalchemy import select, func, case, and_, bindparam
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import table, column
+from database import engine
+from .actor import Actor
+from .movie import Movie
+import logging
+
+# the full text search tables indexing the names of the actors and movies. The trigram
+# tokenizer matches any substring of at least 3 characters, case insensitive, as LIKE does
+SEARCH_TABLES = {Actor: "actor_search", Movie: "movie_search"}
+
+# the shortest substring the trigram index can look up, shorter ones are searched with LIKE
+MIN_SEARCH_LENGTH = 3
+
+# the statements creating the index of a table, kept in sync with it by triggers
+SEARCH_STATEMENTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5(name, content='{table}', content_rowid='id', "
+    "tokenize='trigram')",
+    "CREATE TRIGGER {search}_insert AFTER INSERT ON {table} BEGIN "
+    "INSERT INTO {search} (rowid, name) VALUES (new.id, new.name); END",
+    "CREATE TRIGGER {search}_delete AFTER DELETE ON {table} BEGIN "
+    "INSERT INTO {search} ({search}, rowid, name) VALUES ('delete', old.id, old.name); END",
+    "CREATE TRIGGER {search}_update AFTER UPDATE OF id, name ON {table} BEGIN "
+    "INSERT INTO {search} ({search}, rowid, name) VALUES ('delete', old.id, old.name); "
+    "INSERT INTO {search} (rowid, name) VALUES (new.id, new.name); END",
+    # index the rows written before the triggers existed
+    "INSERT INTO {search} ({search}) VALUES ('rebuild')",
+)
+
+# whether the search tables exist, None until it is checked
+search_enabled = None
+
+
+def create_search_index():
+    """
+    Create the full text search tables and their triggers if they are missing. Without FTS5
+    (SQLite older than 3.34), the names are searched with LIKE
+    """
+    global search_enabled
+    try:
+        with engine.begin() as connection:
+            triggers = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+            for cls, search in SEARCH_TABLES.items():
+                # the triggers are dropped along with their table, the index is then rebuilt
+                if search + "_insert" in triggers:
+                    continue
+                for statement in SEARCH_STATEMENTS:
+                    connection.execute(statement.format(search=search, table=cls.__tablename__))
+        search_enabled = True
+    except OperationalError as e:
+        logging.warning("Cannot create the full text search index, names are searched with LIKE: {}".format(e))
+        search_enabled = False
+
+
+def is_search_enabled():
+    """
+    :return: whether the names can be searched through the full text search tables
+    """
+    global search_enabled
+    if search_enabled is None:
+        tables = {row[0] for row in engine.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        search_enabled = set(SEARCH_TABLES.values()) <= tables
+    return search_enabled
+
+
+def quote(value):
+    """
+    Quote a string for a full text search query, so that it matches the string as it is
+    :param value: the string
+    :return: the query matching the string
+    """
+    return '"' + value.replace('"', '""') + '"'
+
+
+def uses_search_index(value):
+    """
+    :param value: the string to search
+    :return: whether the string is looked up in the full text search tables, instead of with LIKE
+    """
+    return len(value) >= MIN_SEARCH_LENGTH and is_search_enabled()
+
+
+def get_search_parameter(value):
+    """
+    Get the value of the parameter of the statement returned by search_ids
+    :param value: the string to search
+    :return: the value of the parameter
+    """
+    return quote(value) if uses_search_index(value) else value
+
+
+def search_ids(cls, value, key=None):
+    """
+    Get the ids of the nodes whose name contains the given string, through the full text
+    search table when the string is long enough
+    :param cls: the class of the nodes, Actor or Movie
+    :param value: the string
+    :param key: the name of the parameter holding the string (see get_search_parameter), so
+     that the statement can be reused for other strings, or None for an anonymous parameter
+    :return: the select statement of the ids
+    """
+    parameter = bindparam(key, get_search_parameter(value))
+    if not uses_search_index(value):
+        return select([cls.id]).where(cls.name.contains(parameter))
+    search = table(SEARCH_TABLES[cls], column("rowid"), column(SEARCH_TABLES[cls]))
+    return select([search.c.rowid]).where(search.c[SEARCH_TABLES[cls]].op("MATCH")(parameter))
+
+
+def name_contains(cls, value):
+    """
+    Get the filter selecting the nodes whose name contains the given string
+    :param cls: the class of the nodes, Actor or Movie
+    :param value: the string
+    :return: the filter
+    """
+    return cls.id.in_(search_ids(cls, value))
+
+
+def search(session, cls, value, n=10):
+    """
+    Find the nodes whose name starts with or contains the given string, for autocompletion.
+    The names starting with the string come first, then the shortest names
+    :param session: the session to query with
+    :param cls: the class of the nodes, Actor or Movie
+    :param value: the string, case insensitive
+    :param n: the number of nodes to get
+    :return: list of the nodes
+    """
+    prefix = value.lower()
+    # the range of the names starting with the string, read from the index on lower(name)
+    starts_with = and_(func.lower(cls.name) >= prefix, func.lower(cls.name) < prefix + "\uffff")
+    if not uses_search_index(value):
+        query = session.query(cls).filter(starts_with)
+    else:
+        query = session.query(cls).filter(name_contains(cls, value))
+    return query.order_by(case([(starts_with, 0)], else_=1), func.length(cls.name), cls.name, cls.id) \
+        .limit(n).all()
@@ -0,0 +1,167 @@
+from sqlalchemy import func, bindparam
+from datetime import datetime
+import json
+from .actor import Actor
+from .movie import Movie
+from .edge import Edge
+
+# number of rows fetched from the database (when dumping) or written to it (when loading) at once
+CHUNK_SIZE = 1000
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def dump(session, file):
+    """
+    Write the graph to the file as newline-delimited json, one record per line:
+    all actors, then all movies, then all edges. Rows are streamed from the database,
+    so the memory used does not grow with the size of the graph
+    :param session: the database session
+    :param file: the file object to write
+    """
+    for record_type, cls in (("actor", Actor), ("movie", Movie)):
+        columns = [cls.id] + [getattr(cls, field) for field in cls.FIELDS]
+        for row in session.query(*columns).order_by(cls.id).yield_per(CHUNK_SIZE):
+            record = dict(zip(cls.FIELDS, row[1:]), type=record_type, id=row[0])
+            if isinstance(record.get("release_date"), datetime):
+                record["release_date"] = record["release_date"].strftime(DATE_FORMAT)
+            file.write(json.dumps(record) + "\n")
+
+    for movie_id, actor_id, income in session.query(Edge.movie_id, Edge.actor_id, Edge.income) \
+            .order_by(Edge.movie_id, Edge.actor_id).yield_per(CHUNK_SIZE):
+        file.write(json.dumps({"type": "edge", "movie_id": movie_id, "actor_id": actor_id, "income": income}) + "\n")
+
+
+class StreamLoader:
+    """
+    Load a graph written by dump(), committing every CHUNK_SIZE records. Nodes are merged to
+    the existing node with the same wiki page (or the same name, for nodes without wiki page),
+    and edges overwrite the existing ones. Apart from the map from the ids in the file to the
+    ids in the database, the memory used does not grow with the size of the file
+    """
+
+    def __init__(self, session):
+        """
+        Create a loader writing to the given session
+        :param session: the database session
+        """
+        self.session = session
+        self.pending = {"actor": [], "movie": [], "edge": []}
+        self.classes = {"actor": Actor, "movie": Movie}
+        # map the ids in the file to the ids in the database
+        self.ids = {"actor": {}, "movie": {}}
+        # ids of the nodes created by the loader start from here
+        self.first_ids = {record_type: (session.query(func.max(cls.id)).scalar() or 0) + 1
+                          for record_type, cls in self.classes.items()}
+        self.next_ids = dict(self.first_ids)
+
+    def load(self, file):
+        """
+        Load every record in the file
+        :param file: the file object to read
+        """
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            record_type = record.pop("type", None)
+            if record_type not in self.pending:
+                continue
+            self.pending[record_type].append(record)
+            if len(self.pending[record_type]) >= CHUNK_SIZE:
+                self.flush()
+        self.flush()
+
+    def flush(self):
+        """
+        Write the pending records to the database and commit them
+        """
+        try:
+            # nodes go first so that the edges can find them
+            for record_type in ("actor", "movie"):
+                if self.pending[record_type]:
+                    self.write_nodes(record_type, self.pending[record_type])
+            if self.pending["edge"]:
+                self.write_edges(self.pending["edge"])
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        for records in self.pending.values():
+            del records[:]
+
+    def write_nodes(self, record_type, records):
+        """
+        Insert or update the given nodes
+        :param record_type: "actor" or "movie"
+        :param records: the list of records of the nodes
+        """
+        cls = self.classes[record_type]
+        ids = self.ids[record_type]
+        for record in records:
+            if isinstance(record.get("release_date"), str):
+                record["release_date"] = parse_date(record["release_date"])
+
+        # find the existing nodes, by wiki page first, then by name
+        pages = {record["wiki_page"] for record in records if record.get("wiki_page") is not None}
+        names = {record.get("name") for record in records if record.get("wiki_page") is None}
+        ids_by_page = dict(self.session.query(cls.wiki_page, cls.id).filter(cls.wiki_page.in_(pages))) \
+            if pages else {}
+        ids_by_name = {}
+        if names:
+            # nodes added by the loader itself are not merged by name
+            query = self.session.query(cls.name, cls.id).filter(cls.name.in_(names)) \
+                .filter(cls.id < self.first_ids[record_type]).order_by(cls.id.desc())
+            ids_by_name = dict(query)
+
+        inserts = []
+        updates = []
+        for record in records:
+            # merging also fills the fields derived from others (e.g. release_year of older dumps)
+            values = cls.merge({field: None for field in cls.FIELDS}, record)
+            node_id = ids_by_page.get(values["wiki_page"]) if values["wiki_page"] is not None \
+                else ids_by_name.get(values["name"])
+            if node_id is None:
+                node_id = self.next_ids[record_type]
+                self.next_ids[record_type] += 1
+                if values["wiki_page"] is not None:
+                    ids_by_page[values["wiki_page"]] = node_id
+                inserts.append(dict(values, id=node_id))
+            else:
+                updates.append(dict({"_" + field: value for field, value in values.items()}, _id=node_id))
+            if "id" in record:
+                ids[record["id"]] = node_id
+
+        table = cls.__table__
+        if inserts:
+            self.session.execute(table.insert(), inserts)
+        if updates:
+            self.session.execute(table.update().where(table.c.id == bindparam("_id"))
+                                 .values({field: bindparam("_" + field) for field in cls.FIELDS}), updates)
+
+    def write_edges(self, records):
+        """
+        Insert or overwrite the given edges. Edges to unknown nodes are ignored
+        :param records: the list of records of the edges
+        """
+        rows = []
+        for record in records:
+            movie_id = self.ids["movie"].get(record.get("movie_id"))
+            actor_id = self.ids["actor"].get(record.get("actor_id"))
+            if movie_id is not None and actor_id is not None:
+                rows.append({"movie_id": movie_id, "actor_id": actor_id, "income": record.get("income")})
+        if rows:
+            self.session.execute(Edge.__table__.insert().prefix_with("OR REPLACE"), rows)
+
+
+def parse_date(value):
+    """
+    A helper function to parse the dates written by dump()
+    :param value: the string of the date
+    :return: the datetime object
+    """
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        return Movie.merge({field: None for field in Movie.FIELDS}, {"release_date": value})["release_date"]
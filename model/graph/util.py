@@ -1,3 +1,6 @@
+from collections import OrderedDict
+import threading
+
 ROOT = "https://en.wikipedia.org"
 
 
@@ -10,3 +13,79 @@ def get_wiki_page(url):
         return url[len(ROOT):]
     else:
         return url
+
+
+class LRUCache:
+    """
+    A bounded mapping that evicts the least recently used entry once it is full,
+    and keeps track of the number of hits and misses. It can be shared by threads
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Create an empty cache
+        :param maxsize: the maximum number of entries to keep
+        """
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        """
+        Get the value stored for key, and mark it as recently used
+        :param key: the key to lookup
+        :param default: the value to return if key is not in the cache
+        :return: the cached value, or default
+        """
+        with self.lock:
+            try:
+                value = self.data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store the value for key, evicting the least recently used entry if needed
+        :param key: the key to store
+        :param value: the value to store
+        """
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def pop(self, key):
+        """
+        Remove key from the cache, if it is there
+        :param key: the key to remove
+        """
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry from the cache
+        """
+        with self.lock:
+            self.data.clear()
+
+    def get_stats(self):
+        """
+        Get the statistics of the cache
+        :return: a dict containing the number of hits, misses and entries
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.data)}
@@ -9,9 +9,13 @@ api = Api(app)
 API_ROOT = '/api'
 
 api.add_resource(ActorQueryResource, API_ROOT + '/actors')
+api.add_resource(ActorTopResource, API_ROOT + '/actors/top')
 api.add_resource(ActorResource, API_ROOT + '/actors/<string:name>')
 api.add_resource(MovieQueryResource, API_ROOT + '/movies')
+api.add_resource(MovieTopResource, API_ROOT + '/movies/top')
 api.add_resource(MovieResource, API_ROOT + '/movies/<string:name>')
+api.add_resource(SearchResource, API_ROOT + '/search')
+api.add_resource(PathResource, API_ROOT + '/path')
 
 
 @app.teardown_appcontext
@@ -1,7 +1,7 @@
 from database import db_session, init_db, Base, engine
 from unittest import TestCase
 from model.crawler import ActorItem, MovieItem
-from model.graph import Graph
+from model.graph import Graph, Actor, Movie, Edge
 from datetime import datetime
 
 actor_item = ActorItem(name="a", wiki_page="b", age=10)
@@ -44,3 +44,98 @@ class TestAnalysis(TestCase):
         self.assertEqual(actors[0][0], 20)
 
         self.graph.get_age_correlation(plot=True, save_to="output/age_correlation.png")
+
+    def test_analytics_match_orm(self):
+        # a small graph where actors share movies in different ways
+        for index in range(20):
+            self.graph.add_movie({"name": "m{}".format(index), "year": 2000 + index % 3, "box_office": index,
+                                  "actors": ["a{}".format((index * 7 + k) % 15) for k in range(index % 5)]},
+                                 external=True)
+        self.graph.add_actor({"name": "lonely"})
+
+        expected = {}
+        for actor in Actor.query:
+            neighbour_ids = {other.actor_id for edge in actor.movies for other in edge.movie.actors}
+            neighbour_ids.discard(actor.id)
+            expected[actor.id] = len(neighbour_ids)
+
+        hubs = self.graph.get_hub_actor(n=-1)
+        self.assertEqual({actor.id: count for actor, count in hubs}, expected)
+        self.assertEqual([count for _, count in hubs], sorted(expected.values(), reverse=True))
+
+        for year in (2000, 2001, 2002, 2003):
+            expected = Actor.query.join(Edge).join(Movie).filter(Movie.release_year == year).all()
+            self.assertEqual(sorted(actor.id for actor in self.graph.get_actors_by_year(year)),
+                             sorted(actor.id for actor in expected))
+            expected = Movie.query.filter(Movie.release_year == year).all()
+            self.assertEqual(sorted(movie.id for movie in self.graph.get_movies_by_year(year)),
+                             sorted(movie.id for movie in expected))
+
+    def test_aggregates(self):
+        self.graph.add_movie({"name": "m1", "year": 1995, "box_office": 100, "actors": ["a"]}, external=True)
+        self.graph.add_movie({"name": "m2", "year": 1999, "box_office": 50, "actors": ["a"]}, external=True)
+        self.graph.add(movie_item)
+        self.graph.add_movie({"name": "m3"}, external=True)
+
+        years, incomes = self.graph.get_income_by_year()
+        self.assertEqual(list(years), [1995, 1999, 2018])
+        self.assertEqual(list(incomes), [0, 0, 12345])
+
+        decades, box_offices = self.graph.get_box_office_by_decade()
+        self.assertEqual(list(decades), [1990, 2010])
+        self.assertEqual(list(box_offices), [150, 12345])
+
+    def test_shortest_path(self):
+        # chains of actors sharing movies, and a few shortcuts
+        for index in range(30):
+            self.graph.add_movie({"name": "m{}".format(index),
+                                  "actors": ["a{}".format(index), "a{}".format((index + 1) % 25 if index < 25 else
+                                                                              index * 3 % 25)]},
+                                 external=True)
+        self.graph.add_actor({"name": "lonely"})
+        actors = Actor.query.all()
+
+        def distances(source):
+            # breadth first search through the ORM
+            reached = {source.id: 0}
+            frontier = [source]
+            while frontier:
+                next_frontier = []
+                for actor in frontier:
+                    for edge in actor.movies:
+                        for other in edge.movie.actors:
+                            if other.actor_id not in reached:
+                                reached[other.actor_id] = reached[actor.id] + 1
+                                next_frontier.append(other.actor)
+                frontier = next_frontier
+            return reached
+
+        for source in actors[::4]:
+            expected = distances(source)
+            for target in actors:
+                path = self.graph.shortest_path(source, target, max_depth=20)
+                if target.id not in expected:
+                    self.assertIsNone(path)
+                    continue
+                self.assertEqual(len(path) // 2, expected[target.id])
+                self.assertEqual((path[0], path[-1]), (source, target))
+                # consecutive actors share the movie between them
+                for position in range(1, len(path), 2):
+                    cast = {edge.actor_id for edge in path[position].actors}
+                    self.assertTrue({path[position - 1].id, path[position + 1].id} <= cast)
+                if expected[target.id] > 2:
+                    self.assertIsNone(self.graph.shortest_path(source, target, max_depth=expected[target.id] - 1))
+
+        # the paths are cached until the graph changes
+        a, b = Actor.query.filter_by(name="a1").one(), Actor.query.filter_by(name="a5").one()
+        self.assertEqual(self.graph.shortest_path(b, a), self.graph.shortest_path(a, b)[::-1])
+        self.assertIn((a.id, b.id, 6), self.graph.path_cache)
+        self.graph.add_movie({"name": "shortcut", "actors": ["a1", "a5"]}, external=True)
+        self.assertEqual(len(self.graph.shortest_path(a, b)), 3)
+
+        # actors written elsewhere since the copy was read are found after reading it again
+        other = Graph(db_session)
+        other.add_movie({"name": "elsewhere", "actors": ["a1", "newcomer"]}, external=True)
+        newcomer = Actor.query.filter_by(name="newcomer").one()
+        self.assertIsNotNone(self.graph.analytics)
+        self.assertEqual([node.name for node in self.graph.shortest_path(a, newcomer)], ["a1", "elsewhere", "newcomer"])
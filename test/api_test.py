@@ -1,15 +1,22 @@
 from unittest import TestCase
 from database import db_session, init_db, Base, engine
 import json
-from model.graph import Graph, Actor, Edge
+from sqlalchemy import event
+from model.graph import Graph, Actor, Movie, Edge
 from server import app
+from api.cache import response_cache
+from api.planner import planner
+import os
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fixtures")
 
 
 class TestAPI(TestCase):
     def setUp(self):
         init_db()
         self.app = app.test_client()
-        self.graph = Graph.load('output/data_small.json', db_session)
+        self.graph = Graph.load(os.path.join(FIXTURE_DIR, "data_small.json"), db_session)
+        response_cache.clear()
 
     def tearDown(self):
         Base.metadata.drop_all(bind=engine)
@@ -133,3 +140,151 @@ class TestAPI(TestCase):
     def test_movie_query(self):
         movies = self.get_movie_query("name=Hard")
         self.assertEqual(len(movies), 1)
+
+    def test_pagination(self):
+        names = []
+        response = self.app.get("/api/movies?limit=10&sort=-name")
+        while True:
+            movies = json.loads(response.data)
+            self.assertLessEqual(len(movies), 10)
+            names.extend(movie.get("name") for movie in movies)
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+            response = self.app.get("/api/movies?limit=10&sort=-name&after=" + cursor)
+
+        self.assertEqual(len(names), 44)
+        self.assertEqual(names, sorted(names, reverse=True))
+        self.assertEqual(self.app.get("/api/movies?limit=0").status_code, 400)
+        self.assertEqual(self.app.get("/api/movies?sort=wiki").status_code, 400)
+        self.assertEqual(self.app.get("/api/movies?after=asdf").status_code, 400)
+
+    def test_top(self):
+        actors = json.loads(self.app.get("/api/actors/top?n=5&fields=name,total_gross").data)
+        self.assertEqual(len(actors), 5)
+        grosses = [actor["total_gross"] for actor in actors]
+        self.assertEqual(grosses, sorted(grosses, reverse=True))
+        self.assertEqual(grosses[0], max(actor.total_gross for actor in Actor.query))
+        self.assertEqual(len(json.loads(self.app.get("/api/actors/top").data)), 10)
+        self.assertEqual(len(json.loads(self.app.get("/api/actors/top?by=age&n=100").data)), 23)
+
+        movies = json.loads(self.app.get("/api/movies/top?year=1988&fields=name,box_office").data)
+        self.assertEqual(movies, sorted(movies, key=lambda movie: movie["box_office"], reverse=True))
+        self.assertIn("Die Hard", [movie["name"] for movie in movies])
+        self.assertEqual(len(movies), Movie.query.filter(Movie.release_year == 1988).count())
+        offices = [movie["box_office"] for movie in json.loads(self.app.get("/api/movies/top?n=3").data)]
+        self.assertEqual(len(offices), 3)
+        self.assertEqual(offices, sorted(offices, reverse=True))
+
+        for url in ("/api/actors/top?by=name", "/api/actors/top?n=0", "/api/movies/top?year=x",
+                    "/api/movies/top?by=release_date"):
+            self.assertEqual(self.app.get(url).status_code, 400, url)
+
+    def test_search(self):
+        results = json.loads(self.app.get("/api/search?q=wil").data)
+        self.assertIn({"id": self.graph.get_actor("Bruce Willis").id, "name": "Bruce Willis",
+                       "wiki_page": "/wiki/Bruce_Willis"}, results["actors"])
+        results = json.loads(self.app.get("/api/search?q=die&n=1").data)
+        self.assertEqual([movie["name"] for movie in results["movies"]], ["Die Hard"])
+        self.assertEqual(self.app.get("/api/search").status_code, 400)
+        self.assertEqual(self.app.get("/api/search?q=die&n=x").status_code, 400)
+
+        # the name filters go through the search index, short strings too
+        self.assertEqual([movie["name"] for movie in self.get_movie_query("actor=willis&fields=name")
+                          if movie["name"] == "Die Hard"], ["Die Hard"])
+        self.assertEqual(len(self.get_actor_query("name=Wi")), len(Actor.query.filter(Actor.name.contains("Wi")).all()))
+
+    def test_path(self):
+        willis = self.graph.get_actor("Bruce Willis")
+        costar = next(edge.actor for movie_edge in willis.movies for edge in movie_edge.movie.actors
+                      if edge.actor_id != willis.id)
+        result = json.loads(self.app.get("/api/path?from=bruce_willis&to={}".format(costar.name)).data)
+        self.assertEqual(result["degrees"], 1)
+        self.assertEqual([(node["type"], node["name"]) for node in result["path"][::2]],
+                         [("actor", "Bruce Willis"), ("actor", costar.name)])
+        self.assertEqual(result["path"][1]["type"], "movie")
+
+        result = json.loads(self.app.get("/api/path?from=Bruce Willis&to=bruce_willis").data)
+        self.assertEqual((result["degrees"], len(result["path"])), (0, 1))
+        for url in ("/api/path?from=Bruce Willis", "/api/path?from=Bruce Willis&to=Bruce Willis&depth=0",
+                    "/api/path?from=Bruce Willis&to=Bruce Willis&depth=x"):
+            self.assertEqual(self.app.get(url).status_code, 400, url)
+        self.assertEqual(self.app.get("/api/path?from=Bruce Willis&to=nobody").status_code, 404)
+
+    def test_planner(self):
+        # the actors of both movies (an INTERSECT of their edges)
+        names = {actor["name"] for actor in self.get_actor_query("movies=Die Hard,Sunset&fields=name")}
+        expected = {actor.name for actor in Actor.query
+                    if {"Die Hard", "Sunset"} <= {edge.movie.name for edge in actor.movies}}
+        self.assertEqual(names, expected)
+        # duplicated conditions and clauses implied by another clause are dropped
+        self.assertEqual(self.get_actor_query("name=Willis&name=Willis|name=Willis&age=61|movie=Die&name=Willis"),
+                         self.get_actor_query("name=Willis"))
+        self.assertEqual(len(self.get_actor_query("name=Willis|name=Faye")), 2)
+        self.assertEqual(len(self.get_movie_query("box_office=140")), Movie.query.filter(
+            Movie.box_office.between(140 - 5000, 140 + 5000)).count())
+
+        plan = planner.plan(Actor, [{"movies": "Die Hard,Sunset", "age": "61", "foo": "bar"}, {"age": "61"}])
+        self.assertEqual(plan.describe(), [["age = 61"]])
+        plan = planner.plan(Actor, [{"movies": "Die Hard,Sunset"}, {"name": "Faye"}])
+        self.assertEqual(len(plan.clauses), 2)
+        self.assertIn("INTERSECT", plan.sql)
+        self.assertIn("UNION", plan.sql)
+        # the SQL is compiled once for each shape of query
+        self.assertTrue(planner.plan(Actor, [{"movies": "Pulp Fiction,Armageddon"}, {"name": "Will"}]).cached)
+        self.assertIsNone(planner.plan(Actor, [{"foo": "bar"}]).filter)
+        self.assertRaises(ValueError, planner.plan, Actor, [{"age": "old"}])
+
+    def test_explain(self):
+        explain = json.loads(self.app.get("/api/actors?movies=Die Hard,Sunset&explain=1").data)
+        self.assertEqual(explain["plan"], [["movie contains 'Die Hard' (edge INTERSECT, search index)",
+                                            "movie contains 'Sunset' (edge INTERSECT, search index)"]])
+        self.assertEqual(explain["count"], len(self.get_actor_query("movies=Die Hard,Sunset")))
+        self.assertTrue(any("movie_search" in step for step in explain["query_plan"]))
+        # the query explained is the one of the page
+        self.assertIn("ORDER BY", explain["sql"])
+        self.assertIn("LIMIT", explain["sql"])
+        self.assertEqual(json.loads(self.app.get("/api/actors?movies=Die Hard&limit=1&explain=1").data)["count"], 1)
+        self.assertGreaterEqual(explain["time_ms"], 0)
+        # the SQL of the same query comes from the plan cache the second time
+        self.assertTrue(json.loads(self.app.get("/api/actors?movies=Die Hard,Sunset&explain=1").data)["cached"])
+
+    def test_fields(self):
+        actors = self.get_actor_query("name=Willis&fields=name,age")
+        self.assertEqual(actors, [{"name": "Bruce Willis", "age": 61}])
+
+    def test_query_count(self):
+        statements = []
+
+        def count(*_):
+            statements.append(1)
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            # the actors, their edges and their movies
+            self.assertEqual(len(json.loads(self.app.get("/api/actors").data)), 23)
+            self.assertLessEqual(len(statements), 3)
+            del statements[:]
+            self.assertEqual(len(json.loads(self.app.get("/api/movies/Die_Hard").data).get("actors")), 4)
+            self.assertLessEqual(len(statements), 3)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+    def test_etag(self):
+        url = "/api/actors/Faye_Dunaway"
+        response = self.app.get(url)
+        etag = response.headers.get("ETag")
+        self.assertIsNotNone(etag)
+        self.assertEqual(self.app.get(url, headers={"If-None-Match": etag}).status_code, 304)
+        self.assertEqual(self.app.get("/api/actors/faye_dunaway").headers.get("ETag"), etag)
+
+        self.app.put(url, data='{"age": 23}', content_type='application/json')
+        response = self.app.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data).get("age"), 23)
+
+        # the order of the arguments does not matter
+        response_cache.clear()
+        self.app.get("/api/actors?age=61&fields=name|name=Faye Dunaway")
+        self.app.get("/api/actors?name=Faye Dunaway|fields=name&age=61")
+        self.assertEqual(response_cache.cache.get_stats()["size"], 1)
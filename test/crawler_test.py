@@ -0,0 +1,575 @@
+from unittest import TestCase
+from datetime import datetime
+from scrapy.exceptions import IgnoreRequest
+from scrapy.core.downloader import Slot
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+from database import db_session, init_db, Base, engine
+from model.graph import Graph, Actor
+from model.crawler.cache import CompressedCacheStorage
+from model.crawler.dupefilter import BloomDupeFilter, ScalableBloomFilter
+from model.crawler import Spider, ActorItem, MovieItem
+from model.crawler.extractor import ROOT, SoupExtractor, LxmlExtractor, extract_page, get_fingerprint
+from model.crawler.pipeline import GraphPipeline
+from model.crawler.middleware import PageStoreMiddleware, AdaptiveThrottleMiddleware
+from model.crawler.store import PageStore
+from model.crawler.url import canonicalize, is_red_link
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from unittest import mock
+from types import SimpleNamespace
+import os
+import tempfile
+import time
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "fixtures")
+
+
+def read_fixture(filename):
+    """
+    Read a saved wikipedia page
+    :param filename: name of the file in the fixture directory
+    :return: the html of the page
+    """
+    with open(os.path.join(FIXTURE_DIR, filename), encoding="utf-8") as file:
+        return file.read()
+
+
+class TestExtractor(TestCase):
+    def setUp(self):
+        init_db()
+        self.soup = SoupExtractor()
+        self.lxml = LxmlExtractor()
+
+    def tearDown(self):
+        Base.metadata.drop_all(bind=engine)
+        db_session.remove()
+
+    def extract(self, method, url, filename):
+        """
+        Extract the page with both extractors, and check they agree
+        :return: the extracted data
+        """
+        text = read_fixture(filename)
+        expected = getattr(self.soup, method)(url, text)
+        self.assertEqual(getattr(self.lxml, method)(url, text), expected)
+        return expected
+
+    def test_actor(self):
+        actor = self.extract("extract_actor", ROOT + "/wiki/Bruce_Willis", "actor.html")
+        self.assertEqual(actor["name"], "Bruce Willis")
+        self.assertEqual(actor["wiki_page"], "/wiki/Bruce_Willis")
+        self.assertEqual(actor["age"], 63)
+        self.assertEqual(actor["movies"], ["/wiki/Die_Hard", "/wiki/Pulp_Fiction", "/wiki/The_Sixth_Sense"])
+        self.assertEqual(actor["filmographies"], ["/wiki/Bruce_Willis_filmography"])
+
+    def test_dead_actor(self):
+        actor = self.extract("extract_actor", ROOT + "/wiki/Humphrey_Bogart", "actor_dead.html")
+        self.assertEqual(actor["age"], 57)
+        # the section stops at the subsection after the film subsection
+        self.assertEqual(actor["movies"], ["/wiki/Swifty_(play)", "/wiki/The_Maltese_Falcon_(1941_film)",
+                                           "/wiki/Casablanca_(film)"])
+        self.assertEqual(actor["filmographies"], ["/wiki/Humphrey_Bogart_filmography"])
+
+    def test_movie(self):
+        movie = self.extract("extract_movie", ROOT + "/wiki/Die_Hard", "movie.html")
+        self.assertEqual(movie["name"], "Die Hard")
+        self.assertEqual(movie["box_office"], 140.8e6)
+        self.assertEqual(movie["actors"], ["/wiki/Bruce_Willis", "/wiki/Alan_Rickman",
+                                           "/wiki/Alexander_Godunov", "/wiki/Bonnie_Bedelia"])
+        self.assertEqual(movie["release_date"], datetime(1988, 7, 15))
+
+    def test_filmography(self):
+        urls = self.extract("extract_filmography", ROOT + "/wiki/Bruce_Willis_filmography", "filmography.html")
+        self.assertIn("/wiki/Die_Hard_2", urls)
+
+    def test_missing_info(self):
+        # a page without info box or filmography
+        text = read_fixture("filmography.html")
+        for extractor in (self.soup, self.lxml):
+            movie = extractor.extract_movie(ROOT + "/wiki/X", text)
+            self.assertEqual((movie["box_office"], movie["actors"], movie["release_date"]), (None, [], None))
+            self.assertRaises(AttributeError, extractor.extract_actor, ROOT + "/wiki/X", text)
+
+    def test_extract_page(self):
+        text = read_fixture("movie.html")
+        with ProcessPoolExecutor(1) as pool:
+            movie = pool.submit(extract_page, "lxml", "movie", ROOT + "/wiki/Die_Hard", text).result()
+            actor = pool.submit(extract_page, "lxml", "actor", ROOT + "/wiki/Die_Hard", text).result()
+        self.assertEqual(movie, self.soup.extract_movie(ROOT + "/wiki/Die_Hard", text))
+        # the page cannot be parsed as an actor
+        self.assertIsNone(actor)
+
+    def test_spider(self):
+        spider = Spider.from_crawler(get_crawler(Spider))
+        url = ROOT + "/wiki/Die_Hard"
+        response = HtmlResponse(url, body=read_fixture("movie.html").encode("utf-8"), encoding="utf-8",
+                                request=Request(url, meta={"is_movie": True, "is_filmography": False}))
+        results = list(spider.parse(response))
+        self.assertIsInstance(results[0], MovieItem)
+        self.assertEqual(results[0]["wiki_page"], "/wiki/Die_Hard")
+        self.assertEqual([request.url for request in results[1:]][0], ROOT + "/wiki/Bruce_Willis")
+        self.assertFalse(any(isinstance(result, ActorItem) for result in results))
+
+        # the data extracted by the ParseMiddleware is used as it is
+        data = self.lxml.extract_movie(url, read_fixture("movie.html"))
+        data["actors"] = ["/wiki/Alan_Rickman"]
+        response = HtmlResponse(url, body=b"", request=Request(url, meta={"is_movie": True, "extracted": data}))
+        results = list(spider.parse(response))
+        self.assertEqual([request.url for request in results[1:]], [ROOT + "/wiki/Alan_Rickman"])
+        self.assertEqual(results[1].meta, {"is_movie": False, "is_filmography": False})
+
+        response = HtmlResponse(url, body=b"", request=Request(url, meta={"is_movie": True, "extracted": None}))
+        self.assertEqual(list(spider.parse(response)), [{}])
+
+
+class TestUrl(TestCase):
+    def test_canonicalize(self):
+        self.assertEqual(canonicalize("/wiki/Die_Hard#Plot"), "/wiki/Die_Hard")
+        self.assertEqual(canonicalize("https://en.wikipedia.org/wiki/die hard"), "/wiki/Die_hard")
+        self.assertEqual(canonicalize("//en.wikipedia.org/wiki/Am%C3%A9lie"), "/wiki/Am%C3%A9lie")
+        self.assertEqual(canonicalize("/wiki/Ocean's_Eleven"), "/wiki/Ocean%27s_Eleven")
+        self.assertEqual(canonicalize("/wiki/Star_Wars:_The_Last_Jedi"), "/wiki/Star_Wars:_The_Last_Jedi")
+        self.assertEqual(canonicalize("/w/index.php?title=Jane_Doe&action=edit&redlink=1"), "/wiki/Jane_Doe")
+        self.assertTrue(is_red_link("/w/index.php?title=Jane_Doe&action=edit&redlink=1"))
+        self.assertFalse(is_red_link("/wiki/Jane_Doe"))
+        for url in ("#cite_note-1", "/wiki/File:Die_Hard.jpg", "/wiki/Help:IPA", "/wiki/Talk:Die_Hard",
+                    "/wiki/Wikipedia_talk:Films", "/w/index.php?title=Die_Hard&action=history",
+                    "/w/index.php?title=Die_Hard&oldid=1", "https://www.imdb.com/title/tt0095016/", "/wiki/"):
+            self.assertIsNone(canonicalize(url), url)
+
+    def test_spider(self):
+        init_db()
+        spider = Spider.from_crawler(get_crawler(Spider))
+        graph = Graph(db_session)
+        graph.add(ActorItem(name="Bruce Willis", wiki_page="/wiki/Bruce_Willis", aliases=["/wiki/Walter_Willis"]))
+
+        # the page is reached through a redirect, and its links go through the known redirects
+        url = ROOT + "/wiki/Die_Hard_(film)"
+        text = read_fixture("movie.html") \
+            .replace("</head>", '<link rel="canonical" href="https://en.wikipedia.org/wiki/Die_Hard"/></head>') \
+            .replace("/wiki/Bruce_Willis", "/wiki/Walter_Willis") \
+            .replace("/wiki/Alan_Rickman", "/w/index.php?title=Alan_Rickman&amp;action=edit&amp;redlink=1") \
+            .replace("/wiki/Bonnie_Bedelia", "/wiki/File:Bonnie_Bedelia.jpg")
+        response = HtmlResponse(url, body=text.encode("utf-8"),
+                                request=Request(url, meta={"is_movie": True, "is_filmography": False}))
+        results = list(spider.parse(response))
+        self.assertEqual(results[0]["wiki_page"], "/wiki/Die_Hard")
+        self.assertEqual(results[0]["aliases"], ["/wiki/Die_Hard_(film)"])
+        self.assertEqual(results[0]["actors"], ["/wiki/Bruce_Willis", "/wiki/Alan_Rickman", "/wiki/Alexander_Godunov"])
+        # red links are not requested
+        self.assertEqual([request.url for request in results[1:]],
+                         [ROOT + "/wiki/Bruce_Willis", ROOT + "/wiki/Alexander_Godunov"])
+        stats = spider.crawler.stats
+        self.assertEqual((stats.get_value("url/filtered"), stats.get_value("url/aliased")), (2, 1))
+
+        # filmography pages only lead to articles, whose redirects are looked up at once
+        url = ROOT + "/wiki/Bruce_Willis_filmography"
+        response = HtmlResponse(url, body=read_fixture("filmography.html").encode("utf-8"),
+                                request=Request(url, meta={"is_movie": False, "is_filmography": True}))
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            self.assertEqual([request.url for request in spider.parse(response)],
+                             [ROOT + "/wiki/Die_Hard", ROOT + "/wiki/Die_Hard_2"])
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+        # (along with the box offices of the movies, for their priority)
+        self.assertEqual(len(statements), 1)
+        Base.metadata.drop_all(bind=engine)
+        db_session.remove()
+
+    def test_priority(self):
+        init_db()
+        spider = Spider.from_crawler(get_crawler(Spider))
+        graph = Graph(db_session)
+        graph.add(MovieItem(name="Sin City", wiki_page="/wiki/Sin_City_(film)", box_office=158.8e6,
+                            actors=["/wiki/Bruce_Willis"]))
+
+        url = ROOT + "/wiki/Die_Hard"
+        response = HtmlResponse(url, body=read_fixture("movie.html").encode("utf-8"),
+                                request=Request(url, meta={"is_movie": True, "is_filmography": False}))
+        priorities = {request.url[len(ROOT):]: request.priority for request in list(spider.parse(response))[1:]}
+        # $140.8 million is two orders of magnitude, and the actors already in the graph come first
+        self.assertEqual(priorities["/wiki/Alan_Rickman"], 1 + 2)
+        self.assertEqual(priorities["/wiki/Bruce_Willis"], 1 + 2 + 1)
+
+        url = ROOT + "/wiki/Bruce_Willis"
+        text = read_fixture("actor.html").replace("/wiki/Pulp_Fiction", "/wiki/Sin_City_(film)")
+        response = HtmlResponse(url, body=text.encode("utf-8"),
+                                request=Request(url, meta={"is_movie": False, "is_filmography": False}))
+        priorities = {request.url[len(ROOT):]: request.priority for request in list(spider.parse(response))[:-1]}
+        # the movies come before the filmographies, and the movies with a known box office first
+        self.assertEqual(priorities, {"/wiki/Die_Hard": 2, "/wiki/Sin_City_(film)": 2 + 2, "/wiki/The_Sixth_Sense": 2,
+                                      "/wiki/Bruce_Willis_filmography": 0})
+        self.assertEqual(Spider.get_priority("movie", 5e5), 2)
+        self.assertEqual(Spider.get_priority("actor", 1e12, 10), 1 + 3 + 3)
+        Base.metadata.drop_all(bind=engine)
+        db_session.remove()
+
+
+class TestPageStore(TestCase):
+    def setUp(self):
+        init_db()
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = PageStore(self.directory.name)
+        self.stats = get_crawler(Spider).stats
+        self.spider = Spider.from_crawler(get_crawler(Spider))
+
+    def tearDown(self):
+        self.directory.cleanup()
+        Base.metadata.drop_all(bind=engine)
+        db_session.remove()
+
+    def test_store(self):
+        self.store.put(ROOT + "/wiki/Die_Hard#Plot", b"<html></html>")
+        self.store.put_redirect("/wiki/Die_Hard_(film)", ROOT + "/wiki/Die_Hard")
+        self.store.put("/wiki/" + "x" * 500, b"long")
+        self.assertEqual(self.store.get("/wiki/Die_Hard"), b"<html></html>")
+        self.assertEqual(self.store.get_redirect(ROOT + "/wiki/Die_Hard_(film)"), "/wiki/Die_Hard")
+        self.assertEqual(self.store.get(ROOT + "/wiki/" + "x" * 500), b"long")
+        self.assertIsNone(self.store.get("/wiki/Die_Hard_(film)"))
+        self.assertIsNone(self.store.get_redirect("/wiki/Die_Hard"))
+        self.assertEqual(len(self.store), 2)
+
+    def test_record_replay(self):
+        recorder = PageStoreMiddleware(self.store, "record", self.stats)
+        url = ROOT + "/wiki/Die_Hard"
+        body = read_fixture("movie.html").encode("utf-8")
+        # the page is reached through a redirect
+        request = Request(url, meta={"is_movie": True, "redirect_urls": [ROOT + "/wiki/Die_Hard_(film)"]})
+        response = HtmlResponse(url, body=body, encoding="utf-8", request=request)
+        self.assertIsNone(recorder.process_request(request, self.spider))
+        self.assertIs(recorder.process_response(request, response, self.spider), response)
+
+        player = PageStoreMiddleware(self.store, "replay", self.stats)
+        replayed = player.process_request(Request(url, meta={"is_movie": True}), self.spider)
+        self.assertEqual(replayed.body, body)
+        self.assertEqual(list(self.spider.parse(replayed))[0]["wiki_page"], "/wiki/Die_Hard")
+
+        redirect = player.process_request(Request(ROOT + "/wiki/Die_Hard_(film)"), self.spider)
+        self.assertEqual((redirect.status, redirect.headers["Location"]), (301, b"/wiki/Die_Hard"))
+        self.assertRaises(IgnoreRequest, player.process_request, Request(ROOT + "/wiki/Unknown"), self.spider)
+        self.assertEqual(self.stats.get_value("page_store/hit"), 1)
+        self.assertEqual(self.stats.get_value("page_store/miss"), 1)
+
+
+class TestHttpCache(TestCase):
+    def setUp(self):
+        init_db()
+        self.directory = tempfile.TemporaryDirectory()
+        self.spider = Spider.from_crawler(get_crawler(Spider))
+        self.storage = self.open_storage(0)
+
+    def tearDown(self):
+        self.storage.close_spider(self.spider)
+        self.directory.cleanup()
+        Base.metadata.drop_all(bind=engine)
+        db_session.remove()
+
+    def open_storage(self, max_size):
+        storage = CompressedCacheStorage(Settings({"HTTPCACHE_DIR": self.directory.name,
+                                                   "HTTPCACHE_MAX_SIZE": max_size}))
+        storage.open_spider(self.spider)
+        return storage
+
+    def store(self, path, body, storage=None):
+        url = ROOT + path
+        response = HtmlResponse(url, body=body, headers={"ETag": '"1"'}, encoding="utf-8")
+        (storage or self.storage).store_response(self.spider, Request(url), response)
+
+    def test_storage(self):
+        body = read_fixture("movie.html").encode("utf-8")
+        self.store("/wiki/Die_Hard", body)
+        # identical pages are stored once
+        self.store("/wiki/Die_Hard_(film)", body)
+        self.assertEqual(len(self.storage.index.execute("SELECT * FROM object").fetchall()), 1)
+        self.assertLess(self.storage.size, len(body))
+
+        response = self.storage.retrieve_response(self.spider, Request(ROOT + "/wiki/Die_Hard#Plot"))
+        self.assertIsInstance(response, HtmlResponse)
+        self.assertEqual((response.status, response.body), (200, body))
+        self.assertEqual(response.headers["ETag"], b'"1"')
+        self.assertIsNone(self.storage.retrieve_response(self.spider, Request(ROOT + "/wiki/Unknown")))
+
+        # replaced pages free their body
+        self.store("/wiki/Die_Hard", b"new")
+        self.store("/wiki/Die_Hard_(film)", b"new")
+        self.assertEqual(len(self.storage.index.execute("SELECT * FROM object").fetchall()), 1)
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(os.path.join(self.directory.name, "objects"))), 1)
+
+    def test_eviction(self):
+        self.storage.close_spider(self.spider)
+        self.storage = self.open_storage(1000)
+        for i in range(10):
+            self.store("/wiki/{}".format(i), os.urandom(300))
+            if i > 0:
+                # keep the first page in use
+                self.storage.retrieve_response(self.spider, Request(ROOT + "/wiki/0"))
+        self.assertLessEqual(self.storage.size, 1000)
+        urls = [row[0] for row in self.storage.index.execute("SELECT url FROM response")]
+        self.assertIn(ROOT + "/wiki/0", urls)
+        self.assertIn(ROOT + "/wiki/9", urls)
+        self.assertLess(len(urls), 4)
+        self.assertEqual(len(self.storage.index.execute("SELECT * FROM object").fetchall()), len(urls))
+
+    def test_unchanged_page(self):
+        graph = Graph(db_session)
+        graph.add(MovieItem(name="Die Hard", wiki_page="/wiki/Die_Hard", box_office=100, fingerprint="1",
+                            actors=["/wiki/Bruce_Willis", "/wiki/Alan_Rickman"]))
+        url = ROOT + "/wiki/Die_Hard"
+        response = HtmlResponse(url, body=b"", flags=["cached"],
+                                request=Request(url, meta={"is_movie": True, "is_filmography": False}))
+        results = list(self.spider.parse(response))
+        # the links are read from the graph, without parsing the page
+        self.assertEqual([request.url for request in results],
+                         [ROOT + "/wiki/Bruce_Willis", ROOT + "/wiki/Alan_Rickman"])
+        self.assertEqual(self.spider.crawler.stats.get_value("httpcache/unchanged"), 1)
+
+        # actor pages lead to the movies and filmographies they link to, crawled or not
+        graph.add(ActorItem(name="Bruce Willis", wiki_page="/wiki/Bruce_Willis", fingerprint="1",
+                            links={"movies": ["/wiki/Die_Hard", "/wiki/Armageddon_(1998_film)"],
+                                   "filmographies": ["/wiki/Bruce_Willis_filmography"]}))
+        url = ROOT + "/wiki/Bruce_Willis"
+        response = HtmlResponse(url, body=b"", flags=["cached"],
+                                request=Request(url, meta={"is_movie": False, "is_filmography": False}))
+        results = list(self.spider.parse(response))
+        self.assertEqual([(request.url, request.meta["is_filmography"]) for request in results],
+                         [(ROOT + "/wiki/Die_Hard", False), (ROOT + "/wiki/Armageddon_(1998_film)", False),
+                          (ROOT + "/wiki/Bruce_Willis_filmography", True)])
+
+        # the actors added with a movie were not built from their page, which is parsed
+        url = ROOT + "/wiki/Alan_Rickman"
+        response = HtmlResponse(url, body=read_fixture("actor.html").encode("utf-8"), flags=["cached"],
+                                request=Request(url, meta={"is_movie": False, "is_filmography": False}))
+        actor = list(self.spider.parse(response))[-1]
+        self.assertIsInstance(actor, ActorItem)
+        self.assertIsNotNone(actor["age"])
+        self.assertEqual(self.spider.crawler.stats.get_value("httpcache/unchanged"), 2)
+
+        # pages that are not in the graph are parsed
+        url = ROOT + "/wiki/Humphrey_Bogart"
+        response = HtmlResponse(url, body=read_fixture("actor_dead.html").encode("utf-8"), flags=["cached"],
+                                request=Request(url, meta={"is_movie": False, "is_filmography": False}))
+        self.assertIsInstance(list(self.spider.parse(response))[-1], ActorItem)
+
+    def test_fingerprint(self):
+        graph = Graph(db_session)
+        spider = self.spider
+        url = ROOT + "/wiki/Die_Hard"
+        text = read_fixture("movie.html")
+
+        def parse(page):
+            request = Request(url, meta={"is_movie": True, "is_filmography": False})
+            return list(spider.parse(HtmlResponse(url, body=page.encode("utf-8"), request=request)))
+
+        movie = parse(text)[0]
+        graph.add(movie)
+        # the fingerprint ignores the rest of the page and the comments in the content
+        page = text.replace("</h1>", "</h1><!-- rendered at 12:00 -->").replace("</title>", "</title><meta/>")
+        self.assertEqual(get_fingerprint(page), movie["fingerprint"])
+        results = parse(page)
+        self.assertEqual([request.url for request in results], [ROOT + path for path in movie["actors"]])
+        self.assertEqual(spider.crawler.stats.get_value("httpcache/unchanged"), 1)
+
+        # the page is only checked once, by the ParseMiddleware, then the spider
+        request = Request(url, meta={"is_movie": True, "is_filmography": False})
+        response = HtmlResponse(url, body=page.encode("utf-8"), request=request)
+        with mock.patch.object(spider.get_graph(), "find_node", wraps=spider.get_graph().find_node) as find_node:
+            node = spider.get_unchanged_node(response)
+            self.assertIsNotNone(node)
+            self.assertIs(spider.get_unchanged_node(response), node)
+            self.assertEqual(find_node.call_count, 1)
+
+        # changed pages are parsed again
+        results = parse(text.replace("$140.8 million", "$141 million"))
+        self.assertEqual(results[0]["box_office"], 141e6)
+        self.assertNotEqual(results[0]["fingerprint"], movie["fingerprint"])
+
+
+class TestPipeline(TestCase):
+    def setUp(self):
+        init_db()
+        self.pipeline = self.create_pipeline()
+
+    def tearDown(self):
+        Base.metadata.drop_all(bind=engine)
+
+    @staticmethod
+    def create_pipeline():
+        # (without opening the spider, which loads JSON_OUTPUT_FILE)
+        pipeline = GraphPipeline()
+        pipeline.graph = Graph(db_session, batch=True)
+        pipeline.pending = []
+        pipeline.start_time = pipeline.last_commit = time.time()
+        return pipeline
+
+    def test_failed_batch(self):
+        graph = self.pipeline.graph
+        add = graph.add
+
+        def add_or_fail(item):
+            if item["name"] == "bad":
+                # as a flush failing on a constraint, which discards the batch
+                graph.rollback()
+                raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+            return add(item)
+
+        with mock.patch.object(graph, "add", side_effect=add_or_fail):
+            for name in ("good", "bad", "other"):
+                self.pipeline.process_item(ActorItem(name=name, wiki_page="/wiki/" + name, age=1), None)
+            self.pipeline.commit()
+        # only the bad item is lost
+        self.assertEqual(sorted(actor.name for actor in Actor.query), ["good", "other"])
+        self.assertEqual(self.pipeline.failed_count, 1)
+
+        # a failing commit is retried one item at a time
+        self.pipeline.process_item(ActorItem(name="last", wiki_page="/wiki/last", age=1), None)
+        commit = db_session.commit
+        failures = [IntegrityError("COMMIT", {}, Exception("constraint failed"))]
+
+        def commit_or_fail():
+            if failures:
+                raise failures.pop()
+            commit()
+
+        with mock.patch.object(db_session, "commit", side_effect=commit_or_fail):
+            self.pipeline.commit()
+        db_session.rollback()
+        self.assertEqual(len(Actor.query.filter_by(name="last").all()), 1)
+        self.assertEqual(self.pipeline.pending, [])
+
+    def test_journal(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.pipeline.open_journal(directory.name)
+        self.pipeline.process_item(ActorItem(name="a", wiki_page="/wiki/a", age=1), None)
+        self.pipeline.process_item(MovieItem(name="x", wiki_page="/wiki/x", box_office=10, actors=["/wiki/a"],
+                                             release_date=datetime(2018, 3, 4)), None)
+        # the crawler is killed before the batch is committed
+        self.pipeline.journal.close()
+        db_session.rollback()
+        self.assertEqual(Actor.query.count(), 0)
+
+        resumed = self.create_pipeline()
+        resumed.open_journal(directory.name)
+        db_session.rollback()
+        movie = resumed.graph.get_movie("x")
+        self.assertEqual(movie.release_date, datetime(2018, 3, 4))
+        self.assertEqual([edge.actor.name for edge in movie.actors], ["a"])
+        self.assertEqual(resumed.graph.get_actor("a").age, 1)
+        # the journal is emptied once its items are committed
+        self.assertEqual(os.path.getsize(os.path.join(directory.name, "pending.jl")), 0)
+        resumed.journal.close()
+
+
+class TestDupeFilter(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        # (the settings of the Spider would override these)
+        self.crawler = get_crawler(settings_dict={"JOBDIR": self.directory.name, "BLOOM_CAPACITY": 100,
+                                                  "BLOOM_ERROR_RATE": 0.001})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_bloom_filter(self):
+        bloom = ScalableBloomFilter(100, 0.01)
+        keys = ["/wiki/Page_{}".format(i).encode("utf-8") for i in range(2000)]
+        # new keys can be reported as seen at the false positive rate
+        false_positives = sum(bloom.add(key) for key in keys)
+        self.assertLess(false_positives, 2000 * 0.01 * 2)
+        self.assertEqual(len(bloom), 2000 - false_positives)
+        # the filter grows by stages, and keys are never missed
+        self.assertGreater(len(bloom.stages), 1)
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum("/wiki/Other_{}".format(i).encode("utf-8") in bloom for i in range(10000))
+        self.assertLess(false_positives, 10000 * 0.01 * 2)
+
+    def test_persistence(self):
+        dupefilter = BloomDupeFilter.from_crawler(self.crawler)
+        requests = [Request(ROOT + "/wiki/Page_{}".format(i)) for i in range(300)]
+        self.assertFalse(any([dupefilter.request_seen(request) for request in requests]))
+        self.assertTrue(dupefilter.request_seen(Request(ROOT + "/wiki/Page_0")))
+        dupefilter.close("shutdown")
+
+        # the seen requests are loaded again when the crawl is resumed
+        resumed = BloomDupeFilter.from_crawler(self.crawler)
+        self.assertEqual(len(resumed.filter), 300)
+        self.assertTrue(all(resumed.request_seen(request) for request in requests))
+        self.assertFalse(resumed.request_seen(Request(ROOT + "/wiki/Page_300")))
+
+    def test_periodic_save(self):
+        crawler = get_crawler(settings_dict={"JOBDIR": self.directory.name, "BLOOM_CAPACITY": 100,
+                                             "BLOOM_ERROR_RATE": 0.001, "BLOOM_SAVE_INTERVAL": 100})
+        dupefilter = BloomDupeFilter.from_crawler(crawler)
+        for i in range(250):
+            dupefilter.request_seen(Request(ROOT + "/wiki/Page_{}".format(i)))
+        # a killed crawl (the filter is not closed) keeps the requests seen until the last save
+        resumed = BloomDupeFilter.from_crawler(crawler)
+        self.assertEqual(len(resumed.filter), 200)
+        self.assertTrue(resumed.request_seen(Request(ROOT + "/wiki/Page_199")))
+
+
+class TestThrottle(TestCase):
+    def setUp(self):
+        crawler = get_crawler(Spider)
+        self.slot = Slot(2, 0.25, False)
+        crawler.engine = SimpleNamespace(downloader=SimpleNamespace(slots={"en.wikipedia.org": self.slot}))
+        self.stats = crawler.stats
+        self.spider = Spider.from_crawler(crawler)
+        self.throttle = AdaptiveThrottleMiddleware(crawler, 0.05, 60, 4, 1.0)
+
+    def respond(self, status=200, latency=0.1, headers=None):
+        request = Request(ROOT + "/wiki/Die_Hard", meta={"download_slot": "en.wikipedia.org",
+                                                         "download_latency": latency})
+        response = Response(request.url, status=status, headers=headers, request=request)
+        self.assertIs(self.throttle.process_response(request, response, self.spider), response)
+
+    def test_speed_up(self):
+        # one more request once all the concurrent requests succeed
+        self.respond()
+        self.assertEqual(self.slot.concurrency, 2)
+        self.respond()
+        self.assertEqual((self.slot.concurrency, self.slot.delay), (3, 0.25 * 0.75))
+        for _ in range(20):
+            self.respond()
+        self.assertEqual((self.slot.concurrency, self.slot.delay), (4, 0.05))
+        self.assertEqual(self.stats.get_value("throttle/max_concurrency"), 4)
+
+        # slow responses take one request off
+        self.respond(latency=2)
+        self.assertEqual(self.slot.concurrency, 3)
+        self.assertEqual(self.stats.get_value("throttle/concurrency"), 3)
+
+    def test_back_off(self):
+        self.slot.concurrency = 4
+        self.respond(status=429, headers={"Retry-After": "10"})
+        self.assertEqual((self.slot.concurrency, self.slot.delay), (2, 10))
+        # the requests in flight do not back off again
+        self.respond(status=503)
+        self.assertEqual((self.slot.concurrency, self.slot.delay), (2, 10))
+        self.assertEqual(self.stats.get_value("throttle/backoff"), 1)
+        self.assertEqual(self.stats.get_value("throttle/retry_after"), 1)
+
+        self.throttle.backoff_times.clear()
+        self.respond(status=500)
+        self.assertEqual((self.slot.concurrency, self.slot.delay), (1, 20))
+        # the delay is capped
+        self.respond(status=503, headers={"Retry-After": "3600"})
+        self.assertEqual(self.slot.delay, 60)
+
+    def test_retry_after(self):
+        def get_retry_after(value):
+            return AdaptiveThrottleMiddleware.get_retry_after(Response(ROOT, headers={"Retry-After": value}))
+
+        self.assertEqual(get_retry_after("120"), 120)
+        self.assertEqual(get_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+        self.assertIsNone(get_retry_after("soon"))
+        self.assertIsNone(AdaptiveThrottleMiddleware.get_retry_after(Response(ROOT)))
@@ -1,14 +1,42 @@
 from database import db_session, init_db, Base, engine
 from unittest import TestCase
+from sqlalchemy import event
 from model.crawler import ActorItem, MovieItem
-from model.graph import Graph
+from model.graph import Graph, Actor, Movie, Edge
 from datetime import datetime
+import json
+import os
+import tempfile
 
 actor_item = ActorItem(name="a", wiki_page="b", age=10)
 movie_item = MovieItem(name="x", wiki_page="y", box_office=12345,
                        actors=["a", "b", "c"], release_date=datetime(2018, 3, 4))
 
 
+external_data = [
+    {
+        "a": {"name": "a", "age": 30, "total_gross": 100, "movies": ["x", "z"]},
+        "e": {"name": "e", "wiki_page": "https://en.wikipedia.org/wiki/E", "movies": ["w", "w"]},
+        "f": {"name": "f", "wiki_page": "/wiki/F", "age": 3},
+    },
+    [
+        {"name": "x", "box_office": 10, "year": 2000, "actors": ["a", "d", "d"]},
+        {"name": "w", "release_date": "2001-02-03", "actors": ["e"]},
+        {"name": "w", "box_office": 20},
+    ],
+]
+
+
+def get_snapshot():
+    """
+    Get the content of the database regardless of the ids
+    """
+    return (sorted(repr((actor.name, actor.age, actor.total_gross, actor.wiki_page)) for actor in Actor.query),
+            sorted(repr((movie.name, movie.box_office, movie.wiki_page, movie.release_date)) for movie in Movie.query),
+            sorted(repr((edge.movie.name, edge.movie.wiki_page, edge.actor.name, edge.actor.wiki_page, edge.income))
+                   for edge in Edge.query))
+
+
 class TestGraph(TestCase):
     def setUp(self):
         init_db()
@@ -23,4 +51,214 @@ class TestGraph(TestCase):
 
     def test_add(self):
         self.graph.add(actor_item)
-        self.assertEqual(self.graph.get_actor("a").wiki_page, actor_item.get("wiki_page"))
\ No newline at end of file
+        self.assertEqual(self.graph.get_actor("a").wiki_page, actor_item.get("wiki_page"))
+
+    def test_batch(self):
+        graph = Graph(db_session, batch=True)
+        graph.add(actor_item)
+        graph.add(movie_item)
+        # buffered changes are visible before they are committed
+        self.assertEqual(graph.get_actor("a").wiki_page, actor_item.get("wiki_page"))
+        self.assertEqual(len(graph.get_movie("x").actors), 3)
+
+        db_session.rollback()
+        self.assertIsNone(graph.get_actor("a"))
+
+        graph.add(actor_item)
+        graph.add(movie_item)
+        graph.commit()
+        db_session.rollback()
+        self.assertEqual(len(graph.get_movie("x").actors), 3)
+        self.assertAlmostEqual(graph.get_actor("a").total_gross, 12345 / 3)
+
+    def test_lookup_cache(self):
+        self.graph.add(movie_item)
+        self.graph.add(actor_item)
+        stats = self.graph.get_cache_stats()["actor"]
+        self.assertGreaterEqual(stats["hits"], 1)
+
+        # renaming the node updates the cache
+        actor = self.graph.find_node(Actor, wiki_page="b")
+        self.graph.add_actor({"name": "d", "wiki_page": "d"}, actor=actor)
+        self.assertIsNone(self.graph.find_node(Actor, wiki_page="b"))
+        self.assertEqual(self.graph.find_node(Actor, wiki_page="d").name, "d")
+
+        # deleting the node removes it from the cache
+        self.graph.delete_actor(self.graph.find_node(Actor, name="d"))
+        self.assertIsNone(self.graph.find_node(Actor, name="d"))
+        self.assertIsNone(self.graph.find_node(Actor, wiki_page="d"))
+
+    def test_lookup_cache_queries(self):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        graph = Graph(db_session, batch=True)
+        graph.add(actor_item)
+        event.listen(engine, "before_cursor_execute", count)
+        try:
+            # a hit finds the node in the session, without a query
+            self.assertEqual(graph.find_node(Actor, wiki_page="b").name, "a")
+            self.assertEqual(statements, [])
+
+            # once the commit has expired the node, it is loaded again with a single query
+            graph.commit()
+            del statements[:]
+            self.assertEqual(graph.find_node(Actor, wiki_page="b").name, "a")
+            self.assertEqual(len([statement for statement in statements if statement.startswith("SELECT")]), 1)
+        finally:
+            event.remove(engine, "before_cursor_execute", count)
+
+    def test_bulk_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "data.json")
+            with open(filename, "w") as file:
+                json.dump(external_data, file)
+
+            snapshots = []
+            for bulk in (False, True):
+                init_db()
+                # the loaded data is merged to existing nodes
+                self.graph.add(movie_item)
+                self.graph.add(actor_item)
+                Graph.load(filename, db_session, bulk=bulk)
+                snapshots.append(get_snapshot())
+                Base.metadata.drop_all(bind=engine)
+                # forget the nodes of the dropped tables
+                db_session.remove()
+
+        self.assertEqual(snapshots[0], snapshots[1])
+        self.assertEqual(len(snapshots[1][2]), 6)
+
+    def test_dump(self):
+        self.graph.add(movie_item)
+        self.graph.add(actor_item)
+        self.graph.add_movie({"name": "w", "release_date": "2001-02-03", "actors": ["e"]}, external=True)
+        snapshot = get_snapshot()
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "data.json")
+            self.graph.dump(filename)
+            # loading into the same graph changes nothing
+            Graph.load(filename, db_session)
+            self.assertEqual(get_snapshot(), snapshot)
+
+            Base.metadata.drop_all(bind=engine)
+            init_db()
+            Graph.load(filename, db_session)
+            self.assertEqual(get_snapshot(), snapshot)
+
+    def test_redirects(self):
+        # the movies link to the actor through a redirect before the actor page is crawled
+        self.graph.add(MovieItem(name="x", wiki_page="/wiki/X", box_office=100, actors=["/wiki/A_(actor)", "/wiki/B"]))
+        self.graph.add(MovieItem(name="y", wiki_page="/wiki/Y", box_office=60, actors=["/wiki/A"]))
+        self.graph.add(MovieItem(name="z", wiki_page="/wiki/Z", box_office=30, actors=["/wiki/A", "/wiki/A_(actor)"]))
+        self.graph.add(ActorItem(name="a", wiki_page="/wiki/A", age=40, aliases=["/wiki/A_(actor)"]))
+
+        self.assertEqual(self.graph.get_redirect("/wiki/A_(actor)"), "/wiki/A")
+        self.assertIsNone(self.graph.find_node(Actor, wiki_page="/wiki/A_(actor)"))
+        actor = self.graph.get_actor("a")
+        self.assertEqual(sorted(movie.name for movie in self.graph.get_movies_for_actor(name="a")), ["x", "y", "z"])
+        # the income of the duplicated edge from z is dropped
+        self.assertAlmostEqual(actor.total_gross, 100 * 2 / 3 + 60 + 30 * 2 / 3)
+        self.assertEqual(Edge.query.count(), 4)
+
+        # the article is moved, and the old page redirects to the new one
+        self.graph.add(ActorItem(name="a", wiki_page="/wiki/A_(actress)", aliases=["/wiki/A"]))
+        self.assertEqual(self.graph.get_redirect("/wiki/A_(actor)"), "/wiki/A_(actress)")
+        self.assertEqual(self.graph.get_redirects(["/wiki/A_(actor)", "/wiki/A", "/wiki/B"]),
+                         {"/wiki/A_(actor)": "/wiki/A_(actress)", "/wiki/A": "/wiki/A_(actress)"})
+        self.assertEqual(Actor.query.count(), 2)
+        self.assertEqual(len(self.graph.get_movies_for_actor(wiki_page="/wiki/A_(actress)")), 3)
+        self.assertAlmostEqual(self.graph.get_actor("a").total_gross, actor.total_gross)
+
+    def test_total_gross(self):
+        self.graph.add(MovieItem(name="x", wiki_page="/wiki/X", box_office=90, actors=["/wiki/A", "/wiki/B"]))
+        self.graph.add(MovieItem(name="y", wiki_page="/wiki/Y", box_office=30, actors=["/wiki/A"]))
+        actor = self.graph.find_node(Actor, wiki_page="/wiki/A")
+        self.assertAlmostEqual(actor.total_gross, 60 + 30)
+        self.assertEqual(self.graph.get_gross_drift(), [])
+
+        # deleting a movie takes its income off its actors
+        self.graph.delete_movie(self.graph.find_node(Movie, wiki_page="/wiki/X"))
+        self.assertAlmostEqual(actor.total_gross, 30)
+        self.assertAlmostEqual(self.graph.find_node(Actor, wiki_page="/wiki/B").total_gross, 0)
+        self.assertEqual(self.graph.get_gross_drift(), [])
+
+        # drift is reported, and fixed for the given actors only
+        engine.execute("UPDATE actor SET total_gross = total_gross + 5")
+        db_session.expire_all()
+        drift = self.graph.get_gross_drift()
+        self.assertEqual(sorted((total_gross, income) for _, total_gross, income in drift), [(5, 0), (35, 30)])
+        self.assertEqual(self.graph.recompute_total_gross([actor.id]), 1)
+        self.assertAlmostEqual(actor.total_gross, 30)
+        self.assertEqual(len(self.graph.get_gross_drift()), 1)
+        self.assertEqual(self.graph.recompute_total_gross(), 2)
+        self.assertEqual(self.graph.get_gross_drift(), [])
+
+    def test_top(self):
+        self.graph.add(MovieItem(name="x", wiki_page="/wiki/X", box_office=90, actors=["/wiki/A", "/wiki/B"],
+                                 release_date=datetime(2000, 1, 1)))
+        self.graph.add(MovieItem(name="y", wiki_page="/wiki/Y", box_office=30, actors=["/wiki/A"],
+                                 release_date=datetime(2001, 1, 1)))
+        self.graph.add(ActorItem(name="c", wiki_page="/wiki/C", age=80))
+        self.assertEqual([actor.wiki_page for actor in self.graph.get_actor_rank()], ["/wiki/A", "/wiki/B", "/wiki/C"])
+        self.assertEqual([actor.name for actor in self.graph.get_oldest_actors(1)], ["c"])
+        self.assertEqual([movie.name for movie in self.graph.get_top_movies()], ["x", "y"])
+        self.assertEqual([movie.name for movie in self.graph.get_top_movies(year=2001)], ["y"])
+        self.assertRaises(ValueError, self.graph.get_top_actors, "name")
+
+        # the leaderboards read the indexes instead of sorting
+        for query, index in (("SELECT id FROM actor ORDER BY total_gross DESC, id DESC LIMIT 10",
+                              "ix_actor_total_gross"),
+                             ("SELECT id FROM movie WHERE release_year = 2000 ORDER BY box_office DESC, id DESC "
+                              "LIMIT 10", "ix_movie_release_year_box_office")):
+            plan = str(engine.execute("EXPLAIN QUERY PLAN " + query).fetchall())
+            self.assertIn(index, plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_search(self):
+        self.graph.add(ActorItem(name="Bruce Willis", wiki_page="/wiki/Bruce_Willis"))
+        self.graph.add(ActorItem(name="Rumer Willis", wiki_page="/wiki/Rumer_Willis"))
+        self.graph.add(ActorItem(name="Willis Bruce", wiki_page="/wiki/Willis_Bruce"))
+        self.graph.add(MovieItem(name="Die Hard", wiki_page="/wiki/Die_Hard", box_office=1, actors=["/wiki/A"]))
+
+        def search(value):
+            return [actor.name for actor in self.graph.search(Actor, value)]
+
+        # the names starting with the string come first
+        self.assertEqual(search("willis"), ["Willis Bruce", "Bruce Willis", "Rumer Willis"])
+        self.assertEqual(search("Bru"), ["Bruce Willis", "Willis Bruce"])
+        self.assertEqual(search("wi"), ["Willis Bruce"])
+        self.assertEqual(search('"x'), [])
+        self.assertEqual([movie.name for movie in self.graph.search(Movie, "hard")], ["Die Hard"])
+
+        # the index follows the updates and deletes
+        self.graph.add(ActorItem(name="Walter Willis", wiki_page="/wiki/Bruce_Willis"))
+        self.graph.delete_actor(self.graph.find_node(Actor, wiki_page="/wiki/Rumer_Willis"))
+        self.assertEqual(search("willis"), ["Willis Bruce", "Walter Willis"])
+        self.assertEqual(search("bruce w"), [])
+
+        plan = str(engine.execute("EXPLAIN QUERY PLAN SELECT rowid FROM actor_search WHERE actor_search MATCH "
+                                  "'\"illi\"'").fetchall())
+        self.assertIn("VIRTUAL TABLE INDEX", plan)
+
+    def test_upgrade_db(self):
+        # database created before release_year and the indexes were added
+        Base.metadata.drop_all(bind=engine)
+        engine.execute("CREATE TABLE movie (id INTEGER PRIMARY KEY, name TEXT, wiki_page TEXT UNIQUE, "
+                       "box_office FLOAT, release_date DATETIME)")
+        engine.execute("INSERT INTO movie (name, release_date) VALUES ('x', '2018-03-04 00:00:00.000000')")
+        init_db()
+        self.assertEqual(self.graph.get_movies_by_year(2018)[0].name, "x")
+
+        for query, index in (("SELECT id FROM movie WHERE lower(name) = lower('x')", "ix_movie_name_lower"),
+                             ("SELECT id FROM movie WHERE release_year = 2018", "ix_movie_release_year"),
+                             ("SELECT movie_id FROM edge WHERE actor_id = 1", "ix_edge_actor_movie")):
+            plan = engine.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+            self.assertIn(index, str(plan))
+
+    def test_pragmas(self):
+        self.assertEqual(engine.execute("PRAGMA synchronous").scalar(), 1)  # NORMAL
+        self.assertEqual(engine.execute("PRAGMA temp_store").scalar(), 2)  # MEMORY